@@ -0,0 +1,114 @@
+"""Long-lived asyncio event loop shared by the Flask request handlers"""
+import asyncio
+import atexit
+import concurrent.futures
+import queue
+import threading
+
+
+class AsyncRuntime:
+    """Runs one event loop on a daemon thread for the life of the process.
+
+    Handlers submit coroutines with ``run`` instead of creating a loop per
+    request, so every in-flight STT/LLM/TTS call is multiplexed on the same
+    loop and loop-bound state (such as HTTP connection pools) is reused.
+    Blocking work inside a coroutine belongs in ``asyncio.to_thread`` so it
+    doesn't stall the other calls.
+    """
+
+    def __init__(self, name="async-runtime"):
+        self.loop = asyncio.new_event_loop()
+        self._lock = threading.Lock()
+        self._closed = False
+        self._stats = {"submitted": 0, "completed": 0, "failed": 0, "timeouts": 0, "in_flight": 0, "max_in_flight": 0}
+        self._thread = threading.Thread(target=self._run, name=name, daemon=True)
+        self._thread.start()
+        atexit.register(self.close)
+
+    def _run(self):
+        asyncio.set_event_loop(self.loop)
+        self.loop.run_forever()
+
+    def submit(self, coro):
+        """Schedule ``coro`` on the loop, returning a concurrent.futures.Future"""
+        if self._closed:
+            coro.close()
+            raise RuntimeError("Async runtime is closed")
+        future = asyncio.run_coroutine_threadsafe(coro, self.loop)
+        with self._lock:
+            self._stats["submitted"] += 1
+            self._stats["in_flight"] += 1
+            self._stats["max_in_flight"] = max(self._stats["max_in_flight"], self._stats["in_flight"])
+        future.add_done_callback(self._done)
+        return future
+
+    def run(self, coro, timeout=None):
+        """Run ``coro`` on the loop and block the calling thread for its result.
+
+        On timeout the coroutine is cancelled and TimeoutError raised.
+        """
+        future = self.submit(coro)
+        try:
+            return future.result(timeout)
+        except concurrent.futures.TimeoutError:
+            future.cancel()
+            with self._lock:
+                self._stats["timeouts"] += 1
+            raise
+
+    def iterate(self, agen):
+        """Drive async generator ``agen`` on the loop, yielding its items here.
+
+        Meant for streaming responses: closing the returned generator (e.g.
+        the client disconnected) cancels ``agen``. Errors are re-raised here.
+        """
+        items = queue.Queue()
+        end = object()
+
+        async def pump():
+            try:
+                async for item in agen:
+                    items.put(item)
+            finally:
+                items.put(end)
+
+        future = self.submit(pump())
+        try:
+            while True:
+                item = items.get()
+                if item is end:
+                    break
+                yield item
+            future.result()
+        finally:
+            future.cancel()
+
+    def _done(self, future):
+        with self._lock:
+            self._stats["in_flight"] -= 1
+            if future.cancelled() or future.exception() is not None:
+                self._stats["failed"] += 1
+            else:
+                self._stats["completed"] += 1
+
+    def close(self):
+        """Stop the loop after cancelling whatever is still running"""
+        if self._closed:
+            return
+        self._closed = True
+
+        async def shutdown():
+            tasks = [t for t in asyncio.all_tasks() if t is not asyncio.current_task()]
+            for task in tasks:
+                task.cancel()
+            await asyncio.gather(*tasks, return_exceptions=True)
+            await self.loop.shutdown_default_executor()
+
+        asyncio.run_coroutine_threadsafe(shutdown(), self.loop).result()
+        self.loop.call_soon_threadsafe(self.loop.stop)
+        self._thread.join()
+        self.loop.close()
+
+    def get_stats(self):
+        with self._lock:
+            return dict(self._stats)
@@ -0,0 +1,152 @@
+"""Micro-benchmarks for database hot paths.
+
+Usage:
+    python benchmarks.py user-search [--users 100000]
+    python benchmarks.py shard-writes [--threads 8] [--writes 500]
+    python benchmarks.py search [--users 1000] [--messages 200]
+"""
+import argparse
+import os
+import random
+import string
+import sys
+import tempfile
+import threading
+import time
+
+from database import Database
+from sharding import ShardedDatabase
+
+
+def _timed(fn, repeat):
+    """Median wall time of ``fn`` in milliseconds"""
+    samples = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        fn()
+        samples.append((time.perf_counter() - start) * 1000)
+    samples.sort()
+    return samples[len(samples) // 2]
+
+
+def _fresh_database(name):
+    return Database(os.path.join(tempfile.mkdtemp(), name))
+
+
+def bench_user_search(users=100000, repeat=20):
+    """Trigram/prefix user search vs the old LIKE '%q%' scan"""
+    rng = random.Random(42)
+    first_names = ['alice', 'bob', 'carol', 'dave', 'erin', 'frank', 'grace', 'heidi', 'ivan', 'judy']
+    domains = ['gmail.com', 'yahoo.com', 'outlook.com', 'example.org']
+
+    db = _fresh_database('bench_users.db')
+    start = time.perf_counter()
+    with db.transaction():
+        for i in range(users):
+            first = rng.choice(first_names)
+            last = ''.join(rng.choice(string.ascii_lowercase) for _ in range(7))
+            db.add_user(f'user{i}', f'{first}.{last}{i}@{rng.choice(domains)}', f'{first.title()} {last.title()}')
+    print(f"Seeded {users} users in {time.perf_counter() - start:.1f}s")
+
+    def old_email_search(query):
+        with db.read() as cursor:
+            cursor.execute('SELECT id, email, name, picture FROM users WHERE email LIKE ? ORDER BY email',
+                           (f'%{query}%',))
+            return cursor.fetchall()
+
+    queries = ['4242@', 'alice.q', f'{users - 1}@', 'zzzzzz', 'gm']
+    print(f"{'query':<14}{'LIKE scan ms':>14}{'indexed ms':>12}{'hits':>7}")
+    for query in queries:
+        old_ms = _timed(lambda: old_email_search(query), repeat)
+        new_ms = _timed(lambda: db.search_users_by_email(query), repeat)
+        hits = len(db.search_users_by_email(query))
+        print(f"{query:<14}{old_ms:>14.2f}{new_ms:>12.2f}{hits:>7}")
+    db.close()
+
+
+def bench_shard_writes(threads=8, writes=500, shard_counts=(1, 2, 4, 8)):
+    """Concurrent chat inserts from many users, single file vs N shards"""
+    def run(db):
+        def worker(n):
+            for i in range(writes):
+                db.add_chat_message(f'user{n}', 'session', f'message {i}', 'reply')
+        workers = [threading.Thread(target=worker, args=(n,)) for n in range(threads)]
+        start = time.perf_counter()
+        for worker_thread in workers:
+            worker_thread.start()
+        for worker_thread in workers:
+            worker_thread.join()
+        return threads * writes / (time.perf_counter() - start)
+
+    print(f"{'layout':<12}{'writes/s':>12}")
+    db = _fresh_database('bench_single.db')
+    print(f"{'single':<12}{run(db):>12.0f}")
+    db.close()
+    for shard_count in shard_counts:
+        db = ShardedDatabase(tempfile.mkdtemp(), shard_count)
+        print(f"{f'{shard_count} shards':<12}{run(db):>12.0f}")
+        db.close()
+
+
+def bench_search(users=1000, messages=200, repeat=20):
+    """Per-user full-text search vs MATCH over every user's rows"""
+    rng = random.Random(42)
+    words = ['today', 'plan', 'gym', 'report', 'meeting', 'groceries', 'call', 'mom', 'read', 'book']
+
+    db = _fresh_database('bench_search.db')
+    start = time.perf_counter()
+    with db.transaction():
+        for i in range(users):
+            for j in range(messages):
+                text = ' '.join(rng.choice(words) for _ in range(8))
+                db.add_chat_message(f'user{i}', f'session{j // 20}', text, 'Sounds like a plan!')
+    print(f"Seeded {users * messages} chat messages in {time.perf_counter() - start:.1f}s")
+
+    def global_match(user_id, query):
+        with db.read() as cursor:
+            cursor.execute('''
+                SELECT c.id, bm25(chat_messages_fts) FROM chat_messages_fts f
+                JOIN chat_messages c ON c.id = f.rowid
+                WHERE chat_messages_fts MATCH ? AND c.user_id = ?
+                ORDER BY bm25(chat_messages_fts) LIMIT 20
+            ''', (query, user_id))
+            return cursor.fetchall()
+
+    print(f"{'query':<14}{'global ms':>12}{'per-user ms':>13}{'hits':>7}")
+    for query in ['plan', 'gym report', 'mom', 'zebra']:
+        match = '{user_message ai_response} : (' + ' '.join(f'"{term}"' for term in query.split()) + '*)'
+        old_ms = _timed(lambda: global_match('user7', match), repeat)
+        new_ms = _timed(lambda: db.search('user7', query, types=['chat']), repeat)
+        hits = len(db.search('user7', query, types=['chat'])['chat'])
+        print(f"{query:<14}{old_ms:>12.2f}{new_ms:>13.2f}{hits:>7}")
+    db.close()
+
+
+BENCHMARKS = {
+    'user-search': bench_user_search,
+    'shard-writes': bench_shard_writes,
+    'search': bench_search,
+}
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Run database micro-benchmarks")
+    parser.add_argument('benchmark', choices=sorted(BENCHMARKS))
+    parser.add_argument('--users', type=int, default=None, help="default 100000 (user-search), 1000 (search)")
+    parser.add_argument('--messages', type=int, default=200, help="chat messages per user (search)")
+    parser.add_argument('--repeat', type=int, default=20)
+    parser.add_argument('--threads', type=int, default=8)
+    parser.add_argument('--writes', type=int, default=500)
+    args = parser.parse_args(argv)
+
+    if args.benchmark == 'user-search':
+        bench_user_search(users=args.users or 100000, repeat=args.repeat)
+    elif args.benchmark == 'search':
+        bench_search(users=args.users or 1000, messages=args.messages, repeat=args.repeat)
+    elif args.benchmark == 'shard-writes':
+        bench_shard_writes(threads=args.threads, writes=args.writes)
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -1,512 +1,1675 @@
 import sqlite3
 import json
-from datetime import datetime
+import threading
+import queue
+import time
+import atexit
+import base64
+import re
+import urllib.parse
+from collections import deque
+from contextlib import contextmanager
+from datetime import datetime, date
 import os
+from migrations import apply_migrations, create_chat_archive
+from cache import LRUCache
 
-class Database:
-    def __init__(self, db_path="productivity_app.db"):
+
+# Keyset pagination
+DEFAULT_PAGE_SIZE = 50
+MAX_PAGE_SIZE = 200
+
+
+def encode_cursor(key):
+    """Encode a keyset position as an opaque URL-safe cursor"""
+    return base64.urlsafe_b64encode(json.dumps(list(key)).encode()).decode().rstrip('=')
+
+
+def decode_cursor(cursor, size=2):
+    """Decode a cursor from encode_cursor, raising ValueError if malformed"""
+    try:
+        padded = cursor + '=' * (-len(cursor) % 4)
+        key = json.loads(base64.urlsafe_b64decode(padded.encode()))
+    except Exception:
+        raise ValueError("Invalid cursor")
+    if not isinstance(key, list) or len(key) != size:
+        raise ValueError("Invalid cursor")
+    # Elements are bound as SQL parameters, so only plain strings and ints
+    if any(isinstance(value, bool) or not isinstance(value, (str, int)) for value in key):
+        raise ValueError("Invalid cursor")
+    return key
+
+
+def fts_query(text):
+    """Turn free text into a safe FTS5 query: quoted terms, prefix match on the last"""
+    terms = re.findall(r'\w+', text.lower())
+    if not terms:
+        return None
+    return ' '.join(f'"{term}"' for term in terms) + '*'
+
+
+def fts_phrase(text):
+    """Quote text as a single FTS5 phrase"""
+    return '"' + text.replace('"', '""') + '"'
+
+
+def like_prefix(text):
+    """LIKE pattern matching values that start with ``text`` (escape with '\\')"""
+    return text.replace('\\', '\\\\').replace('%', '\\%').replace('_', '\\_') + '%'
+
+
+def page_size(limit):
+    """Clamp a requested page size to 1..MAX_PAGE_SIZE"""
+    return max(1, min(int(limit), MAX_PAGE_SIZE))
+
+
+# Habit logs: one bitmap per habit, bit i set when the habit was done on
+# day ordinal start_day + i (start_day is kept a multiple of 8)
+HABIT_RECENT_DAYS = 7
+
+
+def bitmap_has(bitmap, start_day, day):
+    offset = day - start_day
+    if offset < 0 or offset >= len(bitmap) * 8:
+        return False
+    return bool(bitmap[offset // 8] & (1 << (offset % 8)))
+
+
+def bitmap_set(bitmap, start_day, day):
+    """Set ``day`` in ``bitmap`` (a bytearray), growing it either way; returns the new start_day"""
+    if day < start_day:
+        new_start = day - day % 8
+        bitmap[0:0] = bytes((start_day - new_start) // 8)
+        start_day = new_start
+    offset = day - start_day
+    if offset // 8 >= len(bitmap):
+        bitmap.extend(bytes(offset // 8 + 1 - len(bitmap)))
+    bitmap[offset // 8] |= 1 << (offset % 8)
+    return start_day
+
+
+def bitmap_streaks(bitmap, start_day, last_day):
+    """(current, longest) run of set days ending at ``last_day``, by full scan"""
+    run = longest = 0
+    for day in range(start_day, last_day + 1):
+        run = run + 1 if bitmap_has(bitmap, start_day, day) else 0
+        longest = max(longest, run)
+    return run, longest
+
+
+class ConnectionPool:
+    """Pool of long-lived SQLite connections, each configured once when opened.
+
+    A connection is checked out by one thread at a time and returned to the
+    idle list afterwards, so short-lived request threads reuse warm
+    connections instead of reopening the database file on every query.
+
+    ``read_only`` opens connections with ``mode=ro`` and ``query_only``.
+    ``max_connections`` caps how many are checked out at once; further
+    checkouts queue in arrival order, and the wait is recorded in the stats.
+    """
+
+    def __init__(self, db_path, max_idle=8, cache_size_kb=16384,
+                 mmap_size=64 * 1024 * 1024, busy_timeout_ms=5000, trace_callback=None,
+                 attach=None, read_only=False, max_connections=None):
         self.db_path = db_path
-        self.init_database()
-    
-    def init_database(self):
-        """Initialize database tables"""
-        conn = sqlite3.connect(self.db_path)
-        cursor = conn.cursor()
-        
-        # Chat messages table
-        cursor.execute('''
-            CREATE TABLE IF NOT EXISTS chat_messages (
-                id INTEGER PRIMARY KEY AUTOINCREMENT,
-                user_id TEXT NOT NULL,
-                session_id TEXT NOT NULL,
-                user_message TEXT NOT NULL,
-                ai_response TEXT NOT NULL,
-                timestamp DATETIME DEFAULT CURRENT_TIMESTAMP
-            )
-        ''')
-        
-        # Tasks table
-        cursor.execute('''
-            CREATE TABLE IF NOT EXISTS tasks (
-                id INTEGER PRIMARY KEY AUTOINCREMENT,
-                user_id TEXT NOT NULL,
-                title TEXT NOT NULL,
-                status TEXT DEFAULT 'pending',
-                priority TEXT DEFAULT 'medium',
-                created_at DATETIME DEFAULT CURRENT_TIMESTAMP
-            )
-        ''')
-        
-        # Goals table
-        cursor.execute('''
-            CREATE TABLE IF NOT EXISTS goals (
-                id INTEGER PRIMARY KEY AUTOINCREMENT,
-                user_id TEXT NOT NULL,
-                title TEXT NOT NULL,
-                progress INTEGER DEFAULT 0,
-                created_at DATETIME DEFAULT CURRENT_TIMESTAMP
-            )
-        ''')
-        
-        # Subgoals table
-        cursor.execute('''
-            CREATE TABLE IF NOT EXISTS subgoals (
-                id INTEGER PRIMARY KEY AUTOINCREMENT,
-                goal_id INTEGER NOT NULL,
-                title TEXT NOT NULL,
-                completed BOOLEAN DEFAULT 0,
-                credits INTEGER DEFAULT 1,
-                FOREIGN KEY (goal_id) REFERENCES goals (id)
-            )
-        ''')
-        
-        # Habits table
-        cursor.execute('''
-            CREATE TABLE IF NOT EXISTS habits (
-                id INTEGER PRIMARY KEY AUTOINCREMENT,
-                user_id TEXT NOT NULL,
-                name TEXT NOT NULL,
-                streak INTEGER DEFAULT 0,
-                frequency TEXT DEFAULT 'daily',
-                created_at DATETIME DEFAULT CURRENT_TIMESTAMP
-            )
-        ''')
-        
-        # Users table for friends system
-        cursor.execute('''
-            CREATE TABLE IF NOT EXISTS users (
-                id TEXT PRIMARY KEY,
-                email TEXT UNIQUE NOT NULL,
-                name TEXT NOT NULL,
-                picture TEXT,
-                created_at DATETIME DEFAULT CURRENT_TIMESTAMP
-            )
-        ''')
-        
-        # Friend requests table
-        cursor.execute('''
-            CREATE TABLE IF NOT EXISTS friend_requests (
-                id INTEGER PRIMARY KEY AUTOINCREMENT,
-                from_user_id TEXT NOT NULL,
-                to_user_id TEXT NOT NULL,
-                status TEXT DEFAULT 'pending',
-                created_at DATETIME DEFAULT CURRENT_TIMESTAMP,
-                FOREIGN KEY (from_user_id) REFERENCES users (id),
-                FOREIGN KEY (to_user_id) REFERENCES users (id)
-            )
-        ''')
-        
-        # Friends table
-        cursor.execute('''
-            CREATE TABLE IF NOT EXISTS friends (
-                id INTEGER PRIMARY KEY AUTOINCREMENT,
-                user1_id TEXT NOT NULL,
-                user2_id TEXT NOT NULL,
-                created_at DATETIME DEFAULT CURRENT_TIMESTAMP,
-                FOREIGN KEY (user1_id) REFERENCES users (id),
-                FOREIGN KEY (user2_id) REFERENCES users (id)
-            )
-        ''')
-        
-        # Messages table for friend messaging
-        cursor.execute('''
-            CREATE TABLE IF NOT EXISTS messages (
-                id INTEGER PRIMARY KEY AUTOINCREMENT,
-                from_user_id TEXT NOT NULL,
-                to_user_id TEXT NOT NULL,
-                message TEXT NOT NULL,
-                read_status BOOLEAN DEFAULT 0,
-                created_at DATETIME DEFAULT CURRENT_TIMESTAMP,
-                FOREIGN KEY (from_user_id) REFERENCES users (id),
-                FOREIGN KEY (to_user_id) REFERENCES users (id)
-            )
-        ''')
-        
-        conn.commit()
+        self.attach = dict(attach or {})  # schema name -> database file
+        self.read_only = read_only
+        self.max_connections = max_connections
+        self.max_idle = max_idle
+        self.cache_size_kb = cache_size_kb
+        self.mmap_size = mmap_size
+        self.busy_timeout_ms = busy_timeout_ms
+        self.trace_callback = trace_callback
+        self._idle = []
+        self._lock = threading.Lock()
+        self._released = threading.Condition(self._lock)
+        self._next_ticket = 0  # FIFO hand-off when max_connections is set
+        self._serving = 0
+        self._local = threading.local()
+        self._stats = {
+            "opened": 0,
+            "closed": 0,
+            "checkouts": 0,
+            "reused": 0,
+            "in_use": 0,
+            "peak_in_use": 0,
+            "waits": 0,
+            "waiting": 0,
+            "wait_ms_total": 0.0,
+            "wait_ms_max": 0.0,
+        }
+
+    def _open(self):
+        """Open a new connection and apply the per-connection PRAGMAs"""
+        conn = sqlite3.connect(
+            self._uri(self.db_path),
+            timeout=self.busy_timeout_ms / 1000,
+            check_same_thread=False,
+            uri=True,
+        )
+        if self.read_only:
+            for schema, path in self.attach.items():
+                conn.execute(f'ATTACH DATABASE ? AS {schema}', (self._uri(path),))
+            conn.execute('PRAGMA query_only=1')
+        else:
+            # auto_vacuum only takes effect on a new file (or at the next
+            # VACUUM) and has to precede the switch to WAL
+            conn.execute('PRAGMA auto_vacuum=INCREMENTAL')
+            conn.execute('PRAGMA journal_mode=WAL')
+            for schema, path in self.attach.items():
+                conn.execute(f'ATTACH DATABASE ? AS {schema}', (self._uri(path),))
+                conn.execute(f'PRAGMA {schema}.auto_vacuum=INCREMENTAL')
+                conn.execute(f'PRAGMA {schema}.journal_mode=WAL')
+        conn.execute('PRAGMA synchronous=NORMAL')
+        conn.execute(f'PRAGMA cache_size=-{int(self.cache_size_kb)}')
+        conn.execute(f'PRAGMA mmap_size={int(self.mmap_size)}')
+        conn.execute(f'PRAGMA busy_timeout={int(self.busy_timeout_ms)}')
+        conn.execute('PRAGMA temp_store=MEMORY')
+        if self.trace_callback:
+            conn.set_trace_callback(self.trace_callback)
+        return conn
+
+    def _uri(self, path):
+        uri = 'file:' + urllib.parse.quote(os.path.abspath(path))
+        return uri + '?mode=ro' if self.read_only else uri
+
+    def _checkout(self):
+        with self._lock:
+            if self.max_connections:
+                self._wait_turn()
+            self._stats["checkouts"] += 1
+            self._stats["in_use"] += 1
+            self._stats["peak_in_use"] = max(self._stats["peak_in_use"], self._stats["in_use"])
+            if self._idle:
+                self._stats["reused"] += 1
+                return self._idle.pop()
+            self._stats["opened"] += 1
+        return self._open()
+
+    def _wait_turn(self):
+        """Block (lock held) until this caller is next in line and a slot is free"""
+        ticket = self._next_ticket
+        self._next_ticket += 1
+        if ticket != self._serving or self._stats["in_use"] >= self.max_connections:
+            start = time.perf_counter()
+            self._stats["waits"] += 1
+            self._stats["waiting"] += 1
+            while ticket != self._serving or self._stats["in_use"] >= self.max_connections:
+                self._released.wait()
+            self._stats["waiting"] -= 1
+            wait_ms = (time.perf_counter() - start) * 1000
+            self._stats["wait_ms_total"] += wait_ms
+            self._stats["wait_ms_max"] = max(self._stats["wait_ms_max"], wait_ms)
+        self._serving += 1
+        self._released.notify_all()
+
+    def _checkin(self, conn):
+        if conn.in_transaction:
+            conn.rollback()
+        with self._lock:
+            self._stats["in_use"] -= 1
+            self._released.notify_all()
+            if len(self._idle) < self.max_idle:
+                self._idle.append(conn)
+                return
+            self._stats["closed"] += 1
         conn.close()
-    
+
+    def held(self):
+        """Connection the current thread has checked out, if any"""
+        return getattr(self._local, 'conn', None)
+
+    @contextmanager
+    def connection(self):
+        """Check out a connection for the current thread; nested calls share it"""
+        held = getattr(self._local, 'conn', None)
+        if held is not None:
+            yield held
+            return
+
+        conn = self._checkout()
+        self._local.conn = conn
+        try:
+            yield conn
+        finally:
+            self._local.conn = None
+            self._checkin(conn)
+
+    def close_all(self):
+        """Close every idle connection (checked-out ones close on return)"""
+        with self._lock:
+            idle, self._idle = self._idle, []
+            self._stats["closed"] += len(idle)
+        for conn in idle:
+            conn.close()
+
+    def get_stats(self):
+        """Snapshot of pool counters for monitoring"""
+        with self._lock:
+            stats = dict(self._stats)
+            stats["idle"] = len(self._idle)
+        stats["wait_ms_total"] = round(stats["wait_ms_total"], 2)
+        stats["wait_ms_max"] = round(stats["wait_ms_max"], 2)
+        stats["wait_ms_avg"] = round(stats["wait_ms_total"] / stats["waits"], 2) if stats["waits"] else 0.0
+        stats["reuse_ratio"] = round(stats["reused"] / stats["checkouts"], 4) if stats["checkouts"] else 0.0
+        return stats
+
+
+class WriteBehindError(RuntimeError):
+    """Raised by ``WriteBehindQueue.flush`` for queued writes that failed to commit"""
+
+    def __init__(self, errors):
+        super().__init__(f"{len(errors)} queued write(s) failed: {errors[0]}")
+        self.errors = errors
+
+
+class WriteBehindQueue:
+    """Dedicated writer thread that group-commits queued writes.
+
+    Producers enqueue callables taking a cursor; the writer drains up to
+    ``batch_size`` of them (waiting at most ``flush_interval`` seconds for a
+    batch to fill) and commits them in a single transaction, then calls each
+    write's ``on_commit`` hook with its result. When the queue
+    is full, producers block for up to ``put_timeout`` seconds and then fall
+    back to writing synchronously so nothing is dropped; writes submitted
+    after ``close`` are committed synchronously too. A write that fails
+    even on its own is counted in ``failed`` and re-raised to the next
+    ``flush`` caller as WriteBehindError.
+    """
+
+    _STOP = object()
+
+    def __init__(self, db, flush_interval=0.05, batch_size=100, max_queue=1000, put_timeout=1.0):
+        self.db = db
+        self.flush_interval = flush_interval
+        self.batch_size = batch_size
+        self.put_timeout = put_timeout
+        self._queue = queue.Queue(maxsize=max_queue)
+        self._closed = False
+        # Held while enqueuing so nothing lands behind close()'s final drain
+        self._submit_lock = threading.Lock()
+        self._lock = threading.Lock()
+        self._errors = deque(maxlen=100)  # failed writes not yet reported by flush()
+        self._stats = {
+            "enqueued": 0,
+            "committed": 0,
+            "failed": 0,
+            "batches": 0,
+            "largest_batch": 0,
+            "sync_fallbacks": 0,
+        }
+        self._thread = threading.Thread(target=self._run, name="db-write-behind", daemon=True)
+        self._thread.start()
+        atexit.register(self.close)
+
+    def submit(self, write, on_commit=None):
+        """Queue ``write(cursor)`` for the next group commit.
+
+        Once the queue is closed, the write is committed synchronously.
+        """
+        with self._submit_lock:
+            if not self._closed:
+                try:
+                    self._queue.put((write, on_commit), timeout=self.put_timeout)
+                    with self._lock:
+                        self._stats["enqueued"] += 1
+                    return
+                except queue.Full:
+                    pass
+        with self._lock:
+            self._stats["sync_fallbacks"] += 1
+        with self.db.transaction() as cursor:
+            result = write(cursor)
+        if on_commit is not None:
+            on_commit(result)
+
+    def flush(self, timeout=None):
+        """Block until everything queued so far has been committed.
+
+        Returns False on timeout. Raises WriteBehindError if any queued write
+        failed since the last flush.
+        """
+        marker = threading.Event()
+        with self._submit_lock:
+            closed = self._closed
+            if not closed:
+                self._queue.put(marker)
+        if not closed and not marker.wait(timeout):
+            return False
+        with self._lock:
+            errors = list(self._errors)
+            self._errors.clear()
+        if errors:
+            raise WriteBehindError(errors)
+        return True
+
+    def close(self):
+        """Stop the writer thread after committing everything queued"""
+        with self._submit_lock:
+            if self._closed:
+                return
+            self._closed = True
+        self._queue.put(self._STOP)
+        self._thread.join()
+        # Anything queued behind the stop marker before _closed was set
+        leftovers = []
+        while True:
+            try:
+                item = self._queue.get_nowait()
+            except queue.Empty:
+                break
+            if isinstance(item, threading.Event):
+                item.set()
+            elif item is not self._STOP:
+                leftovers.append(item)
+        self._commit(leftovers)
+
+    def get_stats(self):
+        with self._lock:
+            stats = dict(self._stats)
+            stats["unreported_errors"] = len(self._errors)
+        stats["queue_depth"] = self._queue.qsize()
+        return stats
+
+    def _run(self):
+        stopping = False
+        while not stopping:
+            try:
+                item = self._queue.get(timeout=self.flush_interval)
+            except queue.Empty:
+                continue
+
+            batch = []
+            markers = []
+            deadline = time.monotonic() + self.flush_interval
+            while item is not None:
+                if item is self._STOP:
+                    stopping = True
+                elif isinstance(item, threading.Event):
+                    markers.append(item)
+                else:
+                    batch.append(item)
+                item = self._next_item(stopping, bool(markers) or len(batch) >= self.batch_size, deadline)
+
+            self._commit(batch)
+            for marker in markers:
+                marker.set()
+
+    def _next_item(self, stopping, batch_ready, deadline):
+        """Next queued item for the current batch, or None to commit it now"""
+        try:
+            if stopping:
+                return self._queue.get_nowait()
+            remaining = deadline - time.monotonic()
+            if batch_ready or remaining <= 0:
+                return None
+            return self._queue.get(timeout=remaining)
+        except queue.Empty:
+            return None
+
+    def _commit(self, batch):
+        if not batch:
+            return
+        done = []  # (on_commit, result) for each committed write
+        try:
+            with self.db.transaction() as cursor:
+                results = [write(cursor) for write, _ in batch]
+            done = [(on_commit, result) for (_, on_commit), result in zip(batch, results)]
+            failed = 0
+        except Exception as e:
+            print(f"Write-behind batch of {len(batch)} failed, retrying individually: {e}")
+            failed = 0
+            for write, on_commit in batch:
+                try:
+                    with self.db.transaction() as cursor:
+                        done.append((on_commit, write(cursor)))
+                except Exception as write_error:
+                    failed += 1
+                    print(f"Write-behind write failed: {write_error}")
+                    with self._lock:
+                        self._errors.append(write_error)
+        committed = len(done)
+        for on_commit, result in done:
+            if on_commit is not None:
+                try:
+                    on_commit(result)
+                except Exception as e:
+                    print(f"Write-behind commit hook failed: {e}")
+        with self._lock:
+            self._stats["batches"] += 1
+            self._stats["committed"] += committed
+            self._stats["failed"] += failed
+            self._stats["largest_batch"] = max(self._stats["largest_batch"], len(batch))
+
+
+class RetentionWorker:
+    """Background thread that archives idle chat sessions and compacts the files.
+
+    Every ``interval`` seconds it moves sessions idle for more than
+    ``archive_after_days`` into the archive database, then runs an
+    incremental vacuum and records the bytes reclaimed.
+    """
+
+    def __init__(self, db, archive_after_days=90, interval=3600, batch_sessions=500):
+        self.db = db
+        self.archive_after_days = archive_after_days
+        self.interval = interval
+        self.batch_sessions = batch_sessions
+        self._stop = threading.Event()
+        self._lock = threading.Lock()
+        self._stats = {
+            "runs": 0,
+            "failures": 0,
+            "sessions_archived": 0,
+            "messages_archived": 0,
+            "bytes_reclaimed": 0,
+            "last_run": None,
+        }
+        self._thread = threading.Thread(target=self._run, name="db-retention", daemon=True)
+        self._thread.start()
+        atexit.register(self.close)
+
+    def run_once(self):
+        """Archive everything that is due, then compact; returns a report"""
+        start = time.perf_counter()
+        sessions = messages = 0
+        while True:
+            moved = self.db.archive_chat_sessions(self.archive_after_days, self.batch_sessions)
+            sessions += moved["sessions"]
+            messages += moved["messages"]
+            if moved["sessions"] < self.batch_sessions:
+                break
+        reclaimed = self.db.compact()
+        report = {
+            "sessions_archived": sessions,
+            "messages_archived": messages,
+            "bytes_reclaimed": sum(reclaimed.values()),
+            "duration_ms": round((time.perf_counter() - start) * 1000, 1),
+            "finished_at": datetime.now().isoformat(timespec='seconds'),
+        }
+        with self._lock:
+            self._stats["runs"] += 1
+            self._stats["sessions_archived"] += sessions
+            self._stats["messages_archived"] += messages
+            self._stats["bytes_reclaimed"] += report["bytes_reclaimed"]
+            self._stats["last_run"] = report
+        return report
+
+    def close(self):
+        self._stop.set()
+        self._thread.join()
+
+    def get_stats(self):
+        with self._lock:
+            stats = dict(self._stats)
+        stats["archive_after_days"] = self.archive_after_days
+        stats["interval"] = self.interval
+        return stats
+
+    def _run(self):
+        while not self._stop.wait(self.interval):
+            try:
+                report = self.run_once()
+                print(f"Chat retention: archived {report['sessions_archived']} sessions, "
+                      f"reclaimed {report['bytes_reclaimed']} bytes")
+            except Exception as e:
+                with self._lock:
+                    self._stats["failures"] += 1
+                print(f"Chat retention run failed: {e}")
+
+
+class Database:
+    def __init__(self, db_path="productivity_app.db", run_migrations=True,
+                 query_cache=True, cache_size=1024, cache_ttl=30.0, archive_path=None,
+                 friend_cache_size=4096, friend_cache_ttl=60.0, **pool_options):
+        self.db_path = db_path
+        # Cold chat history lives in a second file attached as "archive"
+        self.archive_path = archive_path
+        if archive_path:
+            pool_options.setdefault('attach', {})['archive'] = archive_path
+        # All writes share one connection, taken in turn; reads go to a pool
+        # of read-only connections that WAL lets run alongside the writer
+        self.writer = ConnectionPool(db_path, **dict(pool_options, max_idle=1, max_connections=1))
+        self.readers = ConnectionPool(db_path, read_only=True, **pool_options)
+        self._tx = threading.local()
+        self.write_behind = None
+        self.retention = None
+        self.events = None
+        # Friend lists by user id. Writes invalidate only this process's
+        # copy, so the TTL bounds staleness across worker processes
+        self.friend_graph = LRUCache(friend_cache_size, friend_cache_ttl)
+        # Read-through cache of full task/goal/habit/subgoal lists, keyed
+        # by (entity, owner id); pass query_cache=False to disable
+        self.query_cache = LRUCache(cache_size, cache_ttl, enabled=query_cache)
+        self.init_database(run_migrations)
+
+    @contextmanager
+    def transaction(self, immediate=False):
+        """Yield a cursor inside a transaction, committing on success.
+
+        Nested calls on the same thread join the outer transaction, which
+        commits or rolls back as a whole. ``immediate`` takes the write lock
+        up front (BEGIN IMMEDIATE), so a read-modify-write can't interleave
+        with another process's writes.
+        """
+        with self.writer.connection() as conn:
+            depth = getattr(self._tx, 'depth', 0)
+            self._tx.depth = depth + 1
+            cursor = conn.cursor()
+            try:
+                if immediate and not conn.in_transaction:
+                    cursor.execute('BEGIN IMMEDIATE')
+                yield cursor
+                if depth == 0:
+                    conn.commit()
+            except Exception:
+                if depth == 0:
+                    conn.rollback()
+                raise
+            finally:
+                cursor.close()
+                self._tx.depth = depth
+
+    @contextmanager
+    def read(self):
+        """Yield a cursor for read-only queries.
+
+        Runs on a reader connection, or on the writer when called inside a
+        transaction so it sees that transaction's uncommitted changes.
+        """
+        pool = self.writer if self.writer.held() is not None else self.readers
+        with pool.connection() as conn:
+            cursor = conn.cursor()
+            try:
+                yield cursor
+            finally:
+                cursor.close()
+
+    def enable_retention(self, **options):
+        """Start the background chat archival and incremental vacuum thread"""
+        if self.retention is None:
+            self.retention = RetentionWorker(self, **options)
+        return self.retention
+
+    def enable_events(self, bus):
+        """Publish message and friend request events on ``bus`` after they commit"""
+        self.events = bus
+        return bus
+
+    def _publish(self, user_id, event_type, data):
+        if self.events is not None:
+            self.events.publish(user_id, event_type, data)
+
+    def enable_write_behind(self, **options):
+        """Route chat and friend message inserts through a group-commit queue"""
+        if self.write_behind is None:
+            self.write_behind = WriteBehindQueue(self, **options)
+        return self.write_behind
+
+    def flush_writes(self, timeout=None):
+        """Wait for queued write-behind inserts to be committed"""
+        if self.write_behind is None:
+            return True
+        return self.write_behind.flush(timeout)
+
+    def _deferred_write(self, write, on_commit=None):
+        """Run ``write(cursor)`` now, or queue it when write-behind is enabled.
+
+        ``on_commit(result)`` runs once the write has committed. Returns the
+        write's result when run synchronously, else None.
+        """
+        if self.write_behind is not None:
+            self.write_behind.submit(write, on_commit)
+            return None
+        with self.transaction() as cursor:
+            result = write(cursor)
+        if on_commit is not None:
+            on_commit(result)
+        return result
+
+    def _page(self, items, limit, key):
+        """Trim a ``limit + 1`` fetch to ``(items, next_cursor)``"""
+        if len(items) > limit:
+            items = items[:limit]
+            return items, encode_cursor(key(items[-1]))
+        return items, None
+
+    def _page_query(self, sql, params, order_clause, keyset_clause, limit, cursor):
+        """Append keyset and LIMIT clauses to ``sql``.
+
+        ``sql`` must contain ``{keyset}`` where the cursor condition goes.
+        Returns ``(sql, params, limit)`` with limit clamped, or None.
+        """
+        params = list(params)
+        if cursor is not None and limit is None:
+            limit = DEFAULT_PAGE_SIZE
+        keyset = ''
+        if cursor is not None:
+            keyset = keyset_clause
+            params.extend(decode_cursor(cursor))
+        sql = sql.format(keyset=keyset) + ' ' + order_clause
+        if limit is not None:
+            limit = page_size(limit)
+            sql += ' LIMIT ?'
+            params.append(limit + 1)
+        return sql, params, limit
+
+    def _cached(self, key, load):
+        """Read-through query cache lookup; returns copies callers may modify"""
+        rows = self.query_cache.get_or_load(key, load)
+        return [dict(row) for row in rows]
+
+    def _owner_of(self, cursor, table, row_id):
+        """user_id owning a row, used to invalidate that user's cached list"""
+        cursor.execute(f'SELECT user_id FROM {table} WHERE id = ?', (row_id,))
+        row = cursor.fetchone()
+        return row[0] if row else None
+
+    def get_pool_stats(self):
+        """Get connection pool statistics; writer waits show write contention"""
+        stats = {"writer": self.writer.get_stats(), "readers": self.readers.get_stats()}
+        stats["db_path"] = self.db_path
+        if self.write_behind is not None:
+            stats["write_behind"] = self.write_behind.get_stats()
+        stats["friend_graph"] = self.friend_graph.get_stats()
+        stats["query_cache"] = self.query_cache.get_stats()
+        if self.retention is not None:
+            stats["retention"] = self.retention.get_stats()
+        return stats
+
+    def close(self):
+        """Flush queued writes and close pooled connections"""
+        if self.retention is not None:
+            self.retention.close()
+        if self.write_behind is not None:
+            self.write_behind.close()
+        self.writer.close_all()
+        self.readers.close_all()
+
+    def init_database(self, run_migrations=True):
+        """Initialize database tables and apply pending schema migrations"""
+        with self.transaction() as cursor:
+            # Chat messages table
+            cursor.execute('''
+                CREATE TABLE IF NOT EXISTS chat_messages (
+                    id INTEGER PRIMARY KEY AUTOINCREMENT,
+                    user_id TEXT NOT NULL,
+                    session_id TEXT NOT NULL,
+                    user_message TEXT NOT NULL,
+                    ai_response TEXT NOT NULL,
+                    timestamp DATETIME DEFAULT CURRENT_TIMESTAMP
+                )
+            ''')
+
+            # Tasks table
+            cursor.execute('''
+                CREATE TABLE IF NOT EXISTS tasks (
+                    id INTEGER PRIMARY KEY AUTOINCREMENT,
+                    user_id TEXT NOT NULL,
+                    title TEXT NOT NULL,
+                    status TEXT DEFAULT 'pending',
+                    priority TEXT DEFAULT 'medium',
+                    created_at DATETIME DEFAULT CURRENT_TIMESTAMP
+                )
+            ''')
+
+            # Goals table
+            cursor.execute('''
+                CREATE TABLE IF NOT EXISTS goals (
+                    id INTEGER PRIMARY KEY AUTOINCREMENT,
+                    user_id TEXT NOT NULL,
+                    title TEXT NOT NULL,
+                    progress INTEGER DEFAULT 0,
+                    created_at DATETIME DEFAULT CURRENT_TIMESTAMP
+                )
+            ''')
+
+            # Subgoals table
+            cursor.execute('''
+                CREATE TABLE IF NOT EXISTS subgoals (
+                    id INTEGER PRIMARY KEY AUTOINCREMENT,
+                    goal_id INTEGER NOT NULL,
+                    title TEXT NOT NULL,
+                    completed BOOLEAN DEFAULT 0,
+                    credits INTEGER DEFAULT 1,
+                    FOREIGN KEY (goal_id) REFERENCES goals (id)
+                )
+            ''')
+
+            # Habits table
+            cursor.execute('''
+                CREATE TABLE IF NOT EXISTS habits (
+                    id INTEGER PRIMARY KEY AUTOINCREMENT,
+                    user_id TEXT NOT NULL,
+                    name TEXT NOT NULL,
+                    streak INTEGER DEFAULT 0,
+                    frequency TEXT DEFAULT 'daily',
+                    created_at DATETIME DEFAULT CURRENT_TIMESTAMP
+                )
+            ''')
+
+            # Users table for friends system
+            cursor.execute('''
+                CREATE TABLE IF NOT EXISTS users (
+                    id TEXT PRIMARY KEY,
+                    email TEXT UNIQUE NOT NULL,
+                    name TEXT NOT NULL,
+                    picture TEXT,
+                    created_at DATETIME DEFAULT CURRENT_TIMESTAMP
+                )
+            ''')
+
+            # Friend requests table
+            cursor.execute('''
+                CREATE TABLE IF NOT EXISTS friend_requests (
+                    id INTEGER PRIMARY KEY AUTOINCREMENT,
+                    from_user_id TEXT NOT NULL,
+                    to_user_id TEXT NOT NULL,
+                    status TEXT DEFAULT 'pending',
+                    created_at DATETIME DEFAULT CURRENT_TIMESTAMP,
+                    FOREIGN KEY (from_user_id) REFERENCES users (id),
+                    FOREIGN KEY (to_user_id) REFERENCES users (id)
+                )
+            ''')
+
+            # Friends table
+            cursor.execute('''
+                CREATE TABLE IF NOT EXISTS friends (
+                    id INTEGER PRIMARY KEY AUTOINCREMENT,
+                    user1_id TEXT NOT NULL,
+                    user2_id TEXT NOT NULL,
+                    created_at DATETIME DEFAULT CURRENT_TIMESTAMP,
+                    FOREIGN KEY (user1_id) REFERENCES users (id),
+                    FOREIGN KEY (user2_id) REFERENCES users (id)
+                )
+            ''')
+
+            # Messages table for friend messaging
+            cursor.execute('''
+                CREATE TABLE IF NOT EXISTS messages (
+                    id INTEGER PRIMARY KEY AUTOINCREMENT,
+                    from_user_id TEXT NOT NULL,
+                    to_user_id TEXT NOT NULL,
+                    message TEXT NOT NULL,
+                    read_status BOOLEAN DEFAULT 0,
+                    created_at DATETIME DEFAULT CURRENT_TIMESTAMP,
+                    FOREIGN KEY (from_user_id) REFERENCES users (id),
+                    FOREIGN KEY (to_user_id) REFERENCES users (id)
+                )
+            ''')
+
+            if run_migrations:
+                applied = apply_migrations(cursor)
+                if applied:
+                    print(f"Applied database migrations: {applied}")
+
+            cursor.execute("SELECT 1 FROM sqlite_master WHERE name = 'users_search'")
+            self.user_search_enabled = cursor.fetchone() is not None
+
+            if self.archive_path:
+                create_chat_archive(cursor)
+
     def add_chat_message(self, user_id, session_id, user_message, ai_response):
         """Add a chat message to database"""
-        conn = sqlite3.connect(self.db_path)
-        cursor = conn.cursor()
-        cursor.execute('''
-            INSERT INTO chat_messages (user_id, session_id, user_message, ai_response)
-            VALUES (?, ?, ?, ?)
-        ''', (user_id, session_id, user_message, ai_response))
-        conn.commit()
-        conn.close()
-    
+        def write(cursor):
+            cursor.execute('''
+                INSERT INTO chat_messages (user_id, session_id, user_message, ai_response)
+                VALUES (?, ?, ?, ?)
+            ''', (user_id, session_id, user_message, ai_response))
+            # Keep the session summary in step; title holds the first 51
+            # characters of the session's messages, enough to know whether
+            # it needs an ellipsis
+            cursor.execute('''
+                INSERT INTO chat_sessions (user_id, session_id, message_count, title)
+                VALUES (?, ?, 1, substr(?, 1, 51))
+                ON CONFLICT (user_id, session_id) DO UPDATE SET
+                    last_activity = CURRENT_TIMESTAMP,
+                    message_count = message_count + 1,
+                    archived = 0,
+                    title = CASE WHEN length(title) > 50 THEN title
+                                 ELSE substr(title || ' ' || excluded.title, 1, 51) END
+            ''', (user_id, session_id, user_message))
+
+        self._deferred_write(write)
+
     def get_recent_chat_history(self, user_id, limit=10):
         """Get recent chat history for context"""
-        conn = sqlite3.connect(self.db_path)
-        cursor = conn.cursor()
-        cursor.execute('''
-            SELECT user_message, ai_response, timestamp
-            FROM chat_messages
-            WHERE user_id = ?
-            ORDER BY timestamp DESC
-            LIMIT ?
-        ''', (user_id, limit))
-        messages = cursor.fetchall()
-        conn.close()
+        with self.read() as cursor:
+            cursor.execute('''
+                SELECT user_message, ai_response, timestamp
+                FROM chat_messages
+                WHERE user_id = ?
+                ORDER BY timestamp DESC
+                LIMIT ?
+            ''', (user_id, limit))
+            messages = cursor.fetchall()
         return list(reversed(messages))  # Return in chronological order
-    
+
     def add_task(self, user_id, title, status='pending', priority='medium'):
         """Add a task to database"""
-        conn = sqlite3.connect(self.db_path)
-        cursor = conn.cursor()
-        cursor.execute('''
-            INSERT INTO tasks (user_id, title, status, priority)
-            VALUES (?, ?, ?, ?)
-        ''', (user_id, title, status, priority))
-        task_id = cursor.lastrowid
-        conn.commit()
-        conn.close()
+        with self.transaction() as cursor:
+            cursor.execute('''
+                INSERT INTO tasks (user_id, title, status, priority)
+                VALUES (?, ?, ?, ?)
+            ''', (user_id, title, status, priority))
+            task_id = cursor.lastrowid
+        self.query_cache.invalidate(('tasks', user_id))
         return task_id
-    
-    def get_tasks(self, user_id):
-        """Get all tasks for a user"""
-        conn = sqlite3.connect(self.db_path)
-        cursor = conn.cursor()
-        cursor.execute('''
+
+    def get_tasks(self, user_id, limit=None, cursor=None):
+        """Get tasks for a user, newest first.
+
+        With ``limit`` or ``cursor``, returns ``(tasks, next_cursor)``;
+        full lists come from the query cache.
+        """
+        if limit is None and cursor is None:
+            return self._cached(('tasks', user_id), lambda: self._select_tasks(user_id))
+        return self._select_tasks(user_id, limit, cursor)
+
+    def _select_tasks(self, user_id, limit=None, cursor=None):
+        sql, params, limit = self._page_query('''
             SELECT id, title, status, priority, created_at
             FROM tasks
-            WHERE user_id = ?
-            ORDER BY created_at DESC
-        ''', (user_id,))
-        tasks = cursor.fetchall()
-        conn.close()
-        return [{"id": t[0], "title": t[1], "status": t[2], "priority": t[3], "created_at": t[4]} for t in tasks]
-    
+            WHERE user_id = ? {keyset}
+        ''', (user_id,), 'ORDER BY created_at DESC, id DESC', 'AND (created_at, id) < (?, ?)', limit, cursor)
+        with self.read() as db_cursor:
+            db_cursor.execute(sql, params)
+            rows = db_cursor.fetchall()
+        tasks = [{"id": t[0], "title": t[1], "status": t[2], "priority": t[3], "created_at": t[4]} for t in rows]
+        if limit is None:
+            return tasks
+        return self._page(tasks, limit, lambda t: (t["created_at"], t["id"]))
+
     def complete_task(self, task_id):
         """Mark a task as completed"""
-        conn = sqlite3.connect(self.db_path)
-        cursor = conn.cursor()
-        cursor.execute('''
-            UPDATE tasks SET status = 'completed' WHERE id = ?
-        ''', (task_id,))
-        affected_rows = cursor.rowcount
-        conn.commit()
-        conn.close()
-        return affected_rows > 0
-    
+        with self.transaction() as cursor:
+            owner = self._owner_of(cursor, 'tasks', task_id)
+            cursor.execute('''
+                UPDATE tasks SET status = 'completed' WHERE id = ?
+            ''', (task_id,))
+            updated = cursor.rowcount > 0
+        self.query_cache.invalidate(('tasks', owner))
+        return updated
+
     def add_goal(self, user_id, title, progress=0):
         """Add a goal to database"""
-        conn = sqlite3.connect(self.db_path)
-        cursor = conn.cursor()
-        cursor.execute('''
-            INSERT INTO goals (user_id, title, progress)
-            VALUES (?, ?, ?)
-        ''', (user_id, title, progress))
-        goal_id = cursor.lastrowid
-        conn.commit()
-        conn.close()
+        with self.transaction() as cursor:
+            cursor.execute('''
+                INSERT INTO goals (user_id, title, progress)
+                VALUES (?, ?, ?)
+            ''', (user_id, title, progress))
+            goal_id = cursor.lastrowid
+        self.query_cache.invalidate(('goals', user_id))
         return goal_id
-    
-    def get_goals(self, user_id):
-        """Get all goals for a user"""
-        conn = sqlite3.connect(self.db_path)
-        cursor = conn.cursor()
-        cursor.execute('''
+
+    def get_goals(self, user_id, limit=None, cursor=None):
+        """Get goals for a user, newest first.
+
+        With ``limit`` or ``cursor``, returns ``(goals, next_cursor)``;
+        full lists come from the query cache.
+        """
+        if limit is None and cursor is None:
+            return self._cached(('goals', user_id), lambda: self._select_goals(user_id))
+        return self._select_goals(user_id, limit, cursor)
+
+    def _select_goals(self, user_id, limit=None, cursor=None):
+        sql, params, limit = self._page_query('''
             SELECT id, title, progress, created_at
             FROM goals
-            WHERE user_id = ?
-            ORDER BY created_at DESC
-        ''', (user_id,))
-        goals = cursor.fetchall()
-        conn.close()
-        return [{"id": g[0], "title": g[1], "progress": g[2], "created_at": g[3]} for g in goals]
-    
+            WHERE user_id = ? {keyset}
+        ''', (user_id,), 'ORDER BY created_at DESC, id DESC', 'AND (created_at, id) < (?, ?)', limit, cursor)
+        with self.read() as db_cursor:
+            db_cursor.execute(sql, params)
+            rows = db_cursor.fetchall()
+        goals = [{"id": g[0], "title": g[1], "progress": g[2], "created_at": g[3]} for g in rows]
+        if limit is None:
+            return goals
+        return self._page(goals, limit, lambda g: (g["created_at"], g["id"]))
+
+    def get_goals_with_subgoals(self, user_id, limit=None, cursor=None):
+        """Get goals for a user, newest first, each with a ``subGoals`` list.
+
+        One joined query regardless of the number of goals. With ``limit``
+        or ``cursor``, returns ``(goals, next_cursor)``.
+        """
+        if limit is None and cursor is None:
+            goal_filter, params = 'g.user_id = ?', [user_id]
+        else:
+            page_sql, params, limit = self._page_query('''
+                SELECT id FROM goals
+                WHERE user_id = ? {keyset}
+            ''', (user_id,), 'ORDER BY created_at DESC, id DESC', 'AND (created_at, id) < (?, ?)', limit, cursor)
+            goal_filter = f'g.id IN ({page_sql})'
+        with self.read() as db_cursor:
+            db_cursor.execute(f'''
+                SELECT g.id, g.title, g.progress, g.created_at, s.id, s.title, s.completed, s.credits
+                FROM goals g
+                LEFT JOIN subgoals s ON s.goal_id = g.id
+                WHERE {goal_filter}
+                ORDER BY g.created_at DESC, g.id DESC, s.id
+            ''', params)
+            rows = db_cursor.fetchall()
+
+        goals = []
+        for row in rows:
+            if not goals or goals[-1]["id"] != row[0]:
+                goals.append({"id": row[0], "title": row[1], "progress": row[2], "created_at": row[3], "subGoals": []})
+            if row[4] is not None:
+                goals[-1]["subGoals"].append({"id": row[4], "title": row[5], "completed": bool(row[6]), "credits": row[7]})
+        if limit is None:
+            return goals
+        return self._page(goals, limit, lambda g: (g["created_at"], g["id"]))
+
     def complete_goal(self, goal_id):
         """Mark a goal as completed (100% progress)"""
-        conn = sqlite3.connect(self.db_path)
-        cursor = conn.cursor()
-        cursor.execute('''
-            UPDATE goals SET progress = 100 WHERE id = ?
-        ''', (goal_id,))
-        affected_rows = cursor.rowcount
-        conn.commit()
-        conn.close()
-        return affected_rows > 0
-    
+        return self.update_goal_progress(goal_id, 100)
+
+    def update_goal_progress(self, goal_id, progress):
+        """Set a goal's progress percentage"""
+        with self.transaction() as cursor:
+            owner = self._owner_of(cursor, 'goals', goal_id)
+            cursor.execute('UPDATE goals SET progress = ? WHERE id = ?', (progress, goal_id))
+            updated = cursor.rowcount > 0
+        self.query_cache.invalidate(('goals', owner))
+        return updated
+
     def add_subgoal(self, goal_id, title, credits=1):
         """Add a subgoal to database"""
-        conn = sqlite3.connect(self.db_path)
-        cursor = conn.cursor()
-        cursor.execute('''
-            INSERT INTO subgoals (goal_id, title, credits)
-            VALUES (?, ?, ?)
-        ''', (goal_id, title, credits))
-        subgoal_id = cursor.lastrowid
-        conn.commit()
-        conn.close()
+        with self.transaction() as cursor:
+            cursor.execute('''
+                INSERT INTO subgoals (goal_id, title, credits)
+                VALUES (?, ?, ?)
+            ''', (goal_id, title, credits))
+            subgoal_id = cursor.lastrowid
+        self.query_cache.invalidate(('subgoals', goal_id))
         return subgoal_id
-    
+
     def get_subgoals(self, goal_id):
         """Get all subgoals for a goal"""
-        conn = sqlite3.connect(self.db_path)
-        cursor = conn.cursor()
-        cursor.execute('''
-            SELECT id, title, completed, credits
-            FROM subgoals
-            WHERE goal_id = ?
-        ''', (goal_id,))
-        subgoals = cursor.fetchall()
-        conn.close()
+        return self._cached(('subgoals', goal_id), lambda: self._select_subgoals(goal_id))
+
+    def _select_subgoals(self, goal_id):
+        with self.read() as cursor:
+            cursor.execute('''
+                SELECT id, title, completed, credits
+                FROM subgoals
+                WHERE goal_id = ?
+            ''', (goal_id,))
+            subgoals = cursor.fetchall()
         return [{"id": s[0], "title": s[1], "completed": bool(s[2]), "credits": s[3]} for s in subgoals]
-    
+
     def toggle_subgoal(self, goal_id, subgoal_id):
         """Toggle subgoal completion status"""
-        conn = sqlite3.connect(self.db_path)
-        cursor = conn.cursor()
-        cursor.execute('''
-            UPDATE subgoals 
-            SET completed = NOT completed 
-            WHERE id = ? AND goal_id = ?
-        ''', (subgoal_id, goal_id))
-        affected_rows = cursor.rowcount
-        conn.commit()
-        conn.close()
-        return affected_rows > 0
-    
+        with self.transaction() as cursor:
+            cursor.execute('''
+                UPDATE subgoals
+                SET completed = NOT completed
+                WHERE id = ? AND goal_id = ?
+            ''', (subgoal_id, goal_id))
+            updated = cursor.rowcount > 0
+        self.query_cache.invalidate(('subgoals', goal_id))
+        return updated
+
     def add_habit(self, user_id, name, frequency='daily'):
         """Add a habit to database"""
-        conn = sqlite3.connect(self.db_path)
-        cursor = conn.cursor()
-        cursor.execute('''
-            INSERT INTO habits (user_id, name, frequency)
-            VALUES (?, ?, ?)
-        ''', (user_id, name, frequency))
-        habit_id = cursor.lastrowid
-        conn.commit()
-        conn.close()
+        with self.transaction() as cursor:
+            cursor.execute('''
+                INSERT INTO habits (user_id, name, frequency)
+                VALUES (?, ?, ?)
+            ''', (user_id, name, frequency))
+            habit_id = cursor.lastrowid
+        self.query_cache.invalidate(('habits', user_id))
         return habit_id
-    
-    def get_habits(self, user_id):
-        """Get all habits for a user"""
-        conn = sqlite3.connect(self.db_path)
-        cursor = conn.cursor()
-        cursor.execute('''
+
+    def get_habits(self, user_id, limit=None, cursor=None):
+        """Get habits for a user, newest first.
+
+        With ``limit`` or ``cursor``, returns ``(habits, next_cursor)``;
+        full lists come from the query cache.
+        """
+        if limit is None and cursor is None:
+            return self._cached(('habits', user_id), lambda: self._select_habits(user_id))
+        return self._select_habits(user_id, limit, cursor)
+
+    def _select_habits(self, user_id, limit=None, cursor=None):
+        sql, params, limit = self._page_query('''
             SELECT id, name, streak, frequency, created_at
             FROM habits
-            WHERE user_id = ?
-            ORDER BY created_at DESC
-        ''', (user_id,))
-        habits = cursor.fetchall()
-        conn.close()
-        return [{"id": h[0], "name": h[1], "streak": h[2], "frequency": h[3], "created_at": h[4]} for h in habits]
-    
+            WHERE user_id = ? {keyset}
+        ''', (user_id,), 'ORDER BY created_at DESC, id DESC', 'AND (created_at, id) < (?, ?)', limit, cursor)
+        with self.read() as db_cursor:
+            db_cursor.execute(sql, params)
+            rows = db_cursor.fetchall()
+        habits = [{"id": h[0], "name": h[1], "streak": h[2], "frequency": h[3], "created_at": h[4]} for h in rows]
+        if limit is None:
+            return habits
+        return self._page(habits, limit, lambda h: (h["created_at"], h["id"]))
+
     def delete_habit(self, habit_id):
         """Delete a habit"""
-        conn = sqlite3.connect(self.db_path)
-        cursor = conn.cursor()
-        cursor.execute('DELETE FROM habits WHERE id = ?', (habit_id,))
-        affected_rows = cursor.rowcount
-        conn.commit()
-        conn.close()
-        return affected_rows > 0
-    
+        with self.transaction() as cursor:
+            owner = self._owner_of(cursor, 'habits', habit_id)
+            cursor.execute('DELETE FROM habits WHERE id = ?', (habit_id,))
+            deleted = cursor.rowcount > 0
+            cursor.execute('DELETE FROM habit_logs WHERE habit_id = ?', (habit_id,))
+        self.query_cache.invalidate(('habits', owner))
+        return deleted
+
+    def log_habit(self, habit_id, day=None):
+        """Record a habit completion for ``day`` (a date, default today).
+
+        Returns True when logged, False if that day was already logged and
+        None if the habit doesn't exist. Streaks are updated incrementally;
+        only a backdated log re-derives them from the bitmap.
+        """
+        day = (day or date.today()).toordinal()
+        # The bitmap is read, modified and written back; BEGIN IMMEDIATE keeps
+        # a concurrent log from another process from being overwritten
+        with self.transaction(immediate=True) as cursor:
+            owner = self._owner_of(cursor, 'habits', habit_id)
+            if owner is None:
+                return None
+            cursor.execute('''
+                SELECT start_day, bitmap, last_day, current_streak, longest_streak, total
+                FROM habit_logs WHERE habit_id = ?
+            ''', (habit_id,))
+            row = cursor.fetchone()
+            if row:
+                start_day, bitmap, last_day, current, longest, total = row
+                bitmap = bytearray(bitmap)
+            else:
+                start_day, bitmap, last_day, current, longest, total = day - day % 8, bytearray(), None, 0, 0, 0
+            if bitmap_has(bitmap, start_day, day):
+                return False
+
+            start_day = bitmap_set(bitmap, start_day, day)
+            if last_day is None or day > last_day:
+                current = current + 1 if last_day == day - 1 else 1
+                longest = max(longest, current)
+                last_day = day
+            else:
+                current, longest = bitmap_streaks(bitmap, start_day, last_day)
+            cursor.execute('''
+                INSERT OR REPLACE INTO habit_logs
+                    (habit_id, start_day, bitmap, last_day, current_streak, longest_streak, total)
+                VALUES (?, ?, ?, ?, ?, ?, ?)
+            ''', (habit_id, start_day, bytes(bitmap), last_day, current, longest, total + 1))
+            cursor.execute('UPDATE habits SET streak = ? WHERE id = ?', (current, habit_id))
+        self.query_cache.invalidate(('habits', owner))
+        return True
+
+    def get_habit_logs(self, user_id, today=None, days=HABIT_RECENT_DAYS):
+        """Completion status for each of a user's habits, keyed by habit id.
+
+        ``streak`` is the current streak as of ``today`` (0 once a day has
+        been missed) and ``recent_logs`` lists the logged dates in the last
+        ``days`` days.
+        """
+        today = (today or date.today()).toordinal()
+        with self.read() as cursor:
+            cursor.execute('''
+                SELECT h.id, l.start_day, l.bitmap, l.last_day, l.current_streak, l.longest_streak, l.total
+                FROM habits h
+                LEFT JOIN habit_logs l ON l.habit_id = h.id
+                WHERE h.user_id = ?
+            ''', (user_id,))
+            rows = cursor.fetchall()
+
+        logs = {}
+        for habit_id, start_day, bitmap, last_day, current, longest, total in rows:
+            if last_day is None:
+                logs[habit_id] = {"completed_today": False, "recent_logs": [], "last_completed": None,
+                                  "streak": 0, "longest_streak": 0, "total_completions": 0}
+                continue
+            logs[habit_id] = {
+                "completed_today": bitmap_has(bitmap, start_day, today),
+                "recent_logs": [date.fromordinal(day).isoformat()
+                                for day in range(today - days + 1, today + 1)
+                                if bitmap_has(bitmap, start_day, day)],
+                "last_completed": date.fromordinal(last_day).isoformat(),
+                "streak": current if last_day >= today - 1 else 0,
+                "longest_streak": longest,
+                "total_completions": total
+            }
+        return logs
+
     def add_user(self, user_id, email, name, picture=None):
         """Add or update user information"""
-        conn = sqlite3.connect(self.db_path)
-        cursor = conn.cursor()
-        cursor.execute('''
-            INSERT OR REPLACE INTO users (id, email, name, picture)
-            VALUES (?, ?, ?, ?)
-        ''', (user_id, email, name, picture))
-        conn.commit()
-        conn.close()
-    
-    def search_users_by_email(self, email_query):
+        with self.transaction() as cursor:
+            if self.user_search_enabled:
+                # REPLACE drops rows clashing on id or email; unindex them first
+                cursor.execute('SELECT rowid FROM users WHERE id = ? OR email = ?', (user_id, email))
+                replaced = cursor.fetchall()
+                cursor.executemany('DELETE FROM users_search WHERE rowid = ?', replaced)
+            cursor.execute('''
+                INSERT OR REPLACE INTO users (id, email, name, picture)
+                VALUES (?, ?, ?, ?)
+            ''', (user_id, email, name, picture))
+            if self.user_search_enabled:
+                cursor.execute('INSERT INTO users_search (rowid, email, name) VALUES (?, ?, ?)',
+                               (cursor.lastrowid, email, name))
+            # Friends' cached lists carry this user's name and email
+            cursor.execute('SELECT friend_id FROM friendships WHERE user_id = ?', (user_id,))
+            affected = [user_id] + [row[0] for row in cursor.fetchall()]
+        self.friend_graph.invalidate(*affected)
+
+    def search_users(self, query, fields=('email', 'name'), limit=20):
+        """Search users by substring of email and/or name, best matches first.
+
+        Queries of three or more characters use the trigram index. Shorter
+        ones (and SQLite builds without trigram support) take prefix matches
+        from the lower(email)/lower(name) indexes, then top up with a scan
+        for other substring matches that stops after ``limit`` rows. Exact
+        matches rank first, then prefix matches, then shorter values.
+        """
+        query = query.strip().lower()
+        limit = page_size(limit)
+        fields = [f for f in fields if f in ('email', 'name')]
+        exact = ' OR '.join(f'lower(u.{f}) = :q' for f in fields)
+        prefix = ' OR '.join(f'lower(u.{f}) LIKE :prefix ESCAPE \'\\\'' for f in fields)
+        params = {"q": query, "prefix": like_prefix(query), "limit": limit}
+
+        if len(query) >= 3 and self.user_search_enabled:
+            params["match"] = '{' + ' '.join(fields) + '} : ' + fts_phrase(query)
+            sql = f'''
+                SELECT u.id, u.email, u.name, u.picture
+                FROM users_search s
+                JOIN users u ON u.rowid = s.rowid
+                WHERE users_search MATCH :match
+                ORDER BY CASE WHEN {exact} THEN 0 WHEN {prefix} THEN 1 ELSE 2 END,
+                         length(u.{fields[0]}), u.{fields[0]}
+                LIMIT :limit
+            '''
+            with self.read() as cursor:
+                cursor.execute(sql, params)
+                rows = cursor.fetchall()
+        else:
+            # One index range per field, merged and ranked in Python
+            params["upper"] = query + '\uffff'
+            rows = []
+            seen = set()
+            with self.read() as cursor:
+                for field in fields:
+                    cursor.execute(f'''
+                        SELECT id, email, name, picture
+                        FROM users
+                        WHERE lower({field}) >= :q AND lower({field}) < :upper
+                        ORDER BY lower({field})
+                        LIMIT :limit
+                    ''', params)
+                    for row in cursor.fetchall():
+                        if row[0] not in seen:
+                            seen.add(row[0])
+                            rows.append(row)
+                if query and len(rows) < limit:
+                    # Matches inside the value, which no index can find
+                    inside = ' OR '.join(f'instr(lower({f}), :q) > 1' for f in fields)
+                    cursor.execute(f'''
+                        SELECT id, email, name, picture
+                        FROM users
+                        WHERE {inside}
+                        LIMIT :limit
+                    ''', params)
+                    for row in cursor.fetchall():
+                        if row[0] not in seen:
+                            seen.add(row[0])
+                            rows.append(row)
+            field_index = {"email": 1, "name": 2}
+            rows.sort(key=lambda r: (
+                0 if any(r[field_index[f]].lower() == query for f in fields) else 1,
+                0 if any(r[field_index[f]].lower().startswith(query) for f in fields) else 1,
+                len(r[field_index[fields[0]]]),
+                r[field_index[fields[0]]],
+            ))
+            rows = rows[:limit]
+        return [{"id": u[0], "email": u[1], "name": u[2], "picture": u[3]} for u in rows]
+
+    def search_users_by_email(self, email_query, limit=20):
         """Search users by email"""
-        conn = sqlite3.connect(self.db_path)
-        cursor = conn.cursor()
-        cursor.execute('''
-            SELECT id, email, name, picture
-            FROM users
-            WHERE email LIKE ?
-            ORDER BY email
-        ''', (f'%{email_query}%',))
-        users = cursor.fetchall()
-        conn.close()
-        return [{"id": u[0], "email": u[1], "name": u[2], "picture": u[3]} for u in users]
-    
+        return self.search_users(email_query, fields=('email',), limit=limit)
+
     def send_friend_request(self, from_user_id, to_user_id):
         """Send a friend request"""
-        conn = sqlite3.connect(self.db_path)
-        cursor = conn.cursor()
-        cursor.execute('''
-            INSERT INTO friend_requests (from_user_id, to_user_id)
-            VALUES (?, ?)
-        ''', (from_user_id, to_user_id))
-        request_id = cursor.lastrowid
-        conn.commit()
-        conn.close()
+        with self.transaction() as cursor:
+            cursor.execute('''
+                INSERT INTO friend_requests (from_user_id, to_user_id)
+                VALUES (?, ?)
+            ''', (from_user_id, to_user_id))
+            request_id = cursor.lastrowid
+            sender = None
+            if self.events is not None:
+                # Same shape as get_pending_friend_requests rows
+                cursor.execute('''
+                    SELECT u.name, u.email, u.picture, fr.created_at
+                    FROM friend_requests fr
+                    JOIN users u ON fr.from_user_id = u.id
+                    WHERE fr.id = ?
+                ''', (request_id,))
+                sender = cursor.fetchone()
+
+        if sender is not None:
+            self._publish(to_user_id, 'friend_request', {
+                "request_id": request_id, "id": from_user_id, "name": sender[0],
+                "email": sender[1], "picture": sender[2], "created_at": sender[3]
+            })
         return request_id
-    
+
     def get_pending_friend_requests(self, user_id):
         """Get pending friend requests for a user"""
-        conn = sqlite3.connect(self.db_path)
-        cursor = conn.cursor()
-        cursor.execute('''
-            SELECT fr.id, u.id, u.name, u.email, u.picture, fr.created_at
-            FROM friend_requests fr
-            JOIN users u ON fr.from_user_id = u.id
-            WHERE fr.to_user_id = ? AND fr.status = 'pending'
-            ORDER BY fr.created_at DESC
-        ''', (user_id,))
-        requests = cursor.fetchall()
-        conn.close()
+        with self.read() as cursor:
+            cursor.execute('''
+                SELECT fr.id, u.id, u.name, u.email, u.picture, fr.created_at
+                FROM friend_requests fr
+                JOIN users u ON fr.from_user_id = u.id
+                WHERE fr.to_user_id = ? AND fr.status = 'pending'
+                ORDER BY fr.created_at DESC
+            ''', (user_id,))
+            requests = cursor.fetchall()
         return [{"request_id": r[0], "id": r[1], "name": r[2], "email": r[3], "picture": r[4], "created_at": r[5]} for r in requests]
-    
+
     def respond_to_friend_request(self, request_id, status):
         """Accept or reject a friend request"""
-        conn = sqlite3.connect(self.db_path)
-        cursor = conn.cursor()
-        
-        # Get the request details first
-        cursor.execute('SELECT from_user_id, to_user_id FROM friend_requests WHERE id = ?', (request_id,))
-        request_data = cursor.fetchone()
-        
-        if not request_data:
-            conn.close()
-            return False
-        
-        from_user_id, to_user_id = request_data
-        
-        # Update request status
-        cursor.execute('UPDATE friend_requests SET status = ? WHERE id = ?', (status, request_id))
-        
-        # If accepted, create friendship
+        with self.transaction() as cursor:
+            # Get the request details first
+            cursor.execute('SELECT from_user_id, to_user_id FROM friend_requests WHERE id = ?', (request_id,))
+            request_data = cursor.fetchone()
+
+            if not request_data:
+                return False
+
+            from_user_id, to_user_id = request_data
+
+            # Update request status
+            cursor.execute('UPDATE friend_requests SET status = ? WHERE id = ?', (status, request_id))
+
+            # If accepted, create the friendship in both directions
+            if status == 'accepted':
+                cursor.executemany('''
+                    INSERT OR IGNORE INTO friendships (user_id, friend_id)
+                    VALUES (?, ?)
+                ''', [(from_user_id, to_user_id), (to_user_id, from_user_id)])
+
         if status == 'accepted':
-            cursor.execute('''
-                INSERT INTO friends (user1_id, user2_id)
-                VALUES (?, ?)
-            ''', (from_user_id, to_user_id))
-        
-        conn.commit()
-        conn.close()
+            self.friend_graph.invalidate(from_user_id, to_user_id)
+        self._publish(from_user_id, 'friend_request_response', {
+            "request_id": request_id, "friend_id": to_user_id, "status": status
+        })
         return True
-    
+
+    def remove_friend(self, user_id, friend_id):
+        """Remove a friendship (both directions)"""
+        with self.transaction() as cursor:
+            cursor.execute('''
+                DELETE FROM friendships
+                WHERE (user_id = ? AND friend_id = ?) OR (user_id = ? AND friend_id = ?)
+            ''', (user_id, friend_id, friend_id, user_id))
+            removed = cursor.rowcount > 0
+        self.friend_graph.invalidate(user_id, friend_id)
+        return removed
+
+    def _load_friends(self, user_id):
+        with self.read() as cursor:
+            cursor.execute('''
+                SELECT u.id, u.name, u.email, u.picture
+                FROM friendships f
+                JOIN users u ON u.id = f.friend_id
+                WHERE f.user_id = ?
+            ''', (user_id,))
+            friends = cursor.fetchall()
+        return [{"id": f[0], "name": f[1], "email": f[2], "picture": f[3]} for f in friends]
+
     def get_friends(self, user_id):
         """Get all friends for a user"""
-        conn = sqlite3.connect(self.db_path)
-        cursor = conn.cursor()
-        cursor.execute('''
-            SELECT u.id, u.name, u.email, u.picture
-            FROM friends f
-            JOIN users u ON (f.user1_id = u.id OR f.user2_id = u.id)
-            WHERE (f.user1_id = ? OR f.user2_id = ?) AND u.id != ?
-        ''', (user_id, user_id, user_id))
-        friends = cursor.fetchall()
-        conn.close()
-        return [{"id": f[0], "name": f[1], "email": f[2], "picture": f[3], "status": "offline"} for f in friends]
-    
+        friends = self.friend_graph.get_or_load(user_id, lambda: self._load_friends(user_id))
+        return [dict(friend, status="offline") for friend in friends]
+
     def get_friend_by_name(self, user_id, name_query):
-        """Find a friend by name (supports first name matching)"""
-        conn = sqlite3.connect(self.db_path)
-        cursor = conn.cursor()
-        cursor.execute('''
-            SELECT u.id, u.name, u.email, u.picture
-            FROM friends f
-            JOIN users u ON (f.user1_id = u.id OR f.user2_id = u.id)
-            WHERE (f.user1_id = ? OR f.user2_id = ?) AND u.id != ? AND LOWER(u.name) LIKE LOWER(?)
-            LIMIT 1
-        ''', (user_id, user_id, user_id, f'%{name_query}%'))
-        friend = cursor.fetchone()
-        conn.close()
-        if friend:
-            return {"id": friend[0], "name": friend[1], "email": friend[2], "picture": friend[3]}
-        return None
-    
-    def get_chat_sessions(self, user_id):
-        """Get chat sessions for a user"""
-        conn = sqlite3.connect(self.db_path)
-        cursor = conn.cursor()
-        cursor.execute('''
-            SELECT DISTINCT session_id, MIN(timestamp) as created_at, 
-                   GROUP_CONCAT(user_message, ' ') as sample_text
-            FROM chat_messages
-            WHERE user_id = ?
-            GROUP BY session_id
-            ORDER BY created_at DESC
-        ''', (user_id,))
-        sessions = cursor.fetchall()
-        conn.close()
-        
+        """Find a friend by name (supports first name matching)
+
+        Prefers an exact name, then a name or word starting with the query.
+        """
+        name_query = name_query.lower()
+        best = None
+        best_rank = None
+        for friend in self.friend_graph.get_or_load(user_id, lambda: self._load_friends(user_id)):
+            name = friend["name"].lower()
+            if name_query not in name:
+                continue
+            if name == name_query:
+                rank = 0
+            elif name.startswith(name_query):
+                rank = 1
+            elif f' {name_query}' in name:
+                rank = 2
+            else:
+                rank = 3
+            if best_rank is None or (rank, len(name)) < best_rank:
+                best, best_rank = friend, (rank, len(name))
+        return dict(best) if best else None
+
+    def get_chat_sessions(self, user_id, limit=None, cursor=None):
+        """Get chat sessions for a user, newest first.
+
+        With ``limit`` or ``cursor``, returns ``(sessions, next_cursor)``.
+        """
+        sql, params, limit = self._page_query('''
+            SELECT session_id, created_at, title, last_activity, message_count
+            FROM chat_sessions
+            WHERE user_id = ? {keyset}
+        ''', (user_id,), 'ORDER BY created_at DESC, session_id DESC', 'AND (created_at, session_id) < (?, ?)', limit, cursor)
+        with self.read() as db_cursor:
+            db_cursor.execute(sql, params)
+            sessions = db_cursor.fetchall()
+
+        next_cursor = None
+        if limit is not None:
+            sessions, next_cursor = self._page(sessions, limit, lambda row: (row[1], row[0]))
+
         result = {}
         for session in sessions:
-            session_id, created_at, sample_text = session
+            session_id, created_at, sample_text, last_activity, message_count = session
             title = sample_text[:50] + "..." if len(sample_text) > 50 else sample_text
             result[session_id] = {
                 "messages": [],
                 "created_at": created_at,
+                "last_activity": last_activity,
+                "message_count": message_count,
                 "title": title
             }
-        return result
-    
-    def get_session_messages(self, user_id, session_id):
-        """Get messages for a specific session"""
-        conn = sqlite3.connect(self.db_path)
-        cursor = conn.cursor()
-        cursor.execute('''
+        if limit is None:
+            return result
+        return result, next_cursor
+
+    def get_session_messages(self, user_id, session_id, limit=None, cursor=None):
+        """Get messages for a specific session, oldest first.
+
+        With ``limit`` or ``cursor``, returns ``(messages, next_cursor)``.
+        """
+        sql, params, limit = self._page_query('''
             SELECT id, user_message, ai_response, timestamp
-            FROM chat_messages
-            WHERE user_id = ? AND session_id = ?
-            ORDER BY timestamp ASC
-        ''', (user_id, session_id))
-        messages = cursor.fetchall()
-        conn.close()
-        
-        return [{
+            FROM ''' + self._chat_messages_source() + '''
+            WHERE user_id = ? AND session_id = ? {keyset}
+        ''', (user_id, session_id), 'ORDER BY timestamp ASC, id ASC', 'AND (timestamp, id) > (?, ?)', limit, cursor)
+        with self.read() as db_cursor:
+            db_cursor.execute(sql, params)
+            rows = db_cursor.fetchall()
+
+        messages = [{
             "id": m[0],
             "user_message": m[1],
             "ai_response": m[2],
             "timestamp": m[3]
-        } for m in messages]
-    
+        } for m in rows]
+        if limit is None:
+            return messages
+        return self._page(messages, limit, lambda m: (m["timestamp"], m["id"]))
+
     def delete_chat_session(self, user_id, session_id):
         """Delete all messages for a specific session"""
-        conn = sqlite3.connect(self.db_path)
-        cursor = conn.cursor()
-        cursor.execute('''
-            DELETE FROM chat_messages
-            WHERE user_id = ? AND session_id = ?
-        ''', (user_id, session_id))
-        affected_rows = cursor.rowcount
-        conn.commit()
-        conn.close()
-        return affected_rows > 0
-    
+        with self.transaction() as cursor:
+            cursor.execute('''
+                DELETE FROM chat_messages
+                WHERE user_id = ? AND session_id = ?
+            ''', (user_id, session_id))
+            deleted = cursor.rowcount > 0
+            if self.archive_path:
+                cursor.execute('''
+                    DELETE FROM archive.chat_messages
+                    WHERE user_id = ? AND session_id = ?
+                ''', (user_id, session_id))
+                deleted = deleted or cursor.rowcount > 0
+            cursor.execute('DELETE FROM chat_sessions WHERE user_id = ? AND session_id = ?', (user_id, session_id))
+            return deleted
+
+    def _chat_messages_source(self):
+        """FROM target covering hot and archived chat messages"""
+        if not self.archive_path:
+            return 'chat_messages'
+        columns = 'id, user_id, session_id, user_message, ai_response, timestamp'
+        return f'(SELECT {columns} FROM main.chat_messages UNION ALL SELECT {columns} FROM archive.chat_messages)'
+
+    def archive_chat_sessions(self, older_than_days=90, max_sessions=500):
+        """Move up to ``max_sessions`` chat sessions idle for ``older_than_days`` into the archive.
+
+        Session summaries stay in chat_sessions (flagged archived) so history
+        listings are unchanged. Returns the number of sessions and messages moved.
+        """
+        moved = {"sessions": 0, "messages": 0}
+        if not self.archive_path:
+            return moved
+        with self.transaction() as cursor:
+            cursor.execute('''
+                SELECT user_id, session_id FROM chat_sessions
+                WHERE archived = 0 AND last_activity < datetime('now', ?)
+                LIMIT ?
+            ''', (f'{-float(older_than_days)} days', max_sessions))
+            for user_id, session_id in cursor.fetchall():
+                # Ids are preserved, so re-running after an interrupted move is harmless
+                cursor.execute('''
+                    INSERT OR IGNORE INTO archive.chat_messages (id, user_id, session_id, user_message, ai_response, timestamp)
+                    SELECT id, user_id, session_id, user_message, ai_response, timestamp
+                    FROM main.chat_messages
+                    WHERE user_id = ? AND session_id = ?
+                ''', (user_id, session_id))
+                cursor.execute('''
+                    DELETE FROM main.chat_messages
+                    WHERE user_id = ? AND session_id = ?
+                ''', (user_id, session_id))
+                moved["messages"] += cursor.rowcount
+                cursor.execute('''
+                    UPDATE chat_sessions SET archived = 1
+                    WHERE user_id = ? AND session_id = ?
+                ''', (user_id, session_id))
+                moved["sessions"] += 1
+        return moved
+
+    def compact(self, max_pages=0):
+        """Return free pages to the filesystem; returns bytes reclaimed per database file.
+
+        Runs an incremental vacuum (``max_pages`` 0 frees every free page).
+        A file created before auto_vacuum was enabled gets one full VACUUM
+        to switch it over.
+        """
+        reclaimed = {}
+        schemas = ['main'] + (['archive'] if self.archive_path else [])
+        with self.writer.connection() as conn:
+            for schema in schemas:
+                page_bytes = conn.execute(f'PRAGMA {schema}.page_size').fetchone()[0]
+                before = conn.execute(f'PRAGMA {schema}.page_count').fetchone()[0]
+                if conn.execute(f'PRAGMA {schema}.auto_vacuum').fetchone()[0] == 2:
+                    # executescript steps the pragma to completion
+                    conn.executescript(f'PRAGMA {schema}.incremental_vacuum({int(max_pages)});')
+                else:
+                    conn.execute(f'PRAGMA {schema}.auto_vacuum=INCREMENTAL')
+                    conn.execute(f'VACUUM {schema}')
+                conn.execute(f'PRAGMA {schema}.wal_checkpoint(TRUNCATE)').fetchall()
+                after = conn.execute(f'PRAGMA {schema}.page_count').fetchone()[0]
+                reclaimed[schema] = (before - after) * page_bytes
+        return reclaimed
+
     def send_message(self, from_user_id, to_user_id, message):
-        """Send a message to a friend"""
-        conn = sqlite3.connect(self.db_path)
-        cursor = conn.cursor()
-        cursor.execute('''
-            INSERT INTO messages (from_user_id, to_user_id, message)
-            VALUES (?, ?, ?)
-        ''', (from_user_id, to_user_id, message))
-        message_id = cursor.lastrowid
-        conn.commit()
-        conn.close()
-        return message_id
-    
-    def get_messages(self, user_id):
-        """Get all messages for a user (both sent and received)"""
-        conn = sqlite3.connect(self.db_path)
-        cursor = conn.cursor()
-        cursor.execute('''
-            SELECT m.id, u.name, m.message, m.created_at, m.read_status, 'received' as type
+        """Send a message to a friend (returns None when write-behind queued it)"""
+        def write(cursor):
+            cursor.execute('''
+                INSERT INTO messages (from_user_id, to_user_id, message)
+                VALUES (?, ?, ?)
+            ''', (from_user_id, to_user_id, message))
+            message_id = cursor.lastrowid
+            cursor.execute('''
+                INSERT INTO conversation_unread (user_id, contact_id, unread_count, last_message_id)
+                VALUES (?, ?, 1, ?)
+                ON CONFLICT (user_id, contact_id) DO UPDATE SET
+                    unread_count = unread_count + 1,
+                    last_message_id = excluded.last_message_id
+            ''', (to_user_id, from_user_id, message_id))
+            cursor.execute('SELECT created_at FROM messages WHERE id = ?', (message_id,))
+            return message_id, cursor.fetchone()[0]
+
+        def on_commit(result):
+            message_id, created_at = result
+            sent = {"id": message_id, "message": message, "created_at": created_at}
+            self._publish(to_user_id, 'message', dict(sent, contact_id=from_user_id, read=False, type='received'))
+            self._publish(from_user_id, 'message', dict(sent, contact_id=to_user_id, read=True, type='sent'))
+
+        result = self._deferred_write(write, on_commit if self.events is not None else None)
+        return result[0] if result is not None else None
+
+    def get_messages(self, user_id, limit=None, cursor=None):
+        """Get messages for a user (both sent and received), newest first.
+
+        With ``limit`` or ``cursor``, returns ``(messages, next_cursor)``.
+        """
+        params = [user_id]
+        keyset = ''
+        if cursor is not None:
+            keyset = 'AND (m.created_at, m.id) < (?, ?)'
+            params.extend(decode_cursor(cursor))
+        if cursor is not None and limit is None:
+            limit = DEFAULT_PAGE_SIZE
+        sql = f'''
+            SELECT m.id as id, u.id, u.name, m.message, m.created_at as created_at, m.read_status, 'received' as type
             FROM messages m
             JOIN users u ON m.from_user_id = u.id
-            WHERE m.to_user_id = ?
+            WHERE m.to_user_id = ? {keyset}
             UNION ALL
-            SELECT m.id, u.name, m.message, m.created_at, 1 as read_status, 'sent' as type
+            SELECT m.id, u.id, u.name, m.message, m.created_at, 1 as read_status, 'sent' as type
             FROM messages m
             JOIN users u ON m.to_user_id = u.id
-            WHERE m.from_user_id = ?
-            ORDER BY created_at DESC
-        ''', (user_id, user_id))
-        messages = cursor.fetchall()
-        conn.close()
-        return [{"id": m[0], "contact_name": m[1], "message": m[2], "created_at": m[3], "read": bool(m[4]), "type": m[5]} for m in messages]
\ No newline at end of file
+            WHERE m.from_user_id = ? {keyset}
+            ORDER BY created_at DESC, id DESC
+        '''
+        params = params + params
+        if limit is not None:
+            limit = page_size(limit)
+            sql += ' LIMIT ?'
+            params.append(limit + 1)
+        with self.read() as db_cursor:
+            db_cursor.execute(sql, params)
+            rows = db_cursor.fetchall()
+        messages = [self._message_row(m) for m in rows]
+        if limit is None:
+            return messages
+        return self._page(messages, limit, lambda m: (m["created_at"], m["id"]))
+
+    def _message_row(self, m):
+        return {"id": m[0], "contact_id": m[1], "contact_name": m[2], "message": m[3],
+                "created_at": m[4], "read": bool(m[5]), "type": m[6]}
+
+    def get_messages_since(self, user_id, since=None, limit=None):
+        """Messages sent or received after the ``since`` cursor, oldest first.
+
+        Returns ``(messages, since)``; pass the returned cursor back to get
+        only what arrived in the meantime. Without ``since`` nothing is
+        returned, just the cursor for the current position.
+        """
+        after = None
+        if since:
+            after = decode_cursor(since, size=1)[0]
+            if not isinstance(after, int):
+                raise ValueError("Invalid cursor")
+        with self.read() as cursor:
+            if after is None:
+                cursor.execute('''
+                    SELECT MAX(id) FROM (
+                        SELECT MAX(id) AS id FROM messages WHERE to_user_id = ?
+                        UNION ALL
+                        SELECT MAX(id) FROM messages WHERE from_user_id = ?
+                    )
+                ''', (user_id, user_id))
+                return [], encode_cursor([cursor.fetchone()[0] or 0])
+            cursor.execute('''
+                SELECT m.id as id, u.id, u.name, m.message, m.created_at, m.read_status, 'received'
+                FROM messages m
+                JOIN users u ON m.from_user_id = u.id
+                WHERE m.to_user_id = ? AND m.id > ?
+                UNION ALL
+                SELECT m.id, u.id, u.name, m.message, m.created_at, 1, 'sent'
+                FROM messages m
+                JOIN users u ON m.to_user_id = u.id
+                WHERE m.from_user_id = ? AND m.id > ?
+                ORDER BY id
+                LIMIT ?
+            ''', (user_id, after, user_id, after, page_size(limit or MAX_PAGE_SIZE)))
+            rows = cursor.fetchall()
+        messages = [self._message_row(m) for m in rows]
+        last_id = messages[-1]["id"] if messages else after
+        return messages, encode_cursor([last_id])
+
+    def get_unread_counts(self, user_id):
+        """Unread message count per contact, from the maintained counter table"""
+        with self.read() as cursor:
+            cursor.execute('''
+                SELECT contact_id, unread_count FROM conversation_unread
+                WHERE user_id = ? AND unread_count > 0
+            ''', (user_id,))
+            return dict(cursor.fetchall())
+
+    def mark_conversation_read(self, user_id, contact_id):
+        """Mark every message from ``contact_id`` to ``user_id`` read; returns how many changed"""
+        with self.transaction() as cursor:
+            cursor.execute('''
+                UPDATE messages SET read_status = 1
+                WHERE to_user_id = ? AND from_user_id = ? AND read_status = 0
+            ''', (user_id, contact_id))
+            marked = cursor.rowcount
+            cursor.execute('''
+                UPDATE conversation_unread SET unread_count = 0
+                WHERE user_id = ? AND contact_id = ?
+            ''', (user_id, contact_id))
+            return marked
+
+    # Full-text search
+
+    SEARCH_TYPES = {
+        # type: (fts table, content table, text columns, columns returned)
+        "chat": ("chat_messages_fts", "chat_messages", ["user_message", "ai_response"],
+                 "c.session_id, c.user_message, c.ai_response, c.timestamp"),
+        "tasks": ("tasks_fts", "tasks", ["title"], "c.title, c.status, c.priority, c.created_at"),
+        "goals": ("goals_fts", "goals", ["title"], "c.title, c.progress, c.created_at"),
+        "habits": ("habits_fts", "habits", ["name"], "c.name, c.frequency, c.created_at"),
+    }
+
+    def _search_table(self, search_type, user_id, match, limit, schema='main'):
+        fts, table, text_columns, columns = self.SEARCH_TYPES[search_type]
+        # The query terms only match text columns; the indexed user_id column
+        # narrows MATCH to this user's rows before ranking. c.user_id = ?
+        # still decides ownership, since ids can share tokens.
+        match = '{' + ' '.join(text_columns) + '} : (' + match + ')'
+        if re.search(r'[^\W_]', str(user_id)):
+            match = f'user_id : {fts_phrase(str(user_id))} AND {match}'
+        # Weight 0 keeps the user_id column out of the score
+        rank = f"bm25({fts}, {', '.join(['1.0'] * len(text_columns))}, 0.0)"
+        with self.read() as cursor:
+            cursor.execute(f'''
+                SELECT c.id, {columns}, snippet({fts}, -1, '<mark>', '</mark>', '...', 12), {rank}
+                FROM {schema}.{fts} f
+                JOIN {schema}.{table} c ON c.id = f.rowid
+                WHERE {fts} MATCH ? AND c.user_id = ?
+                ORDER BY {rank}
+                LIMIT ?
+            ''', (match, user_id, limit))
+            rows = cursor.fetchall()
+            names = [d[0].split('.')[-1] for d in cursor.description]
+        names[-2:] = ["snippet", "score"]
+        return [dict(zip(names, row)) for row in rows]
+
+    def search(self, user_id, query, types=None, limit=20):
+        """Ranked full-text search over a user's chat history, tasks, goals and habits.
+
+        Returns ``{type: [matches]}`` with BM25 scores (lower is better) and
+        highlighted snippets. MATCH is scoped to the user's rows, but BM25's
+        IDF and prefix ("term*") expansion still read each term's posting
+        list across all users (see ``benchmarks.py search``).
+        """
+        match = fts_query(query)
+        types = [t for t in (types or self.SEARCH_TYPES) if t in self.SEARCH_TYPES]
+        if not match:
+            return {t: [] for t in types}
+        limit = page_size(limit)
+        results = {t: self._search_table(t, user_id, match, limit) for t in types}
+        if 'chat' in results and self.archive_path:
+            # Archived chat has its own index; merge the two by score
+            archived = self._search_table('chat', user_id, match, limit, schema='archive')
+            results['chat'] = sorted(results['chat'] + archived, key=lambda row: row["score"])[:limit]
+        return results
@@ -0,0 +1,195 @@
+"""In-process pub/sub for server-sent events"""
+import json
+import queue
+import random
+import threading
+import time
+from collections import deque
+
+
+NUDGE_MESSAGES = [
+    "How are your tasks going today?",
+    "Need any help with your to-do list?",
+    "How's your productivity today?"
+]
+
+
+def pick_nudge(tasks, chance=0.3):
+    """Check-in message for a user with pending tasks, or None.
+
+    Only nudges occasionally (``chance`` of the time) so it doesn't nag.
+    """
+    if not any(task['status'] == 'pending' for task in tasks):
+        return None
+    if random.random() > chance:
+        return None
+    return random.choice(NUDGE_MESSAGES)
+
+
+def format_sse(event):
+    """Encode an event dict as a text/event-stream frame"""
+    frame = f"event: {event['event']}\ndata: {json.dumps(event['data'])}\n\n"
+    if event.get('id') is not None:
+        frame = f"id: {event['id']}\n" + frame
+    return frame
+
+
+class Subscription:
+    """One connected stream's queue of events for a user"""
+
+    def __init__(self, bus, user_id, max_queue):
+        self.bus = bus
+        self.user_id = user_id
+        self.queue = queue.Queue(maxsize=max_queue)
+
+    def get(self, timeout=None):
+        """Next event dict, or None if nothing arrived within ``timeout``"""
+        try:
+            return self.queue.get(timeout=timeout)
+        except queue.Empty:
+            return None
+
+    def close(self):
+        self.bus.unsubscribe(self)
+
+
+class EventBus:
+    """Fans events out to every open stream of the user they're addressed to.
+
+    Each event gets an increasing id, and the last ``history`` events per
+    user are kept so a reconnecting client that sends ``Last-Event-ID`` gets
+    whatever it missed. History of a user with no open stream is dropped
+    ``history_ttl`` seconds after their last event or disconnect. Ids start
+    from the current time in milliseconds so they keep increasing across
+    restarts; an id newer than any issued here (a clock step back) replays
+    all kept history. A subscriber whose queue is full (a stalled client)
+    loses the event rather than blocking the publisher.
+    """
+
+    def __init__(self, history=50, max_queue=100, history_ttl=300.0):
+        self.history = history
+        self.max_queue = max_queue
+        self.history_ttl = history_ttl
+        self._subscribers = {}  # user_id -> set of Subscription
+        self._recent = {}       # user_id -> deque of recent events
+        self._touched = {}      # user_id -> monotonic time of last event or disconnect
+        self._next_id = int(time.time() * 1000)
+        self._next_sweep = time.monotonic() + history_ttl
+        self._lock = threading.Lock()
+        self._stats = {"published": 0, "delivered": 0, "dropped": 0, "replayed": 0, "expired_histories": 0}
+
+    def subscribe(self, user_id, last_event_id=None):
+        """Open a stream for ``user_id``, replaying events after ``last_event_id``"""
+        subscription = Subscription(self, user_id, self.max_queue)
+        with self._lock:
+            self._subscribers.setdefault(user_id, set()).add(subscription)
+            if last_event_id is not None:
+                if last_event_id >= self._next_id:
+                    last_event_id = 0
+                for event in self._recent.get(user_id, ()):
+                    if event['id'] > last_event_id and not subscription.queue.full():
+                        subscription.queue.put_nowait(event)
+                        self._stats["replayed"] += 1
+        return subscription
+
+    def unsubscribe(self, subscription):
+        with self._lock:
+            subscribers = self._subscribers.get(subscription.user_id)
+            if subscribers is not None:
+                subscribers.discard(subscription)
+                if not subscribers:
+                    del self._subscribers[subscription.user_id]
+                    self._touched[subscription.user_id] = time.monotonic()
+
+    def publish(self, user_id, event_type, data):
+        """Send ``data`` as an ``event_type`` event to ``user_id``'s streams"""
+        with self._lock:
+            event = {"id": self._next_id, "event": event_type, "data": data}
+            self._next_id += 1
+            self._stats["published"] += 1
+            now = time.monotonic()
+            if now >= self._next_sweep:
+                self._expire_history(now)
+            recent = self._recent.get(user_id)
+            if recent is None:
+                recent = self._recent[user_id] = deque(maxlen=self.history)
+            recent.append(event)
+            self._touched[user_id] = now
+            for subscription in self._subscribers.get(user_id, ()):
+                try:
+                    subscription.queue.put_nowait(event)
+                    self._stats["delivered"] += 1
+                except queue.Full:
+                    self._stats["dropped"] += 1
+        return event
+
+    def _expire_history(self, now):
+        """Forget history of users without a stream, idle for history_ttl (lock held)"""
+        cutoff = now - self.history_ttl
+        for user_id in [u for u, touched in self._touched.items() if touched < cutoff]:
+            if user_id not in self._subscribers:
+                del self._touched[user_id]
+                self._recent.pop(user_id, None)
+                self._stats["expired_histories"] += 1
+        self._next_sweep = now + min(self.history_ttl, 60.0)
+
+    def connected_users(self):
+        with self._lock:
+            return list(self._subscribers)
+
+    def get_stats(self):
+        with self._lock:
+            stats = dict(self._stats)
+            stats["connected_users"] = len(self._subscribers)
+            stats["streams"] = sum(len(s) for s in self._subscribers.values())
+            stats["users_with_history"] = len(self._recent)
+        return stats
+
+
+class NudgeWorker:
+    """Daemon thread that pushes check-in nudges to connected users.
+
+    Every ``interval`` seconds, each user with an open stream and pending
+    tasks may get a "nudge" event. Users without a stream cost nothing.
+    """
+
+    def __init__(self, bus, db, interval=600, chance=0.3):
+        self.bus = bus
+        self.db = db
+        self.interval = interval
+        self.chance = chance
+        self._stop = threading.Event()
+        self._lock = threading.Lock()
+        self._stats = {"runs": 0, "nudges": 0, "failures": 0}
+        self._thread = threading.Thread(target=self._run, name="nudge-worker", daemon=True)
+        self._thread.start()
+
+    def run_once(self):
+        """Nudge every connected user once; returns the number nudged"""
+        nudged = 0
+        for user_id in self.bus.connected_users():
+            message = pick_nudge(self.db.get_tasks(user_id), self.chance)
+            if message:
+                self.bus.publish(user_id, 'nudge', {"message": message, "created_at": int(time.time())})
+                nudged += 1
+        with self._lock:
+            self._stats["runs"] += 1
+            self._stats["nudges"] += nudged
+        return nudged
+
+    def close(self):
+        self._stop.set()
+        self._thread.join()
+
+    def get_stats(self):
+        with self._lock:
+            return dict(self._stats)
+
+    def _run(self):
+        while not self._stop.wait(self.interval):
+            try:
+                self.run_once()
+            except Exception as e:
+                with self._lock:
+                    self._stats["failures"] += 1
+                print(f"Nudge run failed: {e}")
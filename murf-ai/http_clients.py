@@ -0,0 +1,135 @@
+"""Pooled, keep-alive HTTP clients for the Groq, Murf and Deepgram APIs"""
+import base64
+import re
+import threading
+
+import aiohttp
+
+
+class UpstreamClient:
+    """One long-lived aiohttp session per upstream host.
+
+    The session keeps connections alive between requests, caps them per
+    host, caches DNS lookups and applies connect/read timeouts, so the hot
+    path skips the DNS, TCP and TLS handshakes after the first call. It is
+    created on first use and bound to the event loop it was used on (the
+    shared AsyncRuntime loop). aiohttp speaks HTTP/1.1 only, so keep-alive
+    reuse is what replaces HTTP/2 multiplexing here.
+    """
+
+    def __init__(self, name, limit_per_host=20, connect_timeout=5.0, read_timeout=30.0,
+                 dns_ttl=300, keepalive=60.0):
+        self.name = name
+        self.limit_per_host = limit_per_host
+        self.timeout = aiohttp.ClientTimeout(total=None, connect=connect_timeout, sock_read=read_timeout)
+        self.dns_ttl = dns_ttl
+        self.keepalive = keepalive
+        self._session = None
+        self._lock = threading.Lock()
+        self._stats = {
+            "requests": 0,
+            "errors": 0,
+            "new_connections": 0,
+            "reused_connections": 0,
+            "dns_lookups": 0,
+            "dns_cache_hits": 0,
+        }
+
+    def session(self):
+        """The shared session, created on the calling event loop the first time"""
+        if self._session is None or self._session.closed:
+            connector = aiohttp.TCPConnector(
+                limit_per_host=self.limit_per_host,
+                ttl_dns_cache=self.dns_ttl,
+                keepalive_timeout=self.keepalive
+            )
+            self._session = aiohttp.ClientSession(
+                connector=connector, timeout=self.timeout, trace_configs=[self._trace_config()]
+            )
+        return self._session
+
+    def post(self, url, **kwargs):
+        """``session.post`` on the pooled session; use as ``async with``"""
+        return self.session().post(url, **kwargs)
+
+    async def close(self):
+        if self._session is not None and not self._session.closed:
+            await self._session.close()
+        self._session = None
+
+    def _count(self, key):
+        async def hook(session, context, params):
+            with self._lock:
+                self._stats[key] += 1
+        return hook
+
+    def _trace_config(self):
+        trace = aiohttp.TraceConfig()
+        trace.on_request_end.append(self._count("requests"))
+        trace.on_request_exception.append(self._count("errors"))
+        trace.on_connection_create_end.append(self._count("new_connections"))
+        trace.on_connection_reuseconn.append(self._count("reused_connections"))
+        trace.on_dns_resolvehost_end.append(self._count("dns_lookups"))
+        trace.on_dns_cache_hit.append(self._count("dns_cache_hits"))
+        return trace
+
+    def get_stats(self):
+        with self._lock:
+            stats = dict(self._stats)
+        connections = stats["new_connections"] + stats["reused_connections"]
+        stats["reuse_ratio"] = round(stats["reused_connections"] / connections, 4) if connections else 0.0
+        stats["open"] = self._session is not None and not self._session.closed
+        return stats
+
+
+class Base64FieldDecoder:
+    """Decodes one base64 string field of a JSON body as the body streams in.
+
+    ``feed`` each chunk and get back whatever audio bytes can be decoded so
+    far, so neither the whole JSON text nor the base64 string is ever held
+    in memory. ``done`` turns true once the field's closing quote is seen.
+    """
+
+    _VALUE_START = re.compile(rb'\s*:\s*"')
+
+    def __init__(self, field):
+        self.marker = b'"' + field.encode() + b'"'
+        self.done = False
+        self._in_value = False
+        self._buffer = b''
+
+    def feed(self, chunk):
+        if self.done:
+            return b''
+        self._buffer += chunk
+        if not self._in_value and not self._find_value():
+            return b''
+        # Base64 has no backslashes, so dropping them undoes JSON's "\/"
+        self._buffer = self._buffer.replace(b'\\', b'')
+        end = self._buffer.find(b'"')
+        if end >= 0:
+            data, self._buffer, self.done = self._buffer[:end], b'', True
+        else:
+            usable = len(self._buffer) - len(self._buffer) % 4
+            data, self._buffer = self._buffer[:usable], self._buffer[usable:]
+        return base64.b64decode(data)
+
+    def _find_value(self):
+        """Skip ahead to the field's value; False if it hasn't arrived yet"""
+        while True:
+            index = self._buffer.find(self.marker)
+            if index < 0:
+                # Keep enough to match a marker split across chunks
+                self._buffer = self._buffer[-len(self.marker):]
+                return False
+            rest = self._buffer[index + len(self.marker):]
+            match = self._VALUE_START.match(rest)
+            if match:
+                self._buffer = rest[match.end():]
+                self._in_value = True
+                return True
+            if not rest.strip(b' \t\r\n:'):
+                self._buffer = self._buffer[index:]
+                return False
+            self._buffer = rest
+
@@ -0,0 +1,442 @@
+"""Versioned schema migrations for the productivity database.
+
+Each migration is a ``(version, name, steps)`` tuple. Steps are SQL strings
+or callables taking a cursor, and must be idempotent so a half-applied
+database can simply be migrated again. Applied versions are recorded in the
+``schema_version`` table.
+
+Usage:
+    python migrations.py status  [--db productivity_app.db]
+    python migrations.py migrate [--db productivity_app.db]
+    python migrations.py check
+"""
+import argparse
+import os
+import re
+import sqlite3
+import sys
+import tempfile
+
+
+def fts_steps(table, columns, schema=None):
+    """Steps for an external-content FTS5 index over ``table`` kept in sync by triggers.
+
+    ``schema`` creates the index in an attached database next to ``table``.
+    """
+    fts = f'{table}_fts'
+    prefix = f'{schema}.' if schema else ''
+    column_list = ', '.join(columns)
+    new_values = ', '.join(f'new.{column}' for column in columns)
+    old_values = ', '.join(f'old.{column}' for column in columns)
+    return [
+        f"CREATE VIRTUAL TABLE IF NOT EXISTS {prefix}{fts} USING fts5({column_list}, content='{table}', content_rowid='id', tokenize='porter unicode61')",
+        f'''CREATE TRIGGER IF NOT EXISTS {prefix}{fts}_insert AFTER INSERT ON {table} BEGIN
+            INSERT INTO {fts} (rowid, {column_list}) VALUES (new.id, {new_values});
+        END''',
+        f'''CREATE TRIGGER IF NOT EXISTS {prefix}{fts}_delete AFTER DELETE ON {table} BEGIN
+            INSERT INTO {fts} ({fts}, rowid, {column_list}) VALUES ('delete', old.id, {old_values});
+        END''',
+        f'''CREATE TRIGGER IF NOT EXISTS {prefix}{fts}_update AFTER UPDATE OF {column_list} ON {table} BEGIN
+            INSERT INTO {fts} ({fts}, rowid, {column_list}) VALUES ('delete', old.id, {old_values});
+            INSERT INTO {fts} (rowid, {column_list}) VALUES (new.id, {new_values});
+        END''',
+        # Index rows that existed before the triggers
+        f"INSERT INTO {prefix}{fts} ({fts}) VALUES ('rebuild')",
+    ]
+
+
+def user_fts_steps(table, columns, schema=None):
+    """Steps replacing ``table``'s FTS index with one that also indexes ``user_id``.
+
+    Searches put the user id in the MATCH expression, so FTS5 only walks
+    that user's postings instead of ranking every user's matches.
+    """
+    fts = f'{table}_fts'
+    prefix = f'{schema}.' if schema else ''
+    drops = [f'DROP TRIGGER IF EXISTS {prefix}{fts}_{event}' for event in ('insert', 'delete', 'update')]
+    return drops + [f'DROP TABLE IF EXISTS {prefix}{fts}'] + fts_steps(table, columns + ['user_id'], schema)
+
+
+def add_column(table, column, definition):
+    """Step adding ``column`` to ``table`` unless it already exists"""
+    def step(cursor):
+        cursor.execute(f'PRAGMA table_info({table})')
+        if column not in [row[1] for row in cursor.fetchall()]:
+            cursor.execute(f'ALTER TABLE {table} ADD COLUMN {column} {definition}')
+    return step
+
+
+def create_user_search_index(cursor):
+    """Trigram index over user emails and names for substring search.
+
+    The trigram tokenizer needs SQLite 3.34+; on older builds user search
+    falls back to prefix lookups on the lower(email)/lower(name) indexes.
+    """
+    try:
+        cursor.execute("CREATE VIRTUAL TABLE IF NOT EXISTS users_search USING fts5(email, name, tokenize='trigram')")
+    except sqlite3.OperationalError as e:
+        print(f"Trigram user search unavailable ({e}); using prefix search")
+        return
+    # Rowids mirror users.rowid; Database.add_user keeps them in step
+    cursor.execute('DELETE FROM users_search')
+    cursor.execute('INSERT INTO users_search (rowid, email, name) SELECT rowid, email, name FROM users')
+
+
+def create_chat_archive(cursor, schema='archive'):
+    """Create the cold chat_messages table and its search index in an attached database.
+
+    Archived rows keep their original ids, so the archive table has no
+    AUTOINCREMENT of its own.
+    """
+    cursor.execute(f'''
+        CREATE TABLE IF NOT EXISTS {schema}.chat_messages (
+            id INTEGER PRIMARY KEY,
+            user_id TEXT NOT NULL,
+            session_id TEXT NOT NULL,
+            user_message TEXT NOT NULL,
+            ai_response TEXT NOT NULL,
+            timestamp DATETIME
+        )
+    ''')
+    cursor.execute(f'CREATE INDEX IF NOT EXISTS {schema}.idx_chat_user_session_time ON chat_messages (user_id, session_id, timestamp, id)')
+    cursor.execute(f"SELECT sql FROM {schema}.sqlite_master WHERE name = 'chat_messages_fts'")
+    row = cursor.fetchone()
+    if row is None or 'user_id' not in row[0]:
+        for step in user_fts_steps('chat_messages', ['user_message', 'ai_response'], schema):
+            cursor.execute(step)
+
+
+MIGRATIONS = [
+    (1, "chat history indexes", [
+        # get_recent_chat_history: WHERE user_id ORDER BY timestamp
+        'CREATE INDEX IF NOT EXISTS idx_chat_messages_user_time ON chat_messages (user_id, timestamp)',
+        # get_chat_sessions / get_session_messages / delete_chat_session
+        'CREATE INDEX IF NOT EXISTS idx_chat_messages_user_session ON chat_messages (user_id, session_id, timestamp)',
+    ]),
+    (2, "per-user list indexes", [
+        # Covering indexes for get_tasks / get_goals / get_habits
+        'CREATE INDEX IF NOT EXISTS idx_tasks_user_created ON tasks (user_id, created_at, title, status, priority)',
+        'CREATE INDEX IF NOT EXISTS idx_goals_user_created ON goals (user_id, created_at, title, progress)',
+        'CREATE INDEX IF NOT EXISTS idx_habits_user_created ON habits (user_id, created_at, name, streak, frequency)',
+        'CREATE INDEX IF NOT EXISTS idx_subgoals_goal ON subgoals (goal_id, title, completed, credits)',
+    ]),
+    (3, "friend indexes", [
+        'CREATE INDEX IF NOT EXISTS idx_friend_requests_to_status ON friend_requests (to_user_id, status, created_at, from_user_id)',
+        'CREATE INDEX IF NOT EXISTS idx_friends_user1 ON friends (user1_id, user2_id)',
+        'CREATE INDEX IF NOT EXISTS idx_friends_user2 ON friends (user2_id, user1_id)',
+    ]),
+    (4, "message inbox and outbox indexes", [
+        'CREATE INDEX IF NOT EXISTS idx_messages_to_created ON messages (to_user_id, created_at)',
+        'CREATE INDEX IF NOT EXISTS idx_messages_from_created ON messages (from_user_id, created_at)',
+    ]),
+    (5, "keyset pagination order for per-user lists", [
+        # Put id right after created_at so (created_at, id) keysets stay covered and ordered
+        'DROP INDEX IF EXISTS idx_tasks_user_created',
+        'DROP INDEX IF EXISTS idx_goals_user_created',
+        'DROP INDEX IF EXISTS idx_habits_user_created',
+        'CREATE INDEX IF NOT EXISTS idx_tasks_user_created_id ON tasks (user_id, created_at, id, title, status, priority)',
+        'CREATE INDEX IF NOT EXISTS idx_goals_user_created_id ON goals (user_id, created_at, id, title, progress)',
+        'CREATE INDEX IF NOT EXISTS idx_habits_user_created_id ON habits (user_id, created_at, id, name, streak, frequency)',
+    ]),
+    (6, "full-text search over chat history, tasks, goals and habits", (
+        fts_steps('chat_messages', ['user_message', 'ai_response'])
+        + fts_steps('tasks', ['title'])
+        + fts_steps('goals', ['title'])
+        + fts_steps('habits', ['name'])
+    )),
+    (7, "indexed user search by email and name", [
+        'CREATE INDEX IF NOT EXISTS idx_users_email_lower ON users (lower(email))',
+        'CREATE INDEX IF NOT EXISTS idx_users_name_lower ON users (lower(name))',
+        create_user_search_index,
+    ]),
+    (8, "symmetric friendship adjacency", [
+        '''
+        CREATE TABLE IF NOT EXISTS friendships (
+            user_id TEXT NOT NULL,
+            friend_id TEXT NOT NULL,
+            created_at DATETIME DEFAULT CURRENT_TIMESTAMP,
+            PRIMARY KEY (user_id, friend_id),
+            FOREIGN KEY (user_id) REFERENCES users (id),
+            FOREIGN KEY (friend_id) REFERENCES users (id)
+        ) WITHOUT ROWID
+        ''',
+        # Both directions of every legacy friends row
+        '''
+        INSERT OR IGNORE INTO friendships (user_id, friend_id, created_at)
+        SELECT user1_id, user2_id, created_at FROM friends WHERE user1_id != user2_id
+        UNION ALL
+        SELECT user2_id, user1_id, created_at FROM friends WHERE user1_id != user2_id
+        ''',
+    ]),
+    (9, "chat session summaries", [
+        '''
+        CREATE TABLE IF NOT EXISTS chat_sessions (
+            user_id TEXT NOT NULL,
+            session_id TEXT NOT NULL,
+            created_at DATETIME DEFAULT CURRENT_TIMESTAMP,
+            last_activity DATETIME DEFAULT CURRENT_TIMESTAMP,
+            message_count INTEGER DEFAULT 0,
+            title TEXT NOT NULL DEFAULT '',
+            PRIMARY KEY (user_id, session_id)
+        ) WITHOUT ROWID
+        ''',
+        'CREATE INDEX IF NOT EXISTS idx_chat_sessions_user_created ON chat_sessions (user_id, created_at, session_id, title, last_activity, message_count)',
+        '''
+        INSERT OR REPLACE INTO chat_sessions (user_id, session_id, created_at, last_activity, message_count, title)
+        SELECT user_id, session_id, MIN(timestamp), MAX(timestamp), COUNT(*),
+               substr(GROUP_CONCAT(user_message, ' '), 1, 51)
+        FROM chat_messages
+        GROUP BY user_id, session_id
+        ''',
+    ]),
+    (10, "persistent habit completion log", [
+        '''
+        CREATE TABLE IF NOT EXISTS habit_logs (
+            habit_id INTEGER PRIMARY KEY,
+            start_day INTEGER NOT NULL,
+            bitmap BLOB NOT NULL,
+            last_day INTEGER NOT NULL,
+            current_streak INTEGER NOT NULL DEFAULT 0,
+            longest_streak INTEGER NOT NULL DEFAULT 0,
+            total INTEGER NOT NULL DEFAULT 0,
+            FOREIGN KEY (habit_id) REFERENCES habits (id)
+        )
+        ''',
+    ]),
+    (11, "chat session archival", [
+        add_column('chat_sessions', 'archived', 'INTEGER NOT NULL DEFAULT 0'),
+        'CREATE INDEX IF NOT EXISTS idx_chat_sessions_archivable ON chat_sessions (last_activity) WHERE archived = 0',
+    ]),
+    (12, "unread counters and incremental inbox sync", [
+        '''
+        CREATE TABLE IF NOT EXISTS conversation_unread (
+            user_id TEXT NOT NULL,
+            contact_id TEXT NOT NULL,
+            unread_count INTEGER NOT NULL DEFAULT 0,
+            last_message_id INTEGER,
+            PRIMARY KEY (user_id, contact_id)
+        ) WITHOUT ROWID
+        ''',
+        '''
+        INSERT OR REPLACE INTO conversation_unread (user_id, contact_id, unread_count, last_message_id)
+        SELECT to_user_id, from_user_id, SUM(read_status = 0), MAX(id)
+        FROM messages
+        GROUP BY to_user_id, from_user_id
+        ''',
+        # get_messages_since: WHERE to/from_user_id = ? AND id > ?
+        'CREATE INDEX IF NOT EXISTS idx_messages_to_id ON messages (to_user_id, id)',
+        'CREATE INDEX IF NOT EXISTS idx_messages_from_id ON messages (from_user_id, id)',
+        'CREATE INDEX IF NOT EXISTS idx_messages_unread ON messages (to_user_id, from_user_id) WHERE read_status = 0',
+    ]),
+    (13, "per-user full-text search", (
+        user_fts_steps('chat_messages', ['user_message', 'ai_response'])
+        + user_fts_steps('tasks', ['title'])
+        + user_fts_steps('goals', ['title'])
+        + user_fts_steps('habits', ['name'])
+    )),
+]
+
+
+def ensure_version_table(cursor):
+    cursor.execute('''
+        CREATE TABLE IF NOT EXISTS schema_version (
+            version INTEGER PRIMARY KEY,
+            name TEXT NOT NULL,
+            applied_at DATETIME DEFAULT CURRENT_TIMESTAMP
+        )
+    ''')
+
+
+def get_current_version(cursor):
+    """Highest applied migration version (0 for a fresh database)"""
+    ensure_version_table(cursor)
+    cursor.execute('SELECT MAX(version) FROM schema_version')
+    version = cursor.fetchone()[0]
+    return version or 0
+
+
+def pending_migrations(cursor):
+    current = get_current_version(cursor)
+    return [m for m in sorted(MIGRATIONS, key=lambda m: m[0]) if m[0] > current]
+
+
+def apply_migrations(cursor, target=None):
+    """Apply pending migrations in order, returning the versions applied.
+
+    Runs inside the caller's transaction so a failing step leaves the
+    schema version untouched.
+    """
+    applied = []
+    for version, name, steps in pending_migrations(cursor):
+        if target is not None and version > target:
+            break
+        for step in steps:
+            if callable(step):
+                step(cursor)
+            else:
+                cursor.execute(step)
+        cursor.execute('INSERT OR REPLACE INTO schema_version (version, name) VALUES (?, ?)', (version, name))
+        applied.append(version)
+    return applied
+
+
+# Query plan checking
+
+# Plan rows that read a whole table or index rather than seeking into it
+_SCAN_PATTERN = re.compile(r'^SCAN (\w+)( USING (COVERING )?INDEX \w+)?$')
+
+# Queries that are known to scan, keyed by a substring of their SQL.
+# Statements run while opening the database (migrations, backfills) are
+# not checked.
+KNOWN_SCANS = {
+    # Short user searches: substring matches after the prefix lookups,
+    # bounded by LIMIT (Database.search_users)
+    'instr(lower(': "short-query substring search",
+}
+
+
+def find_table_scans(cursor, sql):
+    """Return the plan details of any full scans in ``sql``"""
+    cursor.execute('EXPLAIN QUERY PLAN ' + sql)
+    return [row[3] for row in cursor.fetchall() if _SCAN_PATTERN.match(row[3])]
+
+
+def _exercise_database(db):
+    """Call every query method on ``db`` with small sample data"""
+    from database import encode_cursor
+    from events import EventBus
+
+    db.enable_events(EventBus())
+    db.add_user('alice', 'alice@example.com', 'Alice Smith')
+    db.add_user('bob', 'bob@example.com', 'Bob Jones')
+    task_id = db.add_task('alice', 'write report')
+    goal_id = db.add_goal('alice', 'run a marathon')
+    subgoal_id = db.add_subgoal(goal_id, 'buy shoes', 2)
+    habit_id = db.add_habit('alice', 'exercise')
+    request_id = db.send_friend_request('bob', 'alice')
+    db.add_chat_message('alice', 'session_1', 'hello', 'hi there')
+    db.add_chat_message('alice', 'session_1', 'how are you?', 'great')
+
+    db.get_recent_chat_history('alice', 5)
+    db.get_tasks('alice')
+    db.get_tasks('alice', limit=10, cursor=encode_cursor(['2100-01-01 00:00:00', 1000]))
+    db.complete_task(task_id)
+    db.get_goals('alice')
+    db.get_goals('alice', limit=10, cursor=encode_cursor(['2100-01-01 00:00:00', 1000]))
+    db.get_goals_with_subgoals('alice')
+    db.get_goals_with_subgoals('alice', limit=10, cursor=encode_cursor(['2100-01-01 00:00:00', 1000]))
+    db.complete_goal(goal_id)
+    db.update_goal_progress(goal_id, 50)
+    db.get_subgoals(goal_id)
+    db.toggle_subgoal(goal_id, subgoal_id)
+    db.get_habits('alice')
+    db.get_habits('alice', limit=10, cursor=encode_cursor(['2100-01-01 00:00:00', 1000]))
+    db.log_habit(habit_id)
+    db.log_habit(habit_id)
+    db.get_habit_logs('alice')
+    db.search_users_by_email('bob')
+    db.search_users_by_email('bo')
+    db.search_users('jones')
+    db.get_pending_friend_requests('alice')
+    db.respond_to_friend_request(request_id, 'accepted')
+    db.get_friends('alice')
+    db.get_friend_by_name('alice', 'bob')
+    db.add_user('bob', 'bob@example.com', 'Bobby Jones')
+    db.get_friends('alice')
+    db.send_message('alice', 'bob', 'keep going!')
+    db.get_messages('alice')
+    db.get_messages('alice', limit=10, cursor=encode_cursor(['2100-01-01 00:00:00', 1000]))
+    db.get_messages_since('alice')
+    db.get_messages_since('bob', since=encode_cursor([0]))
+    db.get_unread_counts('bob')
+    db.mark_conversation_read('bob', 'alice')
+    db.get_chat_sessions('alice')
+    db.get_chat_sessions('alice', limit=10, cursor=encode_cursor(['2100-01-01 00:00:00', 'session_9']))
+    db.get_session_messages('alice', 'session_1')
+    db.get_session_messages('alice', 'session_1', limit=10, cursor=encode_cursor(['2000-01-01 00:00:00', 0]))
+    db.search('alice', 'report hello')
+    db.archive_chat_sessions(older_than_days=-1)
+    db.get_session_messages('alice', 'session_1')
+    db.search('alice', 'hello', types=['chat'])
+    db.compact()
+    db.delete_chat_session('alice', 'session_1')
+    db.delete_habit(habit_id)
+    db.remove_friend('alice', 'bob')
+
+
+def check_query_plans(verbose=False):
+    """Run every Database query against a scratch database and report scans.
+
+    Returns a list of ``(sql, scans)`` for queries that read a full table.
+    """
+    from database import Database
+
+    statements = []
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        db = Database(os.path.join(tmp_dir, 'plan_check.db'), trace_callback=statements.append,
+                      archive_path=os.path.join(tmp_dir, 'plan_check_archive.db'))
+        del statements[:]
+        try:
+            _exercise_database(db)
+            failures = []
+            seen = set()
+            with db.read() as cursor:
+                for sql in statements:
+                    normalized = ' '.join(sql.split())
+                    if normalized in seen or not re.match(r'^(SELECT|UPDATE|DELETE|INSERT)\b', normalized, re.I):
+                        continue
+                    seen.add(normalized)
+                    scans = find_table_scans(cursor, normalized)
+                    if scans and any(marker in normalized for marker in KNOWN_SCANS):
+                        continue
+                    if verbose:
+                        print(('SCAN  ' if scans else 'ok    ') + normalized[:100])
+                    if scans:
+                        failures.append((normalized, scans))
+            return failures
+        finally:
+            db.close()
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Manage productivity database schema migrations")
+    parser.add_argument('command', choices=['status', 'migrate', 'check'])
+    parser.add_argument('--db', default='productivity_app.db', help="database file (default: productivity_app.db)")
+    parser.add_argument('--to', type=int, default=None, help="migrate up to this version only")
+    parser.add_argument('-v', '--verbose', action='store_true')
+    args = parser.parse_args(argv)
+
+    if args.command == 'check':
+        failures = check_query_plans(verbose=args.verbose)
+        for sql, scans in failures:
+            print(f"Full scan ({', '.join(scans)}): {sql}")
+        if failures:
+            print(f"{len(failures)} queries scan whole tables")
+            return 1
+        print("All queries use indexes")
+        return 0
+
+    conn = sqlite3.connect(args.db)
+    try:
+        cursor = conn.cursor()
+        if args.command == 'status':
+            print(f"Current schema version: {get_current_version(cursor)}")
+            for version, name, _ in pending_migrations(cursor):
+                print(f"  pending {version}: {name}")
+            conn.commit()
+        else:
+            # Database creates the base tables before migrating
+            from database import Database
+            conn.close()
+            db = Database(args.db, run_migrations=False)
+            with db.transaction() as cursor:
+                applied = apply_migrations(cursor, target=args.to)
+            db.close()
+            print(f"Applied migrations: {applied}" if applied else "Database is up to date")
+    finally:
+        conn.close()
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,355 @@
+"""Optional user-sharded storage.
+
+Per-user tables (tasks, goals, subgoals, habits, habit logs and chat
+history) are spread over N SQLite files by a stable hash of the user id, so
+users on different shards never wait on the same write lock. Global tables
+(users, friends, friend requests, messages and unread counters) live in a
+directory shard.
+
+Row ids in shard ``i`` start at ``i << ID_SHARD_SHIFT``, so calls that only
+carry a task/goal/habit id are routed without a lookup.
+
+Usage:
+    python sharding.py migrate   --source productivity_app.db --to shards --shards 4
+    python sharding.py rebalance --source shards --to shards_8 --shards 8
+    python sharding.py status    --dir shards
+"""
+import argparse
+import hashlib
+import os
+import sys
+from collections import defaultdict
+
+from database import Database
+from migrations import create_user_search_index
+
+ID_SHARD_SHIFT = 40  # 2**40 ids per shard; ids stay below 2**53 up to 4096 shards
+ID_TABLES = ('tasks', 'goals', 'subgoals', 'habits', 'chat_messages')
+GLOBAL_TABLES = ('users', 'friend_requests', 'friends', 'friendships', 'messages', 'conversation_unread')
+COPY_BATCH = 5000
+
+
+def jump_hash(user_id, shard_count):
+    """Jump consistent hash of ``user_id`` onto 0..shard_count-1.
+
+    Growing from N to M shards only moves about (M - N) / M of the users.
+    """
+    key = int.from_bytes(hashlib.blake2b(str(user_id).encode(), digest_size=8).digest(), 'big')
+    bucket, candidate = -1, 0
+    while candidate < shard_count:
+        bucket = candidate
+        key = (key * 2862933555777941757 + 1) & 0xFFFFFFFFFFFFFFFF
+        candidate = int((bucket + 1) * ((1 << 31) / ((key >> 33) + 1)))
+    return bucket
+
+
+def shard_path(directory, index):
+    return os.path.join(directory, f'shard_{index:03d}.db')
+
+
+def reserve_id_range(db, index, base=None):
+    """Start the shard's AUTOINCREMENT sequences at ``index << ID_SHARD_SHIFT`` (or ``base[table]``)"""
+    with db.transaction() as cursor:
+        for table in ID_TABLES:
+            if base is None:
+                start = index << ID_SHARD_SHIFT
+            elif table in base:
+                start = base[table]
+            else:
+                continue
+            cursor.execute('SELECT seq FROM sqlite_sequence WHERE name = ?', (table,))
+            row = cursor.fetchone()
+            if row is None:
+                cursor.execute('INSERT INTO sqlite_sequence (name, seq) VALUES (?, ?)', (table, start))
+            elif row[0] < start:
+                cursor.execute('UPDATE sqlite_sequence SET seq = ? WHERE name = ?', (start, table))
+
+
+class ShardedDatabase:
+    """Drop-in replacement for Database that routes each call to its shard.
+
+    Methods taking a user id go to that user's shard, methods taking a row
+    id from a per-user table go to the shard encoded in the id, and
+    everything else goes to the directory shard.
+    """
+
+    USER_METHODS = {
+        'add_chat_message', 'get_recent_chat_history', 'get_chat_sessions', 'get_session_messages',
+        'delete_chat_session', 'add_task', 'get_tasks', 'add_goal', 'get_goals',
+        'get_goals_with_subgoals', 'add_habit', 'get_habits', 'get_habit_logs', 'search',
+    }
+    ID_METHODS = {
+        'complete_task', 'complete_goal', 'update_goal_progress', 'add_subgoal', 'get_subgoals',
+        'toggle_subgoal', 'delete_habit', 'log_habit',
+    }
+
+    def __init__(self, directory, shard_count=None, archive=False, **db_options):
+        os.makedirs(directory, exist_ok=True)
+        self.path = directory
+        self.directory = Database(os.path.join(directory, 'directory.db'), **db_options)
+        self.shard_count = self._configure(shard_count)
+        self.shards = []
+        for index in range(self.shard_count):
+            archive_path = os.path.join(directory, f'shard_{index:03d}_archive.db') if archive else None
+            shard = Database(shard_path(directory, index), archive_path=archive_path, **db_options)
+            reserve_id_range(shard, index)
+            self.shards.append(shard)
+
+    def _configure(self, shard_count):
+        """Record the shard count in the directory, refusing to reopen with another"""
+        with self.directory.transaction() as cursor:
+            cursor.execute('CREATE TABLE IF NOT EXISTS shard_config (key TEXT PRIMARY KEY, value TEXT NOT NULL)')
+            cursor.execute("SELECT value FROM shard_config WHERE key = 'shard_count'")
+            row = cursor.fetchone()
+            if row is None:
+                if not shard_count:
+                    raise ValueError(f"{self.path} is not a sharded database; pass shard_count to create one")
+                cursor.execute("INSERT INTO shard_config (key, value) VALUES ('shard_count', ?)", (str(shard_count),))
+                return shard_count
+        if shard_count and int(row[0]) != shard_count:
+            raise ValueError(f"{self.path} has {row[0]} shards, not {shard_count}; use 'sharding.py rebalance'")
+        return int(row[0])
+
+    def shard_index(self, user_id):
+        return jump_hash(user_id, self.shard_count)
+
+    def shard_for_user(self, user_id):
+        return self.shards[self.shard_index(user_id)]
+
+    def shard_for_id(self, row_id):
+        index = int(row_id) >> ID_SHARD_SHIFT
+        if index >= self.shard_count:
+            raise ValueError(f"Id {row_id} does not belong to any shard")
+        return self.shards[index]
+
+    def __getattr__(self, name):
+        if name.startswith('_'):
+            raise AttributeError(name)
+        if name in self.USER_METHODS:
+            def call(user_id, *args, **kwargs):
+                return getattr(self.shard_for_user(user_id), name)(user_id, *args, **kwargs)
+        elif name in self.ID_METHODS:
+            def call(row_id, *args, **kwargs):
+                return getattr(self.shard_for_id(row_id), name)(row_id, *args, **kwargs)
+        else:
+            return getattr(self.directory, name)
+        return call
+
+    def all_databases(self):
+        return [self.directory] + self.shards
+
+    def enable_write_behind(self, **options):
+        for db in self.all_databases():
+            db.enable_write_behind(**options)
+
+    def enable_events(self, bus):
+        for db in self.all_databases():
+            db.enable_events(bus)
+        return bus
+
+    def flush_writes(self, timeout=None):
+        return all([db.flush_writes(timeout) for db in self.all_databases()])
+
+    def enable_retention(self, **options):
+        for shard in self.shards:
+            shard.enable_retention(**options)
+
+    def compact(self, max_pages=0):
+        return {os.path.basename(db.db_path): db.compact(max_pages) for db in self.all_databases()}
+
+    def get_pool_stats(self):
+        return {
+            "shard_count": self.shard_count,
+            "directory": self.directory.get_pool_stats(),
+            "shards": [shard.get_pool_stats() for shard in self.shards],
+        }
+
+    def close(self):
+        for db in self.all_databases():
+            db.close()
+
+
+# Migration and rebalancing
+
+def _insert(cursor, table, row):
+    columns = list(row)
+    cursor.execute(
+        f'INSERT INTO {table} ({", ".join(columns)}) VALUES ({", ".join("?" * len(columns))})',
+        [row[column] for column in columns]
+    )
+    return cursor.lastrowid
+
+
+def copy_global_tables(source, target):
+    """Copy users, friendships, friend messages and unread counters into the directory shard"""
+    counts = {}
+    with source.read() as src, target.directory.transaction() as cursor:
+        for table in GLOBAL_TABLES:
+            src.execute(f'SELECT * FROM {table}')
+            columns = [d[0] for d in src.description]
+            counts[table] = 0
+            while True:
+                rows = src.fetchmany(COPY_BATCH)
+                if not rows:
+                    break
+                for row in rows:
+                    _insert(cursor, table, dict(zip(columns, row)))
+                counts[table] += len(rows)
+        create_user_search_index(cursor)
+    target.directory.friend_graph.clear()
+    return counts
+
+
+def reserve_source_ids(sources, target):
+    """Move each target shard's sequences past the ids it will receive unchanged.
+
+    Must run for every source before any rows are copied, so a renumbered
+    row can never take an id that a later source row keeps.
+    """
+    for source in sources:
+        with source.read() as cursor:
+            cursor.execute('SELECT name, seq FROM sqlite_sequence')
+            sequences = dict(cursor.fetchall())
+        for index, shard in enumerate(target.shards):
+            base = {table: seq for table, seq in sequences.items()
+                    if table in ID_TABLES and seq >> ID_SHARD_SHIFT == index}
+            reserve_id_range(shard, index, base)
+
+
+def copy_user_tables(source, target):
+    """Copy every per-user row in ``source`` (a Database) to its shard in ``target``.
+
+    Rows keep their id when it already falls in the destination shard's
+    range and get a new one otherwise; subgoals and habit logs follow
+    their parent's new id.
+    """
+    plans = [
+        # table, SELECT yielding (owner user_id, *columns), (foreign key, parent table)
+        ('tasks', 'SELECT user_id, * FROM tasks', None),
+        ('goals', 'SELECT user_id, * FROM goals', None),
+        ('subgoals', 'SELECT g.user_id, s.* FROM subgoals s JOIN goals g ON g.id = s.goal_id', ('goal_id', 'goals')),
+        ('habits', 'SELECT user_id, * FROM habits', None),
+        ('habit_logs', 'SELECT h.user_id, l.* FROM habit_logs l JOIN habits h ON h.id = l.habit_id', ('habit_id', 'habits')),
+        # Archived history comes back hot; the shard's retention job re-archives it
+        ('chat_messages', f'SELECT user_id, * FROM {source._chat_messages_source()}', None),
+        ('chat_sessions', 'SELECT user_id, * FROM chat_sessions', None),
+    ]
+    id_maps = defaultdict(dict)
+    counts = {}
+    with source.read() as src:
+        for table, select_sql, parent in plans:
+            src.execute(select_sql)
+            columns = [d[0] for d in src.description][1:]
+            counts[table] = 0
+            while True:
+                rows = src.fetchmany(COPY_BATCH)
+                if not rows:
+                    break
+                by_shard = defaultdict(list)
+                for user_id, *values in rows:
+                    by_shard[target.shard_index(user_id)].append(dict(zip(columns, values)))
+                for index, shard_rows in by_shard.items():
+                    with target.shards[index].transaction() as cursor:
+                        for row in shard_rows:
+                            _copy_row(cursor, table, row, index, parent, id_maps)
+                counts[table] += len(rows)
+    for shard in target.shards:
+        shard.query_cache.clear()
+    return counts
+
+
+def _copy_row(cursor, table, row, index, parent, id_maps):
+    if parent:
+        column, parent_table = parent
+        row[column] = id_maps[parent_table].get(row[column], row[column])
+    if table == 'chat_sessions':
+        row['archived'] = 0
+    old_id = row.get('id')
+    if old_id is not None and old_id >> ID_SHARD_SHIFT != index:
+        del row['id']
+    new_id = _insert(cursor, table, row)
+    if old_id is not None:
+        id_maps[table][old_id] = new_id
+
+
+def migrate(source_path, target_dir, shard_count, **db_options):
+    """Split a single-file database into a new sharded layout"""
+    if os.path.exists(os.path.join(target_dir, 'directory.db')):
+        raise ValueError(f"{target_dir} already holds a sharded database")
+    source = Database(source_path, **db_options)
+    target = ShardedDatabase(target_dir, shard_count, **db_options)
+    try:
+        counts = copy_global_tables(source, target)
+        reserve_source_ids([source], target)
+        counts.update(copy_user_tables(source, target))
+    finally:
+        source.close()
+        target.close()
+    return counts
+
+
+def rebalance(source_dir, target_dir, shard_count, **db_options):
+    """Copy a sharded layout into a new directory with ``shard_count`` shards"""
+    if os.path.exists(os.path.join(target_dir, 'directory.db')):
+        raise ValueError(f"{target_dir} already holds a sharded database")
+    source = ShardedDatabase(source_dir, **db_options)
+    target = ShardedDatabase(target_dir, shard_count, **db_options)
+    try:
+        counts = copy_global_tables(source.directory, target)
+        reserve_source_ids(source.shards, target)
+        for shard in source.shards:
+            for table, count in copy_user_tables(shard, target).items():
+                counts[table] = counts.get(table, 0) + count
+    finally:
+        source.close()
+        target.close()
+    return counts
+
+
+def status(directory):
+    db = ShardedDatabase(directory)
+    try:
+        print(f"{directory}: {db.shard_count} shards")
+        for index, shard in enumerate(db.shards):
+            with shard.read() as cursor:
+                cursor.execute('SELECT COUNT(*) FROM chat_sessions')
+                sessions = cursor.fetchone()[0]
+                cursor.execute('SELECT COUNT(*) FROM tasks')
+                tasks = cursor.fetchone()[0]
+            size = os.path.getsize(shard.db_path)
+            print(f"  shard {index:3d}: {tasks:8d} tasks {sessions:8d} chat sessions {size / 1024:10.0f} KiB")
+    finally:
+        db.close()
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Create, rebalance and inspect user-sharded databases")
+    parser.add_argument('command', choices=['migrate', 'rebalance', 'status'])
+    parser.add_argument('--source', help="single database file (migrate) or shard directory (rebalance)")
+    parser.add_argument('--to', help="new shard directory to create")
+    parser.add_argument('--shards', type=int, help="number of shards to create")
+    parser.add_argument('--dir', help="shard directory (status)")
+    args = parser.parse_args(argv)
+
+    if args.command == 'status':
+        if not args.dir:
+            parser.error("status needs --dir")
+        status(args.dir)
+        return 0
+
+    if not (args.source and args.to and args.shards):
+        parser.error(f"{args.command} needs --source, --to and --shards")
+    copy = migrate if args.command == 'migrate' else rebalance
+    try:
+        counts = copy(args.source, args.to, args.shards)
+    except ValueError as e:
+        print(e)
+        return 1
+    for table, count in counts.items():
+        print(f"  {table}: {count} rows")
+    print(f"Wrote {args.shards} shards to {args.to}")
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,154 @@
+"""Sentence splitting and stitched, pre-rendered templates for spoken replies"""
+import io
+import re
+import sys
+import wave
+from array import array
+
+
+# End of a sentence: terminal punctuation (plus closing quotes/brackets) then whitespace
+SENTENCE_END = re.compile(r'[.!?]+["\')\]]*\s+')
+
+
+def split_sentences(text):
+    """Split off the complete sentences in ``text``; returns (sentences, remainder)"""
+    sentences = []
+    start = 0
+    for match in SENTENCE_END.finditer(text):
+        sentence = text[start:match.end()].strip()
+        if sentence:
+            sentences.append(sentence)
+        start = match.end()
+    return sentences, text[start:]
+
+
+# Fixed replies from WebBackend.prepare_ai_response, with "{}" for each
+# variable slot; keep in sync when the handlers' wording changes
+REPLY_TEMPLATES = [
+    "Great! I've added '{}' to your tasks. You've got this!",
+    "Awesome! I've set '{}' as your goal. Let's work towards it together!",
+    "Perfect! I've added '{}' to your habits. Consistency is key!",
+    "Great! Added '{}' to your '{}' goal!",
+    "Great job! Marked '{}' as complete!",
+    "Perfect! Marked '{}' as done for {}!",
+    "You've already completed '{}' today ({})!",
+    "Awesome! Marked '{}' as accomplished!",
+    "Excellent! Marked '{}' as complete!",
+    "Couldn't find '{}' in your tasks, habits, goals, or subgoals.",
+    "{} has no pending tasks right now.",
+    "{} has no active goals right now.",
+    "I couldn't find a friend named '{}' in your friends list.",
+    "Message sent to {}: '{}'",
+    "Reminder sent to {}: '{}'",
+]
+
+
+def _speakable(text):
+    """Segment text without the quotes/brackets around slots and surrounding space"""
+    return text.strip(" '()")
+
+
+def _has_words(text):
+    return any(c.isalnum() for c in text)
+
+
+class SpeechTemplate:
+    def __init__(self, template):
+        self.parts = template.split('{}')
+        self.pattern = re.compile('^' + '(.+?)'.join(re.escape(part) for part in self.parts) + '$')
+
+    def match(self, text):
+        """Slot values if ``text`` is this template filled in, else None"""
+        match = self.pattern.match(text)
+        return list(match.groups()) if match else None
+
+    def fixed_segments(self):
+        """Fixed text worth synthesizing on its own (not bare punctuation)"""
+        return [segment for segment in map(_speakable, self.parts) if _has_words(segment)]
+
+    def segments(self, values):
+        """Fixed and slot text in speaking order; bare punctuation joins the slot before it"""
+        segments = [_speakable(self.parts[0])]
+        for value, part in zip(values, self.parts[1:]):
+            segments.append(_speakable(value))
+            part = _speakable(part)
+            if _has_words(part):
+                segments.append(part)
+            else:
+                segments[-1] += part
+        return [segment for segment in segments if segment]
+
+
+TEMPLATES = [SpeechTemplate(template) for template in REPLY_TEMPLATES]
+
+
+def match_template(text):
+    """``(template, values)`` for a templated reply, or None"""
+    text = text.strip()
+    for template in TEMPLATES:
+        values = template.match(text)
+        if values is not None:
+            return template, values
+    return None
+
+
+def _trim_silence(samples, channels, rate, threshold, pad_ms):
+    """Cut leading/trailing near-silence, keeping ``pad_ms`` of it"""
+    frames = len(samples) // channels
+
+    def loud(frame):
+        return any(abs(s) > threshold for s in samples[frame * channels:(frame + 1) * channels])
+
+    first = next((frame for frame in range(frames) if loud(frame)), None)
+    if first is None:
+        return samples
+    last = next(frame for frame in range(frames - 1, -1, -1) if loud(frame))
+    pad = int(rate * pad_ms / 1000)
+    return samples[max(0, first - pad) * channels:min(frames, last + 1 + pad) * channels]
+
+
+def stitch_wav(clips, crossfade_ms=10, pad_ms=60, silence_threshold=300):
+    """Join 16-bit PCM WAV clips into one WAV.
+
+    Samples are copied as-is; only the ``crossfade_ms`` around each join is
+    mixed, after trimming each clip's silent edges down to ``pad_ms``. All
+    clips must share channels, sample width and rate (ValueError if not).
+    """
+    params = None
+    pieces = []
+    for clip in clips:
+        with wave.open(io.BytesIO(clip), 'rb') as reader:
+            clip_params = (reader.getnchannels(), reader.getsampwidth(), reader.getframerate())
+            frames = reader.readframes(reader.getnframes())
+        if clip_params[1] != 2:
+            raise ValueError("Only 16-bit PCM audio can be stitched")
+        if params is None:
+            params = clip_params
+        elif clip_params != params:
+            raise ValueError("Clips have different audio formats")
+        samples = array('h', frames)
+        if sys.byteorder == 'big':
+            samples.byteswap()
+        pieces.append(_trim_silence(samples, params[0], params[2], silence_threshold, pad_ms))
+
+    channels, _, rate = params
+    fade = int(rate * crossfade_ms / 1000) * channels
+    stitched = pieces[0]
+    for piece in pieces[1:]:
+        overlap = min(fade, len(stitched), len(piece))
+        overlap -= overlap % channels
+        base = len(stitched) - overlap
+        for i in range(overlap):
+            weight = (i // channels + 1) / (overlap // channels + 1)
+            stitched[base + i] = int(stitched[base + i] * (1 - weight) + piece[i] * weight)
+        stitched.extend(piece[overlap:])
+
+    if sys.byteorder == 'big':
+        stitched.byteswap()
+    output = io.BytesIO()
+    with wave.open(output, 'wb') as writer:
+        writer.setnchannels(channels)
+        writer.setsampwidth(2)
+        writer.setframerate(rate)
+        writer.writeframes(stitched.tobytes())
+    return output.getvalue()
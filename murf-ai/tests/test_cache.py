@@ -0,0 +1,98 @@
+import threading
+import time
+
+import pytest
+
+from cache import LRUCache
+from database import Database
+
+
+def test_hit_after_miss():
+    cache = LRUCache(max_entries=4, ttl=60)
+    loads = []
+    assert cache.get_or_load('a', lambda: loads.append('a') or 1) == 1
+    assert cache.get_or_load('a', lambda: loads.append('a') or 2) == 1
+    assert loads == ['a']
+    stats = cache.get_stats()
+    assert (stats["hits"], stats["misses"]) == (1, 1)
+
+
+def test_least_recently_used_entry_is_evicted():
+    cache = LRUCache(max_entries=2, ttl=60)
+    cache.get_or_load('a', lambda: 'a')
+    cache.get_or_load('b', lambda: 'b')
+    cache.get_or_load('a', lambda: 'stale')  # touch a, so b is oldest
+    cache.get_or_load('c', lambda: 'c')
+    assert cache.get_or_load('a', lambda: 'reloaded') == 'a'
+    assert cache.get_or_load('b', lambda: 'reloaded') == 'reloaded'
+    assert cache.get_stats()["evictions"] >= 1
+
+
+def test_entries_expire_after_ttl():
+    cache = LRUCache(max_entries=4, ttl=0.05)
+    cache.get_or_load('a', lambda: 1)
+    time.sleep(0.1)
+    assert cache.get_or_load('a', lambda: 2) == 2
+    assert cache.get_stats()["expirations"] == 1
+
+
+def test_invalidation_during_load_is_not_cached():
+    cache = LRUCache(max_entries=4, ttl=60)
+    loading = threading.Event()
+    release = threading.Event()
+
+    def slow_load():
+        loading.set()
+        release.wait(5)
+        return 'old'
+
+    reader = threading.Thread(target=cache.get_or_load, args=('a', slow_load))
+    reader.start()
+    loading.wait(5)
+    cache.invalidate('a')  # a write lands while the read is in flight
+    release.set()
+    reader.join()
+    assert cache.get_or_load('a', lambda: 'new') == 'new'
+
+
+def test_disabled_cache_always_loads():
+    cache = LRUCache(max_entries=4, ttl=60, enabled=False)
+    assert cache.get_or_load('a', lambda: 1) == 1
+    assert cache.get_or_load('a', lambda: 2) == 2
+
+
+@pytest.fixture
+def db(tmp_path):
+    db = Database(str(tmp_path / 'cache.db'))
+    yield db
+    db.close()
+
+
+def test_writes_invalidate_cached_lists(db):
+    db.add_task('alice', 'first')
+    assert [t["title"] for t in db.get_tasks('alice')] == ['first']
+    task_id = db.add_task('alice', 'second')
+    assert len(db.get_tasks('alice')) == 2
+    db.complete_task(task_id)
+    assert {t["title"]: t["status"] for t in db.get_tasks('alice')}["second"] == 'completed'
+
+    goal_id = db.add_goal('alice', 'marathon')
+    assert db.get_goals('alice')[0]["progress"] == 0
+    db.update_goal_progress(goal_id, 40)
+    assert db.get_goals('alice')[0]["progress"] == 40
+    subgoal_id = db.add_subgoal(goal_id, 'shoes')
+    assert db.get_subgoals(goal_id)[0]["completed"] in (0, False)
+    db.toggle_subgoal(goal_id, subgoal_id)
+    assert db.get_subgoals(goal_id)[0]["completed"] in (1, True)
+
+    habit_id = db.add_habit('alice', 'read')
+    assert [h["name"] for h in db.get_habits('alice')] == ['read']
+    db.delete_habit(habit_id)
+    assert db.get_habits('alice') == []
+
+
+def test_cached_rows_are_copies(db):
+    db.add_task('alice', 'first')
+    db.get_tasks('alice')[0]["title"] = 'changed'
+    assert db.get_tasks('alice')[0]["title"] == 'first'
+    assert db.query_cache.get_stats()["hits"] >= 1
@@ -0,0 +1,26 @@
+import pytest
+
+from database import decode_cursor, encode_cursor
+
+
+def test_round_trip():
+    assert decode_cursor(encode_cursor(['2024-01-01 00:00:00', 7])) == ['2024-01-01 00:00:00', 7]
+    assert decode_cursor(encode_cursor([12]), size=1) == [12]
+
+
+@pytest.mark.parametrize('key', [
+    [1, {"a": 1}],
+    [1, [2]],
+    [True, 1],
+    [1.5, 1],
+    [None, 1],
+    [1, 2, 3],
+])
+def test_rejects_keys_that_cannot_be_bound(key):
+    with pytest.raises(ValueError):
+        decode_cursor(encode_cursor(key))
+
+
+def test_rejects_garbage():
+    with pytest.raises(ValueError):
+        decode_cursor('not a cursor!')
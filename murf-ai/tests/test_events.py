@@ -0,0 +1,82 @@
+import time
+
+from events import EventBus, format_sse
+
+
+def test_events_reach_only_the_addressed_users_streams():
+    bus = EventBus()
+    first, second = bus.subscribe('alice'), bus.subscribe('alice')
+    other = bus.subscribe('bob')
+    event = bus.publish('alice', 'message', {"text": "hi"})
+    assert first.get(0.1) == event and second.get(0.1) == event
+    assert other.get(0.01) is None
+    assert bus.get_stats()["delivered"] == 2
+
+
+def test_ids_increase_and_start_from_the_clock():
+    before = int(time.time() * 1000)
+    bus = EventBus()
+    ids = [bus.publish('alice', 'message', {})["id"] for _ in range(3)]
+    assert ids == sorted(set(ids)) and ids[0] >= before
+    # A restarted process starts from the clock again, not from 1
+    time.sleep(0.01)
+    assert EventBus().publish('alice', 'message', {})["id"] > ids[-1]
+
+
+def test_reconnect_replays_missed_events():
+    bus = EventBus()
+    seen = bus.publish('alice', 'message', {"n": 1})
+    missed = [bus.publish('alice', 'message', {"n": n}) for n in (2, 3)]
+    subscription = bus.subscribe('alice', last_event_id=seen["id"])
+    assert [subscription.get(0.1) for _ in missed] == missed
+    assert subscription.get(0.01) is None
+    assert bus.get_stats()["replayed"] == 2
+
+
+def test_id_from_the_future_replays_all_history():
+    bus = EventBus()
+    events = [bus.publish('alice', 'message', {"n": n}) for n in range(3)]
+    subscription = bus.subscribe('alice', last_event_id=events[-1]["id"] + 10 ** 9)
+    assert [subscription.get(0.1) for _ in events] == events
+
+
+def test_history_is_bounded_per_user():
+    bus = EventBus(history=2)
+    events = [bus.publish('alice', 'message', {"n": n}) for n in range(5)]
+    subscription = bus.subscribe('alice', last_event_id=0)
+    assert [subscription.get(0.1), subscription.get(0.1)] == events[-2:]
+    assert subscription.get(0.01) is None
+
+
+def test_full_queue_drops_instead_of_blocking():
+    bus = EventBus(max_queue=2)
+    subscription = bus.subscribe('alice')
+    for n in range(5):
+        bus.publish('alice', 'message', {"n": n})
+    stats = bus.get_stats()
+    assert (stats["delivered"], stats["dropped"]) == (2, 3)
+    assert subscription.get(0.1)["data"] == {"n": 0}
+
+
+def test_offline_users_history_expires():
+    bus = EventBus(history_ttl=0.05)
+    bus.publish('offline', 'message', {})
+    connected = bus.subscribe('online')
+    bus.publish('online', 'message', {})
+    time.sleep(0.1)
+    bus.publish('someone', 'message', {})  # publishing sweeps expired history
+    stats = bus.get_stats()
+    assert stats["expired_histories"] == 1
+    assert stats["users_with_history"] == 2
+    assert bus.subscribe('offline', last_event_id=0).get(0.01) is None
+
+    connected.close()
+    time.sleep(0.1)
+    bus.publish('someone', 'message', {})
+    assert bus.get_stats()["users_with_history"] == 1
+    assert bus.get_stats()["connected_users"] == 1  # the 'offline' subscription above
+
+
+def test_format_sse():
+    assert format_sse({"id": 7, "event": "nudge", "data": {"a": 1}}) == 'id: 7\nevent: nudge\ndata: {"a": 1}\n\n'
+    assert format_sse({"event": "token", "data": "x"}) == 'event: token\ndata: "x"\n\n'
@@ -0,0 +1,110 @@
+from datetime import date, timedelta
+
+import pytest
+
+from database import Database, bitmap_has, bitmap_set, bitmap_streaks
+
+
+def test_bitmap_set_grows_both_ways():
+    bitmap = bytearray()
+    start = bitmap_set(bitmap, 800, 805)
+    assert (start, len(bitmap)) == (800, 1)
+    start = bitmap_set(bitmap, start, 823)  # next bytes
+    assert len(bitmap) == 3
+    start = bitmap_set(bitmap, start, 790)  # before start: prepends, stays a multiple of 8
+    assert start == 784 and start % 8 == 0
+    assert [day for day in range(780, 830) if bitmap_has(bitmap, start, day)] == [790, 805, 823]
+
+
+def test_bitmap_has_out_of_range():
+    bitmap = bytearray(b'\xff')
+    assert not bitmap_has(bitmap, 800, 799)
+    assert not bitmap_has(bitmap, 800, 808)
+    assert bitmap_has(bitmap, 800, 807)
+
+
+def test_bitmap_streaks():
+    bitmap = bytearray()
+    start = 800
+    for day in (800, 801, 802, 805, 806):
+        start = bitmap_set(bitmap, start, day)
+    assert bitmap_streaks(bitmap, start, 806) == (2, 3)
+
+
+@pytest.fixture
+def db(tmp_path):
+    db = Database(str(tmp_path / 'habits.db'))
+    yield db
+    db.close()
+
+
+TODAY = date(2026, 3, 10)
+
+
+def day(offset):
+    return TODAY + timedelta(days=offset)
+
+
+def logs(db, habit_id, today=TODAY):
+    return db.get_habit_logs('alice', today=today)[habit_id]
+
+
+def test_consecutive_days_build_a_streak(db):
+    habit_id = db.add_habit('alice', 'read')
+    for offset in (-2, -1, 0):
+        assert db.log_habit(habit_id, day(offset)) is True
+    assert db.log_habit(habit_id, day(0)) is False
+    status = logs(db, habit_id)
+    assert status["completed_today"]
+    assert (status["streak"], status["longest_streak"], status["total_completions"]) == (3, 3, 3)
+    assert status["recent_logs"] == [day(-2).isoformat(), day(-1).isoformat(), day(0).isoformat()]
+    assert db.get_habits('alice')[0]["streak"] == 3
+
+
+def test_gap_resets_current_streak(db):
+    habit_id = db.add_habit('alice', 'read')
+    for offset in (-5, -4, -3, -1, 0):
+        db.log_habit(habit_id, day(offset))
+    status = logs(db, habit_id)
+    assert (status["streak"], status["longest_streak"]) == (2, 3)
+
+
+def test_streak_is_kept_until_a_day_is_missed(db):
+    habit_id = db.add_habit('alice', 'read')
+    db.log_habit(habit_id, day(-1))
+    db.log_habit(habit_id, day(0))
+    assert logs(db, habit_id, today=day(1))["streak"] == 2  # today not logged yet
+    assert logs(db, habit_id, today=day(2))["streak"] == 0
+    assert not logs(db, habit_id, today=day(1))["completed_today"]
+
+
+def test_backdated_log_fills_a_gap(db):
+    habit_id = db.add_habit('alice', 'read')
+    for offset in (-3, -2, 0):
+        db.log_habit(habit_id, day(offset))
+    assert logs(db, habit_id)["streak"] == 1
+    db.log_habit(habit_id, day(-1))
+    status = logs(db, habit_id)
+    assert (status["streak"], status["longest_streak"], status["total_completions"]) == (4, 4, 4)
+
+
+def test_log_long_before_the_first_one(db):
+    habit_id = db.add_habit('alice', 'read')
+    db.log_habit(habit_id, day(0))
+    db.log_habit(habit_id, day(-400))
+    status = logs(db, habit_id)
+    assert status["recent_logs"] == [day(0).isoformat()]
+    assert status["last_completed"] == day(0).isoformat()
+    assert (status["streak"], status["total_completions"]) == (1, 2)
+    assert db.log_habit(habit_id, day(-400)) is False
+
+
+def test_recent_logs_window_and_missing_habit(db):
+    habit_id = db.add_habit('alice', 'read')
+    for offset in range(-10, 1):
+        db.log_habit(habit_id, day(offset))
+    assert len(logs(db, habit_id)["recent_logs"]) == 7
+    assert db.log_habit(habit_id + 1000, day(0)) is None
+    unlogged = db.add_habit('alice', 'write')
+    assert logs(db, unlogged) == {"completed_today": False, "recent_logs": [], "last_completed": None,
+                                  "streak": 0, "longest_streak": 0, "total_completions": 0}
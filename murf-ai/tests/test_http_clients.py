@@ -0,0 +1,80 @@
+import base64
+import json
+
+import pytest
+
+from http_clients import Base64FieldDecoder
+
+AUDIO = bytes(range(256)) * 3 + b'tail'
+
+
+def murf_body(audio=AUDIO, **extra):
+    fields = dict(extra, encodedAudio=base64.b64encode(audio).decode(), audioLengthInSeconds=1.5)
+    return json.dumps(fields).encode()
+
+
+def decode(body, sizes):
+    """Feed ``body`` in chunks of the given sizes (the last repeats)"""
+    decoder = Base64FieldDecoder('encodedAudio')
+    out, position, index = b'', 0, 0
+    while position < len(body):
+        size = sizes[min(index, len(sizes) - 1)]
+        out += decoder.feed(body[position:position + size])
+        position += size
+        index += 1
+    return out, decoder.done
+
+
+def test_whole_body_in_one_chunk():
+    body = murf_body()
+    assert decode(body, [len(body)]) == (AUDIO, True)
+
+
+@pytest.mark.parametrize('size', [1, 2, 3, 5, 7, 64])
+def test_small_fixed_chunks(size):
+    assert decode(murf_body(), [size]) == (AUDIO, True)
+
+
+def test_every_single_split_point():
+    body = murf_body(warning="x" * 10)
+    for split in range(1, len(body)):
+        assert decode(body, [split, len(body)]) == (AUDIO, True), split
+
+
+@pytest.mark.parametrize('length', [1, 2, 3, 4])
+def test_padding(length):
+    audio = b'\xff' * length
+    body = murf_body(audio)
+    assert b'=' in body or length % 3 == 0
+    assert decode(body, [3]) == (audio, True)
+
+
+def test_escaped_slashes():
+    audio = b'\xff\xff\xff' * 20  # encodes to "////"
+    body = murf_body(audio).replace(b'/', b'\\/')
+    assert b'\\/' in body
+    for size in (1, 2, 3, 4, 7):
+        assert decode(body, [size]) == (audio, True)
+
+
+def test_field_named_in_other_values_is_skipped():
+    body = json.dumps({"note": "encodedAudio", "nested": {"x": "\"encodedAudio\""},
+                       "encodedAudio": base64.b64encode(AUDIO).decode()}).encode()
+    for size in (1, 4, 13, len(body)):
+        assert decode(body, [size]) == (AUDIO, True)
+
+
+def test_truncated_body_is_not_done():
+    body = murf_body()
+    end = body.index(b'", "audioLengthInSeconds"') - 10
+    audio, done = decode(body[:end], [16])
+    assert not done
+    assert AUDIO.startswith(audio) and len(audio) < len(AUDIO)
+
+    assert decode(body[:body.index(b'encodedAudio') + 5], [4]) == (b'', False)
+
+
+def test_nothing_more_after_done():
+    decoder = Base64FieldDecoder('encodedAudio')
+    assert decoder.feed(murf_body()) == AUDIO
+    assert decoder.feed(b'"encodedAudio": "AAAA"') == b''
@@ -0,0 +1,6 @@
+from migrations import check_query_plans
+
+
+def test_no_query_scans_a_whole_table():
+    failures = check_query_plans()
+    assert failures == [], "\n".join(f"{', '.join(scans)}: {sql}" for sql, scans in failures)
@@ -0,0 +1,28 @@
+import os
+
+from database import Database
+from sharding import ShardedDatabase, migrate, rebalance
+
+
+def test_unread_counts_survive_migrate_and_rebalance(tmp_path):
+    source = Database(str(tmp_path / 'source.db'))
+    for user_id in ('a', 'b', 'c'):
+        source.add_user(user_id, f'{user_id}@example.com', user_id.upper())
+    source.send_message('b', 'a', 'one')
+    source.send_message('b', 'a', 'two')
+    source.send_message('c', 'a', 'three')
+    source.send_message('a', 'b', 'four')
+    source.mark_conversation_read('a', 'c')
+    expected = {user_id: source.get_unread_counts(user_id) for user_id in ('a', 'b', 'c')}
+    source.close()
+    assert expected['a'] == {'b': 2}
+
+    migrate(str(tmp_path / 'source.db'), str(tmp_path / 'shards_2'), 2)
+    rebalance(str(tmp_path / 'shards_2'), str(tmp_path / 'shards_3'), 3)
+
+    for directory in ('shards_2', 'shards_3'):
+        db = ShardedDatabase(os.path.join(tmp_path, directory))
+        try:
+            assert {user_id: db.get_unread_counts(user_id) for user_id in expected} == expected
+        finally:
+            db.close()
@@ -0,0 +1,143 @@
+import ast
+import io
+import os
+import struct
+import wave
+
+import pytest
+
+from speech_templates import REPLY_TEMPLATES, match_template, split_sentences, stitch_wav
+
+
+def test_split_sentences_keeps_the_unfinished_remainder():
+    assert split_sentences("Nice work! You finished three tasks. Keep") == (
+        ["Nice work!", "You finished three tasks."], "Keep")
+    assert split_sentences("No sentence end yet") == ([], "No sentence end yet")
+    assert split_sentences("") == ([], "")
+
+
+def test_split_sentences_needs_whitespace_after_the_punctuation():
+    # The stream may continue the sentence ("3.5", "e.g.") so wait for a space
+    assert split_sentences("It costs 3.5") == ([], "It costs 3.5")
+    assert split_sentences("Done.") == ([], "Done.")
+    assert split_sentences("Done. ") == (["Done."], "")
+
+
+def test_split_sentences_handles_quotes_and_repeated_punctuation():
+    assert split_sentences("You said 'go!' Then what?! Ok") == (["You said 'go!'", "Then what?!"], "Ok")
+    assert split_sentences('He said "hi." (Really.) Yes') == (['He said "hi."', "(Really.)"], "Yes")
+
+
+def test_split_sentences_over_streamed_tokens():
+    tokens = ["Gre", "at job", "! You", "'ve got ", "this. Ke", "ep going"]
+    sentences, buffer = [], ""
+    for token in tokens:
+        complete, buffer = split_sentences(buffer + token)
+        sentences.extend(complete)
+    assert sentences == ["Great job!", "You've got this."]
+    assert buffer == "Keep going"
+
+WEB_BACKEND = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'web_backend.py')
+
+# Replies whose slots are computed lists; these are synthesized whole
+UNTEMPLATED_REPLIES = {
+    "{} has {}.",
+    "{} has {} pending tasks: {}{}",
+    "{} has {} active goals: {}{}",
+}
+
+
+def handler_replies():
+    """Each f-string reply returned by WebBackend.prepare_ai_response, with "{}" per slot"""
+    with open(WEB_BACKEND) as source:
+        tree = ast.parse(source.read())
+    handler = next(node for node in ast.walk(tree)
+                   if isinstance(node, ast.FunctionDef) and node.name == 'prepare_ai_response')
+    replies = set()
+    for node in ast.walk(handler):
+        if isinstance(node, ast.Return) and isinstance(node.value, ast.Tuple):
+            reply = node.value.elts[0]
+            if isinstance(reply, ast.JoinedStr):
+                replies.add(''.join(part.value if isinstance(part, ast.Constant) else '{}'
+                                    for part in reply.values))
+    return replies
+
+
+def test_every_templated_handler_reply_has_a_template():
+    replies = handler_replies()
+    assert len(replies) > 10
+    assert replies - UNTEMPLATED_REPLIES <= set(REPLY_TEMPLATES)
+    # And no template is left over from wording that no longer exists
+    assert set(REPLY_TEMPLATES) <= replies
+
+
+@pytest.mark.parametrize('template', REPLY_TEMPLATES)
+def test_match_template_recovers_slot_values(template):
+    values = [f"value {n}" for n in range(template.count('{}'))]
+    matched, found = match_template(template.format(*values))
+    assert found == values
+    segments = matched.segments(found)
+    assert all(value in ' '.join(segments) for value in values)
+    assert all(segment in segments for segment in matched.fixed_segments())
+
+
+def test_untemplated_text_does_not_match():
+    assert match_template("How's your day going?") is None
+    assert match_template("Alice has 3 pending tasks: a, b, c") is None
+
+
+def make_wav(samples, rate=24000, channels=1, width=2):
+    out = io.BytesIO()
+    with wave.open(out, 'wb') as writer:
+        writer.setnchannels(channels)
+        writer.setsampwidth(width)
+        writer.setframerate(rate)
+        if width == 2:
+            writer.writeframes(struct.pack(f'<{len(samples)}h', *samples))
+        else:
+            writer.writeframes(bytes(samples))
+    return out.getvalue()
+
+
+def read_wav(data):
+    with wave.open(io.BytesIO(data), 'rb') as reader:
+        params = (reader.getnchannels(), reader.getsampwidth(), reader.getframerate())
+        frames = reader.readframes(reader.getnframes())
+    return params, list(struct.unpack(f'<{len(frames) // 2}h', frames))
+
+
+def test_stitch_wav_header_and_crossfade():
+    rate = 24000
+    first = make_wav([10000] * 2400, rate)
+    second = make_wav([-10000] * 2400, rate)
+    stitched = stitch_wav([first, second], crossfade_ms=10)
+
+    assert stitched[:4] == b'RIFF' and stitched[8:16] == b'WAVEfmt '
+    assert struct.unpack('<I', stitched[4:8])[0] == len(stitched) - 8
+    assert stitched[36:40] == b'data'
+    assert struct.unpack('<I', stitched[40:44])[0] == len(stitched) - 44
+
+    params, samples = read_wav(stitched)
+    assert params == (1, 2, rate)
+    fade = rate * 10 // 1000
+    assert len(samples) == 2400 + 2400 - fade
+    # Untouched before the join, a monotonic ramp across it, untouched after
+    assert samples[:2400 - fade] == [10000] * (2400 - fade)
+    ramp = samples[2400 - fade:2400]
+    assert all(a > b for a, b in zip(ramp, ramp[1:]))
+    assert 10000 > ramp[0] and ramp[-1] > -10000
+    assert samples[2400:] == [-10000] * (2400 - fade)
+
+
+def test_stitch_wav_trims_silence_to_padding():
+    rate = 24000
+    clip = make_wav([0] * rate + [8000] * 2400 + [0] * rate, rate)
+    _, samples = read_wav(stitch_wav([clip], pad_ms=60))
+    assert len(samples) == 2400 + 2 * (rate * 60 // 1000)
+
+
+def test_stitch_wav_rejects_mismatched_clips():
+    with pytest.raises(ValueError):
+        stitch_wav([make_wav([1000] * 100, 24000), make_wav([1000] * 100, 16000)])
+    with pytest.raises(ValueError):
+        stitch_wav([make_wav([128] * 100, width=1)])
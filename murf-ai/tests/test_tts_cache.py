@@ -0,0 +1,122 @@
+import os
+
+from tts_cache import TTSCache, tts_cache_key
+
+
+def files(directory):
+    return sorted(os.listdir(directory))
+
+
+def test_key_ignores_whitespace_but_not_settings():
+    key = tts_cache_key("Hello  there\n", 'en-US-natalie', 0, 24000, 'wav')
+    assert key == tts_cache_key(" Hello there", 'en-US-natalie', 0, 24000, 'WAV')
+    assert key != tts_cache_key("Hello there", 'en-US-natalie', 10, 24000, 'wav')
+    assert key != tts_cache_key("Hello there", 'en-US-ken', 0, 24000, 'wav')
+    assert key != tts_cache_key("hello there", 'en-US-natalie', 0, 24000, 'wav')
+
+
+def test_memory_then_disk_hits(tmp_path):
+    cache = TTSCache(str(tmp_path), memory_bytes=10, disk_bytes=1000)
+    cache.put('a', b'x' * 8)
+    cache.put('b', b'y' * 8)  # pushes a out of memory, both stay on disk
+    assert cache.get('b') == b'y' * 8
+    assert cache.get('a') == b'x' * 8
+    assert cache.get('missing') is None
+    stats = cache.get_stats()
+    assert (stats["memory_hits"], stats["disk_hits"], stats["misses"]) == (1, 1, 1)
+    assert stats["memory_evictions"] >= 1
+    assert files(tmp_path) == ['a.wav', 'b.wav']
+
+
+def test_disk_evicts_least_recently_used_by_bytes(tmp_path):
+    cache = TTSCache(str(tmp_path), memory_bytes=0, disk_bytes=25)
+    cache.put('a', b'1' * 10)
+    cache.put('b', b'2' * 10)
+    assert cache.get('a') == b'1' * 10  # a is now newer than b
+    cache.put('c', b'3' * 10)
+    assert files(tmp_path) == ['a.wav', 'c.wav']
+    assert not cache.contains('b')
+    stats = cache.get_stats()
+    assert (stats["disk_entries"], stats["disk_bytes"], stats["disk_evictions"]) == (2, 20, 1)
+    cache.put('huge', b'4' * 26)  # larger than the whole tier, never written
+    assert files(tmp_path) == ['a.wav', 'c.wav']
+
+
+def test_writes_are_atomic_and_stale_temp_files_are_removed(tmp_path):
+    cache = TTSCache(str(tmp_path), memory_bytes=0, disk_bytes=1000)
+    cache.put('a', b'audio')
+    assert files(tmp_path) == ['a.wav']
+    (tmp_path / 'interrupted.tmp').write_bytes(b'half a clip')
+    TTSCache(str(tmp_path), memory_bytes=0, disk_bytes=1000)
+    assert files(tmp_path) == ['a.wav']
+
+
+def test_cold_start_reloads_index_in_mtime_order(tmp_path):
+    for age, key in enumerate(['newest', 'middle', 'oldest']):
+        path = tmp_path / f'{key}.wav'
+        path.write_bytes(b'0' * 10)
+        os.utime(path, (1_000_000 - age, 1_000_000 - age))
+    (tmp_path / 'notes.txt').write_text('not a clip')
+
+    cache = TTSCache(str(tmp_path), memory_bytes=0, disk_bytes=20)
+    assert not cache.contains('oldest')
+    assert cache.contains('middle') and cache.contains('newest')
+    assert cache.get('middle') == b'0' * 10
+    assert cache.get_stats()["disk_evictions"] == 1
+    assert files(tmp_path) == ['middle.wav', 'newest.wav', 'notes.txt']
+
+
+def test_disabled_cache_stores_nothing(tmp_path):
+    directory = tmp_path / 'tts'
+    cache = TTSCache(str(directory), enabled=False)
+    cache.put('a', b'audio')
+    assert cache.get('a') is None
+    assert not cache.contains('a')
+    assert not directory.exists()
+    assert cache.get_stats()["enabled"] is False
+
+
+def test_writer_spools_to_disk_and_publishes_on_commit(tmp_path):
+    cache = TTSCache(str(tmp_path), memory_bytes=1000, disk_bytes=1000)
+    writer = cache.writer('a')
+    writer.write(b'RIFF')
+    writer.write(b'....')
+    assert not cache.contains('a')
+    assert [name for name in files(tmp_path) if name.endswith('.tmp')]
+    writer.commit()
+    assert files(tmp_path) == ['a.wav']
+    assert cache.get_stats()["memory_entries"] == 0
+    assert cache.get('a') == b'RIFF....'
+    assert cache.get_stats()["disk_hits"] == 1
+
+
+def test_aborted_or_oversized_writes_leave_nothing(tmp_path):
+    cache = TTSCache(str(tmp_path), memory_bytes=1000, disk_bytes=10)
+    writer = cache.writer('a')
+    writer.write(b'half')
+    writer.abort()
+    writer = cache.writer('b')
+    writer.write(b'0' * 8)
+    writer.write(b'0' * 8)  # over the disk tier, so the spool is dropped
+    writer.commit()
+    assert files(tmp_path) == []
+    assert not cache.contains('a') and not cache.contains('b')
+
+
+def test_writer_without_disk_tier_buffers_only_what_fits_in_memory(tmp_path):
+    cache = TTSCache(str(tmp_path / 'tts'), memory_bytes=8, disk_bytes=0)
+    small = cache.writer('small')
+    small.write(b'1234')
+    small.commit()
+    large = cache.writer('large')
+    large.write(b'12345')
+    large.write(b'67890')
+    large.commit()
+    assert cache.get('small') == b'1234'
+    assert cache.get('large') is None
+
+    disabled = TTSCache(str(tmp_path / 'off'), enabled=False)
+    writer = disabled.writer('a')
+    writer.write(b'audio')
+    writer.commit()
+    assert disabled.get('a') is None
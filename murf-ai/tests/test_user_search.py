@@ -0,0 +1,49 @@
+import pytest
+
+from database import Database
+
+
+@pytest.fixture
+def db(tmp_path):
+    db = Database(str(tmp_path / 'users.db'))
+    db.add_user('u1', 'alice.smith@gmail.com', 'Alice Smith')
+    db.add_user('u2', 'bob@gmail.com', 'Bob Jones')
+    db.add_user('u3', 'gmax@example.org', 'Max Power')
+    db.add_user('u4', 'carol@yahoo.com', 'Carol Ng')
+    yield db
+    db.close()
+
+
+def ids(users):
+    return [user["id"] for user in users]
+
+
+def test_trigram_substring(db):
+    assert db.user_search_enabled
+    assert set(ids(db.search_users_by_email('gmail'))) == {'u1', 'u2'}
+    assert ids(db.search_users('jones')) == ['u2']
+
+
+def test_short_query_matches_prefix_and_substring(db):
+    # 'gm' starts one email and appears inside two others; prefix ranks first
+    assert ids(db.search_users_by_email('gm')) == ['u3', 'u2', 'u1']
+    assert ids(db.search_users('ng')) == ['u4']
+
+
+def test_short_query_respects_limit(db):
+    assert len(db.search_users_by_email('o', limit=2)) == 2
+
+
+def test_without_trigram_index(db):
+    db.user_search_enabled = False
+    assert set(ids(db.search_users_by_email('gmail'))) == {'u1', 'u2'}
+    assert ids(db.search_users('smith')) == ['u1']
+    assert ids(db.search_users('bob@gmail.com')) == ['u2']
+
+
+def test_friend_by_short_name(db):
+    for friend in ('u2', 'u3', 'u4'):
+        db.respond_to_friend_request(db.send_friend_request('u1', friend), 'accepted')
+    assert db.get_friend_by_name('u1', 'ng')["id"] == 'u4'
+    assert db.get_friend_by_name('u1', 'm')["id"] == 'u3'
+    assert db.get_friend_by_name('u1', 'zz') is None
@@ -0,0 +1,94 @@
+import threading
+
+import pytest
+
+from database import Database, WriteBehindError
+
+
+@pytest.fixture
+def db(tmp_path):
+    db = Database(str(tmp_path / 'write_behind.db'))
+    with db.transaction() as cursor:
+        cursor.execute('CREATE TABLE items (n INTEGER NOT NULL UNIQUE)')
+    yield db
+    db.close()
+
+
+def insert(n):
+    def write(cursor):
+        cursor.execute('INSERT INTO items (n) VALUES (?)', (n,))
+        return n
+    return write
+
+
+def stored(db):
+    with db.read() as cursor:
+        cursor.execute('SELECT n FROM items ORDER BY rowid')
+        return [row[0] for row in cursor.fetchall()]
+
+
+def test_writes_are_group_committed_in_order(db):
+    queue = db.enable_write_behind(flush_interval=0.5, batch_size=100)
+    committed = []
+    for n in range(50):
+        queue.submit(insert(n), committed.append)
+    assert queue.flush(5)
+    assert stored(db) == list(range(50))
+    assert committed == list(range(50))
+    stats = queue.get_stats()
+    assert stats["committed"] == 50
+    assert stats["batches"] < 50
+    assert stats["largest_batch"] > 1
+
+
+def test_flush_waits_for_writes_queued_before_it(db):
+    queue = db.enable_write_behind(flush_interval=0.05, batch_size=5)
+    for n in range(23):
+        queue.submit(insert(n))
+    assert queue.flush(5)
+    assert len(stored(db)) == 23
+
+
+def test_failed_write_is_reported_and_others_still_commit(db):
+    queue = db.enable_write_behind(flush_interval=0.5)
+    committed = []
+    queue.submit(insert(1), committed.append)
+    queue.submit(insert(1), committed.append)  # violates UNIQUE
+    queue.submit(insert(2), committed.append)
+    with pytest.raises(WriteBehindError) as raised:
+        queue.flush(5)
+    assert len(raised.value.errors) == 1
+    assert stored(db) == [1, 2]
+    assert committed == [1, 2]
+    stats = queue.get_stats()
+    assert stats["failed"] == 1 and stats["committed"] == 2
+    # Reported once; the next flush is clean
+    assert queue.flush(5)
+
+
+def test_submit_after_close_writes_synchronously(db):
+    queue = db.enable_write_behind()
+    queue.submit(insert(1))
+    queue.close()
+    committed = []
+    queue.submit(insert(2), committed.append)
+    assert stored(db) == [1, 2]
+    assert committed == [2]
+    assert queue.get_stats()["sync_fallbacks"] == 1
+    assert queue.flush(1)
+
+
+def test_concurrent_submits_during_close_are_kept(db):
+    queue = db.enable_write_behind()
+
+    def producer(start):
+        for n in range(start, start + 200):
+            queue.submit(insert(n))
+
+    producers = [threading.Thread(target=producer, args=(i * 1000,)) for i in range(4)]
+    for thread in producers:
+        thread.start()
+    queue.close()
+    for thread in producers:
+        thread.join()
+    assert len(stored(db)) == 800
@@ -0,0 +1,262 @@
+"""Content-addressed cache of synthesized speech, in memory and on disk"""
+import hashlib
+import os
+import tempfile
+import threading
+import unicodedata
+from collections import OrderedDict
+
+
+def tts_cache_key(text, voice_id, rate, sample_rate, audio_format):
+    """Hash of the normalized text and every setting that changes the audio"""
+    normalized = ' '.join(unicodedata.normalize('NFC', text).split())
+    material = '\x1f'.join([normalized, voice_id, str(rate), str(sample_rate), audio_format.upper()])
+    return hashlib.sha256(material.encode('utf-8')).hexdigest()
+
+
+class TTSCache:
+    """Two-tier LRU cache of audio bytes keyed by ``tts_cache_key``.
+
+    The memory tier holds up to ``memory_bytes`` of the most recently used
+    clips. The disk tier keeps up to ``disk_bytes`` under ``directory`` as
+    one file per key, written atomically (temp file + rename) so readers
+    never see a partial clip; file mtimes carry the LRU order across
+    restarts. Disk hits are promoted to memory.
+    """
+
+    def __init__(self, directory, memory_bytes=32 * 1024 * 1024, disk_bytes=512 * 1024 * 1024,
+                 suffix='.wav', enabled=True):
+        self.directory = directory
+        self.memory_bytes = memory_bytes
+        self.disk_bytes = disk_bytes
+        self.suffix = suffix
+        self.enabled = enabled
+        self._memory = OrderedDict()  # key -> audio bytes
+        self._memory_size = 0
+        self._disk = OrderedDict()    # key -> file size, least recently used first
+        self._disk_size = 0
+        self._lock = threading.Lock()
+        self._stats = {"memory_hits": 0, "disk_hits": 0, "misses": 0, "stores": 0,
+                       "memory_evictions": 0, "disk_evictions": 0}
+        if enabled and disk_bytes > 0:
+            os.makedirs(directory, exist_ok=True)
+            self._load_index()
+
+    def _path(self, key):
+        return os.path.join(self.directory, key + self.suffix)
+
+    def _load_index(self):
+        """Rebuild the disk LRU order from the files already in the directory"""
+        entries = []
+        for name in os.listdir(self.directory):
+            if name.endswith('.tmp'):
+                # Left behind by a write that never got renamed into place
+                try:
+                    os.unlink(os.path.join(self.directory, name))
+                except OSError:
+                    pass
+                continue
+            if not name.endswith(self.suffix):
+                continue
+            try:
+                stat = os.stat(os.path.join(self.directory, name))
+            except OSError:
+                continue
+            entries.append((stat.st_mtime, name[:-len(self.suffix)], stat.st_size))
+        for _, key, size in sorted(entries):
+            self._disk[key] = size
+            self._disk_size += size
+        self._evict_disk()
+
+    def contains(self, key):
+        """Whether ``key`` is cached, without reading it or counting a lookup"""
+        if not self.enabled:
+            return False
+        with self._lock:
+            return key in self._memory or key in self._disk
+
+    def get(self, key):
+        """Cached audio bytes for ``key``, or None"""
+        if not self.enabled:
+            return None
+        with self._lock:
+            audio = self._memory.get(key)
+            if audio is not None:
+                self._memory.move_to_end(key)
+                self._stats["memory_hits"] += 1
+                return audio
+            on_disk = key in self._disk
+
+        if on_disk:
+            try:
+                with open(self._path(key), 'rb') as audio_file:
+                    audio = audio_file.read()
+                os.utime(self._path(key))
+            except OSError:
+                audio = None
+        with self._lock:
+            if audio is None:
+                size = self._disk.pop(key, None) if on_disk else None
+                if size is not None:
+                    self._disk_size -= size
+                self._stats["misses"] += 1
+                return None
+            if key in self._disk:
+                self._disk.move_to_end(key)
+            self._stats["disk_hits"] += 1
+            self._remember(key, audio)
+        return audio
+
+    def put(self, key, audio):
+        """Store ``audio`` bytes under ``key`` in both tiers"""
+        if not self.enabled or not audio:
+            return
+        with self._lock:
+            self._remember(key, audio)
+            self._stats["stores"] += 1
+        if self.disk_bytes <= 0 or len(audio) > self.disk_bytes:
+            return
+        fd, temp_path = tempfile.mkstemp(dir=self.directory, suffix='.tmp')
+        try:
+            with os.fdopen(fd, 'wb') as temp_file:
+                temp_file.write(audio)
+            os.replace(temp_path, self._path(key))
+        except OSError as e:
+            print(f"TTS cache write failed: {e}")
+            try:
+                os.unlink(temp_path)
+            except OSError:
+                pass
+            return
+        with self._lock:
+            self._disk_size += len(audio) - self._disk.pop(key, 0)
+            self._disk[key] = len(audio)
+            self._evict_disk()
+
+    def writer(self, key):
+        """A ``TTSCacheWriter`` that stores ``key`` from chunks as they arrive"""
+        return TTSCacheWriter(self, key)
+
+    def _commit_file(self, key, temp_path, size):
+        """Rename a fully written temp file into place and index it"""
+        os.replace(temp_path, self._path(key))
+        with self._lock:
+            self._disk_size += size - self._disk.pop(key, 0)
+            self._disk[key] = size
+            self._stats["stores"] += 1
+            self._evict_disk()
+
+    def _remember(self, key, audio):
+        """Add to the memory tier (caller holds the lock)"""
+        if len(audio) > self.memory_bytes:
+            return
+        previous = self._memory.pop(key, None)
+        if previous is not None:
+            self._memory_size -= len(previous)
+        self._memory[key] = audio
+        self._memory_size += len(audio)
+        while self._memory_size > self.memory_bytes:
+            _, evicted = self._memory.popitem(last=False)
+            self._memory_size -= len(evicted)
+            self._stats["memory_evictions"] += 1
+
+    def _evict_disk(self):
+        while self._disk_size > self.disk_bytes and self._disk:
+            key, size = self._disk.popitem(last=False)
+            self._disk_size -= size
+            self._stats["disk_evictions"] += 1
+            try:
+                os.unlink(self._path(key))
+            except OSError:
+                pass
+
+    def get_stats(self):
+        with self._lock:
+            stats = dict(self._stats)
+            stats["memory_entries"] = len(self._memory)
+            stats["memory_bytes"] = self._memory_size
+            stats["disk_entries"] = len(self._disk)
+            stats["disk_bytes"] = self._disk_size
+        stats["enabled"] = self.enabled
+        lookups = stats["memory_hits"] + stats["disk_hits"] + stats["misses"]
+        stats["hit_ratio"] = round((stats["memory_hits"] + stats["disk_hits"]) / lookups, 4) if lookups else 0.0
+        return stats
+
+
+class TTSCacheWriter:
+    """Streams one clip into a ``TTSCache`` without holding it in memory.
+
+    Chunks go straight to a temp file in the cache directory, which
+    ``commit`` renames into place; ``abort`` (or a clip that outgrows the
+    disk tier) deletes it. With no disk tier the chunks are buffered only
+    while they fit in the memory tier. The memory tier is not filled from
+    disk here; the first ``get`` promotes the clip.
+    """
+
+    def __init__(self, cache, key):
+        self.cache = cache
+        self.key = key
+        self.size = 0
+        self._file = None
+        self._temp_path = None
+        self._buffer = None
+        if not cache.enabled:
+            return
+        if cache.disk_bytes > 0:
+            fd, self._temp_path = tempfile.mkstemp(dir=cache.directory, suffix='.tmp')
+            self._file = os.fdopen(fd, 'wb')
+        else:
+            self._buffer = bytearray()
+
+    def write(self, data):
+        self.size += len(data)
+        if self._file is not None:
+            if self.size > self.cache.disk_bytes:
+                self.abort()
+                return
+            try:
+                self._file.write(data)
+            except OSError as e:
+                print(f"TTS cache write failed: {e}")
+                self.abort()
+        elif self._buffer is not None:
+            if self.size > self.cache.memory_bytes:
+                self._buffer = None
+            else:
+                self._buffer += data
+
+    def commit(self):
+        """Publish the clip if every chunk was stored"""
+        if self._file is not None:
+            temp_path, self._temp_path = self._temp_path, None
+            try:
+                self._file.close()
+                if self.size:
+                    self.cache._commit_file(self.key, temp_path, self.size)
+                    return
+            except OSError as e:
+                print(f"TTS cache write failed: {e}")
+            finally:
+                self._file = None
+            try:
+                os.unlink(temp_path)
+            except OSError:
+                pass
+        elif self._buffer:
+            with self.cache._lock:
+                self.cache._remember(self.key, bytes(self._buffer))
+                self.cache._stats["stores"] += 1
+            self._buffer = None
+
+    def abort(self):
+        """Drop whatever was written so far"""
+        self._buffer = None
+        if self._file is None:
+            return
+        self._file.close()
+        self._file = None
+        try:
+            os.unlink(self._temp_path)
+        except OSError:
+            pass
+        self._temp_path = None
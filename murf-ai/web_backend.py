@@ -1,25 +1,108 @@
-from flask import Flask, request, jsonify
+from flask import Flask, request, jsonify, Response, stream_with_context
 from flask_cors import CORS
 import asyncio
-import aiohttp
+import atexit
 import os
 import base64
+import json
 from datetime import datetime
 from dotenv import load_dotenv
-import tempfile
+import time
 from database import Database
+from sharding import ShardedDatabase
+from events import EventBus, NudgeWorker, pick_nudge, format_sse
+from async_runtime import AsyncRuntime
+from http_clients import UpstreamClient, Base64FieldDecoder
+from tts_cache import TTSCache, tts_cache_key
+from speech_templates import TEMPLATES, match_template, split_sentences, stitch_wav
 
 load_dotenv()
 
 app = Flask(__name__)
 CORS(app)
 
+# Uploads under 1KB probably mean no audio was recorded
+MIN_AUDIO_BYTES = 1000
+UPLOAD_CHUNK_SIZE = 64 * 1024
+
+# Murf voice settings for every synthesized reply
+MURF_VOICE = {"voiceId": "en-US-ken", "format": "WAV", "rate": 10, "sampleRate": 24000}
+
 class WebBackend:
     def __init__(self):
         self.deepgram_key = os.getenv('DEEPGRAM_API_KEY')
         self.murf_key = os.getenv('MURF_API_KEY')
         self.groq_key = os.getenv('GROQ_API_KEY')
-        self.db = Database()
+        db_options = dict(
+            query_cache=os.getenv('DB_QUERY_CACHE', 'true').lower() in ('1', 'true', 'yes'),
+            cache_size=int(os.getenv('DB_CACHE_SIZE', '1024')),
+            cache_ttl=float(os.getenv('DB_CACHE_TTL', '30')),
+            friend_cache_size=int(os.getenv('DB_FRIEND_CACHE_SIZE', '4096')),
+            friend_cache_ttl=float(os.getenv('DB_FRIEND_CACHE_TTL', '60'))
+        )
+        archive_path = os.getenv('CHAT_ARCHIVE_DB') or None
+        shard_count = int(os.getenv('DB_SHARDS', '0'))
+        if shard_count:
+            # Per-user tables spread over DB_SHARDS files (see sharding.py)
+            self.db = ShardedDatabase(os.getenv('DB_SHARD_DIR', 'shards'), shard_count,
+                                      archive=bool(archive_path), **db_options)
+        else:
+            self.db = Database(archive_path=archive_path, **db_options)
+        
+        # Move idle chat sessions to the archive file and vacuum on a schedule
+        if archive_path:
+            self.db.enable_retention(
+                archive_after_days=float(os.getenv('CHAT_ARCHIVE_AFTER_DAYS', '90')),
+                interval=float(os.getenv('DB_MAINTENANCE_INTERVAL_S', '3600'))
+            )
+        
+        # Optional group-commit queue for chat and friend message inserts
+        if os.getenv('DB_WRITE_BEHIND', '').lower() in ('1', 'true', 'yes'):
+            self.db.enable_write_behind(
+                flush_interval=float(os.getenv('DB_FLUSH_INTERVAL_MS', '50')) / 1000,
+                batch_size=int(os.getenv('DB_BATCH_SIZE', '100')),
+                max_queue=int(os.getenv('DB_WRITE_QUEUE_SIZE', '1000'))
+            )
+        
+        # One event loop for all upstream STT/LLM/TTS calls
+        self.runtime = AsyncRuntime()
+        
+        # Keep-alive connection pool per upstream API, used on that loop
+        http_options = dict(
+            limit_per_host=int(os.getenv('HTTP_POOL_PER_HOST', '20')),
+            connect_timeout=float(os.getenv('HTTP_CONNECT_TIMEOUT_S', '5')),
+            read_timeout=float(os.getenv('HTTP_READ_TIMEOUT_S', '30')),
+            dns_ttl=int(os.getenv('HTTP_DNS_TTL_S', '300')),
+            keepalive=float(os.getenv('HTTP_KEEPALIVE_S', '60'))
+        )
+        self.http = {name: UpstreamClient(name, **http_options) for name in ('groq', 'murf', 'deepgram')}
+        # Synthesized audio keyed by text and voice settings, so repeated
+        # replies skip Murf entirely
+        self.tts_cache = TTSCache(
+            os.getenv('TTS_CACHE_DIR', 'tts_cache'),
+            memory_bytes=int(float(os.getenv('TTS_CACHE_MEMORY_MB', '32')) * 1024 * 1024),
+            disk_bytes=int(float(os.getenv('TTS_CACHE_DISK_MB', '512')) * 1024 * 1024),
+            enabled=os.getenv('TTS_CACHE', 'true').lower() in ('1', 'true', 'yes')
+        )
+        # Build templated confirmations from pre-rendered fixed segments,
+        # synthesizing only the variable part per request. The segments live
+        # in the TTS cache, so without it stitching would only add Murf calls
+        self.tts_stitching = (os.getenv('TTS_STITCHING', 'true').lower() in ('1', 'true', 'yes')
+                              and self.tts_cache.enabled)
+        self.rendering_segments = set()  # fixed segments being synthesized in the background
+        self.tts_crossfade_ms = float(os.getenv('TTS_CROSSFADE_MS', '10'))
+        # Concurrent Murf requests when speaking sentence by sentence or pre-rendering
+        self.tts_parallelism = int(os.getenv('TTS_PARALLELISM', '3'))
+        atexit.register(self.close_http_clients)
+        if self.tts_stitching and self.murf_key:
+            self.runtime.submit(self.prerender_speech_templates())
+        
+        # Server-sent events for messages, friend requests and nudges
+        self.events = self.db.enable_events(EventBus(
+            history=int(os.getenv('SSE_HISTORY', '50')),
+            history_ttl=float(os.getenv('SSE_HISTORY_TTL_S', '300'))
+        ))
+        self.nudges = NudgeWorker(self.events, self.db, interval=float(os.getenv('NUDGE_INTERVAL_S', '600')))
         
         # Check if API keys are loaded
         if not self.deepgram_key:
@@ -28,11 +111,17 @@ class WebBackend:
             print("WARNING: GROQ_API_KEY not found in environment")
         
         # Keep some in-memory storage for compatibility
-        self.habit_logs = {}  # habitId -> [dates]
         self.goal_notes = {}  # goalId -> notes
         self.current_session_id = None
         self.current_user_id = "demo123"  # Default user
     
+    def close_http_clients(self):
+        """Close the pooled upstream sessions on the loop they belong to"""
+        async def close_all():
+            for client in self.http.values():
+                await client.close()
+        self.runtime.run(close_all())
+    
     def analyze_user_personality(self, user_id):
         """Analyze chat history to understand user's communication style"""
         recent_messages = self.db.get_recent_chat_history(user_id, 20)
@@ -54,18 +143,158 @@ class WebBackend:
         else:
             return "balanced and supportive"
     
+    def load_chat_context(self, user_id):
+        """Communication style and recent history for the chat prompt.
 
+        Tasks and goals are read only once a turn turns out to need the LLM.
+        """
+        return {
+            "personality_style": self.analyze_user_personality(user_id),
+            "recent_history": self.db.get_recent_chat_history(user_id, 5)
+        }
     
-    async def get_ai_response(self, text, user_id="demo123"):
+    def save_chat_turn(self, user_id, text, response):
+        """Store one exchange in the current chat session"""
+        # Create session ID if none exists
+        if not self.current_session_id:
+            self.current_session_id = f"session_{int(datetime.now().timestamp())}"
+        self.db.add_chat_message(user_id, self.current_session_id, text, response)
+    
+    async def get_ai_response(self, text, user_id="demo123", context=None):
+        # Command handling and prompt building query the database, so they
+        # run in a worker thread instead of blocking the shared event loop
+        reply, payload = await asyncio.to_thread(self.prepare_ai_response, text, user_id, context)
+        if reply is not None:
+            return reply
+        try:
+            url = "https://api.groq.com/openai/v1/chat/completions"
+            headers = {
+                "Authorization": f"Bearer {self.groq_key}",
+                "Content-Type": "application/json"
+            }
+            async with self.http['groq'].post(url, headers=headers, json=payload) as resp:
+                if resp.status == 200:
+                    result = await resp.json()
+                    return result['choices'][0]['message']['content'].strip()
+                return "I'm here to help you stay accountable! How can I assist you today?"
+        except Exception as e:
+            return "I'm having trouble connecting right now, but I'm still here to support you!"
+    
+    async def stream_ai_response(self, text, user_id="demo123", context=None):
+        """Like get_ai_response, but yields the reply as it is generated.
+
+        Command replies come back as one piece; chat replies are streamed
+        from Groq token by token.
+        """
+        reply, payload = await asyncio.to_thread(self.prepare_ai_response, text, user_id, context)
+        if reply is not None:
+            yield reply
+            return
+        started = False
+        try:
+            url = "https://api.groq.com/openai/v1/chat/completions"
+            headers = {
+                "Authorization": f"Bearer {self.groq_key}",
+                "Content-Type": "application/json"
+            }
+            async with self.http['groq'].post(url, headers=headers, json=dict(payload, stream=True)) as resp:
+                if resp.status != 200:
+                    yield "I'm here to help you stay accountable! How can I assist you today?"
+                    return
+                # OpenAI-style SSE: "data: {chunk}" lines, ending with "data: [DONE]"
+                async for line in resp.content:
+                    line = line.strip()
+                    if not line.startswith(b'data:'):
+                        continue
+                    data = line[len(b'data:'):].strip()
+                    if data == b'[DONE]':
+                        break
+                    token = json.loads(data)['choices'][0]['delta'].get('content')
+                    if not started and token:
+                        token = token.lstrip()
+                    if token:
+                        started = True
+                        yield token
+        except Exception as e:
+            print(f"Streaming chat error: {e}")
+            if not started:
+                yield "I'm having trouble connecting right now, but I'm still here to support you!"
+    
+    async def speak_ai_response(self, text, user_id="demo123"):
+        """Stream the reply and synthesize it one sentence at a time.
+
+        Yields ``("token", text)`` as the reply is generated and, in sentence
+        order, ``("audio", {"index", "text", "audio"})`` as each sentence's
+        speech is ready. Up to ``tts_parallelism`` sentences are synthesized
+        at once, starting as soon as each sentence is complete.
+        """
+        events = asyncio.Queue()
+        sentences = asyncio.Queue()  # (sentence, synthesis task) in order, None at the end
+        synthesis = []
+        limit = asyncio.Semaphore(self.tts_parallelism)
+        
+        async def synthesize(sentence):
+            async with limit:
+                return await self.text_to_speech(sentence)
+        
+        async def queue_sentence(sentence):
+            task = asyncio.create_task(synthesize(sentence))
+            synthesis.append(task)
+            await sentences.put((sentence, task))
+        
+        async def generate():
+            buffer = ''
+            try:
+                async for token in self.stream_ai_response(text, user_id):
+                    await events.put(("token", token))
+                    complete, buffer = split_sentences(buffer + token)
+                    for sentence in complete:
+                        await queue_sentence(sentence)
+                if buffer.strip():
+                    await queue_sentence(buffer.strip())
+            finally:
+                await sentences.put(None)
+        
+        async def deliver():
+            index = 0
+            try:
+                while True:
+                    item = await sentences.get()
+                    if item is None:
+                        break
+                    sentence, task = item
+                    await events.put(("audio", {"index": index, "text": sentence, "audio": await task}))
+                    index += 1
+            finally:
+                await events.put(None)
+        
+        producer = asyncio.create_task(generate())
+        consumer = asyncio.create_task(deliver())
+        try:
+            while True:
+                event = await events.get()
+                if event is None:
+                    break
+                yield event
+            await producer
+            await consumer
+        finally:
+            for task in [producer, consumer] + synthesis:
+                task.cancel()
+    
+    def prepare_ai_response(self, text, user_id="demo123", context=None):
+        """Handle a voice command, or build the LLM request for a chat reply.
+
+        ``context`` is a preloaded ``load_chat_context`` result. Returns
+        ``(reply, None)`` when a command was handled, else ``(None, payload)``
+        for the chat completions call. Prompt context is only loaded once no
+        command matched.
+        """
         try:
             # Check for task creation commands with natural language
             text_lower = text.lower()
             print(f"Processing text: {text_lower}")
             
-            # Get user's communication style and recent context
-            personality_style = self.analyze_user_personality(user_id)
-            recent_history = self.db.get_recent_chat_history(user_id, 5)
-            
             # Check if user is asking for general help or greeting
             greeting_words = ['hello', 'hi', 'hey', 'how are you', 'what\'s up', 'good morning', 'good afternoon']
             is_greeting = any(word in text_lower for word in greeting_words)
@@ -106,9 +335,9 @@ class WebBackend:
                         
                         if target_goal and subgoal_content:
                             subgoal_id = self.db.add_subgoal(target_goal['id'], subgoal_content)
-                            return f"Great! Added '{subgoal_content}' to your '{target_goal['title']}' goal!"
+                            return f"Great! Added '{subgoal_content}' to your '{target_goal['title']}' goal!", None
                         else:
-                            return "Try saying 'Add subgoal [name] to [goal]'."
+                            return "Try saying 'Add subgoal [name] to [goal]'.", None
                 else:
                     # Handle "add subgoal X" without "to goal" - use most recent goal
                     subgoal_content = text_lower.replace('add subgoal ', '').replace('add sub goal ', '').strip()
@@ -116,9 +345,9 @@ class WebBackend:
                     if user_goals and subgoal_content:
                         target_goal = user_goals[0]
                         subgoal_id = self.db.add_subgoal(target_goal['id'], subgoal_content)
-                        return f"Great! Added '{subgoal_content}' to your '{target_goal['title']}' goal!"
+                        return f"Great! Added '{subgoal_content}' to your '{target_goal['title']}' goal!", None
                     else:
-                        return "Try saying 'Add subgoal [name] to [goal]'."
+                        return "Try saying 'Add subgoal [name] to [goal]'.", None
             
             # Check for goal creation BEFORE task detection
             elif any(keyword in text_lower for keyword in ['to my goals', 'to my monthly goals', 'monthly goal', 'add goal', 'set goal', 'new goal', 'goal to', 'my goal is']):
@@ -131,7 +360,7 @@ class WebBackend:
                 
                 if goal_title:
                     goal_id = self.db.add_goal(user_id, goal_title)
-                    return f"Awesome! I've set '{goal_title}' as your goal. Let's work towards it together!"
+                    return f"Awesome! I've set '{goal_title}' as your goal. Let's work towards it together!", None
             
             # Strict task detection patterns - only explicit task creation (excluding goal patterns)
             task_patterns = [
@@ -205,7 +434,7 @@ class WebBackend:
                 if task_title:
                     # Add task to database
                     task_id = self.db.add_task(user_id, task_title)
-                    return f"Great! I've added '{task_title}' to your tasks. You've got this!"
+                    return f"Great! I've added '{task_title}' to your tasks. You've got this!", None
             
 
             
@@ -258,42 +487,37 @@ class WebBackend:
                     for task in user_tasks:
                         if task['status'] == 'pending' and item_name.lower() in task['title'].lower():
                             self.db.complete_task(task['id'])
-                            return f"Great job! Marked '{task['title']}' as complete!"
+                            return f"Great job! Marked '{task['title']}' as complete!", None
                     
                     # Try to find matching habit
                     user_habits = self.db.get_habits(user_id)
                     for habit in user_habits:
                         if item_name.lower() in habit['name'].lower():
                             from datetime import datetime
-                            today = datetime.now().strftime('%Y-%m-%d')
-                            if habit['id'] not in backend.habit_logs:
-                                backend.habit_logs[habit['id']] = []
-                            if today not in backend.habit_logs[habit['id']]:
-                                backend.habit_logs[habit['id']].append(today)
+                            if self.db.log_habit(habit['id']):
                                 day_name = datetime.now().strftime('%A')
-                                return f"Perfect! Marked '{habit['name']}' as done for {day_name}!"
+                                return f"Perfect! Marked '{habit['name']}' as done for {day_name}!", None
                             else:
                                 day_name = datetime.now().strftime('%A')
-                                return f"You've already completed '{habit['name']}' today ({day_name})!"
+                                return f"You've already completed '{habit['name']}' today ({day_name})!", None
                     
                     # Try to find matching goal
-                    user_goals = self.db.get_goals(user_id)
+                    user_goals = self.db.get_goals_with_subgoals(user_id)
                     for goal in user_goals:
                         if goal['progress'] < 100 and item_name.lower() in goal['title'].lower():
                             self.db.complete_goal(goal['id'])
-                            return f"Awesome! Marked '{goal['title']}' as accomplished!"
+                            return f"Awesome! Marked '{goal['title']}' as accomplished!", None
                     
                     # Try to find matching subgoal
                     for goal in user_goals:
-                        subgoals = self.db.get_subgoals(goal['id'])
-                        for subgoal in subgoals:
+                        for subgoal in goal['subGoals']:
                             if not subgoal['completed'] and item_name.lower() in subgoal['title'].lower():
                                 self.db.toggle_subgoal(goal['id'], subgoal['id'])
-                                return f"Excellent! Marked '{subgoal['title']}' as complete!"
+                                return f"Excellent! Marked '{subgoal['title']}' as complete!", None
                     
-                    return f"Couldn't find '{item_name}' in your tasks, habits, goals, or subgoals."
+                    return f"Couldn't find '{item_name}' in your tasks, habits, goals, or subgoals.", None
                 else:
-                    return "Please specify what you want to mark as done."
+                    return "Please specify what you want to mark as done.", None
             
             # Check for friend queries FIRST
             elif any(phrase in text_lower for phrase in ['tell me', 'show me', 'what are']) and any(word in text_lower for word in ['tasks', 'goals']) and 'of' in text_lower:
@@ -335,7 +559,7 @@ class WebBackend:
                             else:
                                 response_parts.append("no active goals")
                             
-                            return f"{target_friend['name']} has {' and '.join(response_parts)}."
+                            return f"{target_friend['name']} has {' and '.join(response_parts)}.", None
                         
                         elif 'task' in text_lower:
                             # Get friend's pending tasks
@@ -343,22 +567,22 @@ class WebBackend:
                             pending_tasks = [task for task in friend_tasks if task['status'] == 'pending']
                             if pending_tasks:
                                 task_list = ', '.join([task['title'] for task in pending_tasks[:5]])
-                                return f"{target_friend['name']} has {len(pending_tasks)} pending tasks: {task_list}{'...' if len(pending_tasks) > 5 else ''}"
+                                return f"{target_friend['name']} has {len(pending_tasks)} pending tasks: {task_list}{'...' if len(pending_tasks) > 5 else ''}", None
                             else:
-                                return f"{target_friend['name']} has no pending tasks right now."
+                                return f"{target_friend['name']} has no pending tasks right now.", None
                         elif 'goal' in text_lower:
                             # Get friend's incomplete goals
                             friend_goals = self.db.get_goals(target_friend['id'])
                             incomplete_goals = [goal for goal in friend_goals if goal['progress'] < 100]
                             if incomplete_goals:
                                 goal_list = ', '.join([f"{goal['title']} ({goal['progress']}%)" for goal in incomplete_goals[:3]])
-                                return f"{target_friend['name']} has {len(incomplete_goals)} active goals: {goal_list}{'...' if len(incomplete_goals) > 3 else ''}"
+                                return f"{target_friend['name']} has {len(incomplete_goals)} active goals: {goal_list}{'...' if len(incomplete_goals) > 3 else ''}", None
                             else:
-                                return f"{target_friend['name']} has no active goals right now."
+                                return f"{target_friend['name']} has no active goals right now.", None
                     else:
-                        return f"I couldn't find a friend named '{friend_name}' in your friends list."
+                        return f"I couldn't find a friend named '{friend_name}' in your friends list.", None
                 else:
-                    return "Please specify which friend you want to know about."
+                    return "Please specify which friend you want to know about.", None
             
             # Check for message sending commands
             elif any(phrase in text_lower for phrase in ['send', 'message', 'remind']) and 'to' in text_lower:
@@ -378,9 +602,9 @@ class WebBackend:
                             target_friend = self.db.get_friend_by_name(user_id, friend_name)
                             if target_friend:
                                 message_id = self.db.send_message(user_id, target_friend['id'], message_part)
-                                return f"Message sent to {target_friend['name']}: '{message_part}'"
+                                return f"Message sent to {target_friend['name']}: '{message_part}'", None
                             else:
-                                return f"I couldn't find a friend named '{friend_name}' in your friends list."
+                                return f"I couldn't find a friend named '{friend_name}' in your friends list.", None
                 
                 # Pattern: "remind [friend] to [task]"
                 elif 'remind' in text_lower and ' to ' in text_lower:
@@ -397,9 +621,9 @@ class WebBackend:
                             if target_friend:
                                 reminder_message = f"Reminder: {task_part}"
                                 message_id = self.db.send_message(user_id, target_friend['id'], reminder_message)
-                                return f"Reminder sent to {target_friend['name']}: '{task_part}'"
+                                return f"Reminder sent to {target_friend['name']}: '{task_part}'", None
                             else:
-                                return f"I couldn't find a friend named '{friend_name}' in your friends list."
+                                return f"I couldn't find a friend named '{friend_name}' in your friends list.", None
             
             # Check for habit creation with more patterns
             elif any(keyword in text_lower for keyword in ['add habit', 'new habit', 'track habit', 'start habit', 'build habit', 'habit of', 'to my habits', 'add playing', 'add exercising', 'add reading']):
@@ -417,14 +641,15 @@ class WebBackend:
                 if habit_name:
                     habit_id = self.db.add_habit(user_id, habit_name)
                     print(f"Added habit: {habit_name}")
-                    return f"Perfect! I've added '{habit_name}' to your habits. Consistency is key!"
+                    return f"Perfect! I've added '{habit_name}' to your habits. Consistency is key!", None
             
             # Regular AI response
-            url = "https://api.groq.com/openai/v1/chat/completions"
-            headers = {
-                "Authorization": f"Bearer {self.groq_key}",
-                "Content-Type": "application/json"
-            }
+            # Get user's communication style and recent context
+            if context is None:
+                context = self.load_chat_context(user_id)
+            personality_style = context["personality_style"]
+            recent_history = context["recent_history"]
+            
             # Create personalized system prompt with context
             system_prompt = f"You are a close friend and accountability partner. Your communication style should be {personality_style}. "
             
@@ -476,50 +701,171 @@ class WebBackend:
                 "max_tokens": 150,
                 "temperature": 0.7
             }
-            
-            async with aiohttp.ClientSession() as session:
-                async with session.post(url, headers=headers, json=payload) as resp:
-                    if resp.status == 200:
-                        result = await resp.json()
-                        return result['choices'][0]['message']['content'].strip()
-                    return "I'm here to help you stay accountable! How can I assist you today?"
+            return None, payload
         except Exception as e:
-            return "I'm having trouble connecting right now, but I'm still here to support you!"
+            return "I'm having trouble connecting right now, but I'm still here to support you!", None
     
     async def text_to_speech(self, text):
+        """Base64 WAV for ``text`` (for JSON responses)"""
+        audio = await self.speech_audio(text)
+        return base64.b64encode(audio).decode('ascii') if audio else None
+    
+    async def speech_audio(self, text):
+        """WAV bytes for ``text``, stitched from cached pieces for templated replies.
+
+        A templated reply whose fixed segments aren't cached yet is
+        synthesized whole, and the missing segments are rendered in the
+        background for next time.
+        """
         try:
-            url = "https://api.murf.ai/v1/speech/generate"
-            headers = {
-                "api-key": self.murf_key,
-                "Content-Type": "application/json"
-            }
-            payload = {
-                "voiceId": "en-US-ken",
-                "text": text,
-                "format": "WAV",
-                "encodeAsBase64": True,
-                "rate": 10,
-                "sampleRate": 24000
-            }
-            
-            async with aiohttp.ClientSession() as session:
-                async with session.post(url, headers=headers, json=payload) as resp:
-                    if resp.status == 200:
-                        result = await resp.json()
-                        if 'encodedAudio' in result:
-                            return result['encodedAudio']
+            template = match_template(text) if self.tts_stitching else None
+            audio = None
+            if template:
+                missing = self.missing_template_segments(template[0])
+                if missing:
+                    self.runtime.submit(self.render_segments(missing))
+                else:
+                    audio = await self.stitched_speech(*template)
+            if audio is None:
+                audio = await self.synthesize_speech(text)
+            return audio
+        except Exception as e:
+            print(f"Text to speech error: {e}")
+            return None
+    
+    def speech_cache_key(self, text):
+        return tts_cache_key(text, MURF_VOICE["voiceId"], MURF_VOICE["rate"], MURF_VOICE["sampleRate"], MURF_VOICE["format"])
+    
+    def speech_ready(self, text):
+        """True when ``text`` can be answered without waiting on a full Murf call"""
+        template = match_template(text) if self.tts_stitching else None
+        if template and not self.missing_template_segments(template[0]):
+            return True
+        return self.tts_cache.contains(self.speech_cache_key(text))
+    
+    def missing_template_segments(self, template):
+        """Fixed segments of ``template`` that aren't in the TTS cache"""
+        return [segment for segment in template.fixed_segments()
+                if not self.tts_cache.contains(self.speech_cache_key(segment))]
+    
+    async def stitched_speech(self, template, values):
+        """WAV bytes for a filled-in template, or None to fall back to full synthesis"""
+        clips = await asyncio.gather(*(self.synthesize_speech(segment) for segment in template.segments(values)))
+        if not all(clips):
             return None
+        try:
+            return await asyncio.to_thread(stitch_wav, clips, self.tts_crossfade_ms)
         except Exception as e:
+            print(f"Audio stitching failed, synthesizing in full: {e}")
             return None
     
-    async def speech_to_text(self, audio_file_path):
-        audio_data = None
+    async def prerender_speech_templates(self):
+        """Synthesize every template's fixed segments into the TTS cache"""
+        segments = {segment for template in TEMPLATES for segment in template.fixed_segments()}
+        rendered = await self.render_segments(segments)
+        print(f"Pre-rendered {rendered}/{len(segments)} reply template segments")
+    
+    async def render_segments(self, segments):
+        """Synthesize fixed template segments into the TTS cache; returns how many are cached.
+
+        Segments already being rendered by another call are skipped.
+        """
+        limit = asyncio.Semaphore(self.tts_parallelism)
+        
+        async def render(segment):
+            if segment in self.rendering_segments:
+                return False
+            self.rendering_segments.add(segment)
+            try:
+                async with limit:
+                    return await self.synthesize_speech(segment) is not None
+            finally:
+                self.rendering_segments.discard(segment)
+        
+        rendered = await asyncio.gather(*(render(segment) for segment in segments))
+        return sum(rendered)
+    
+    async def synthesize_speech(self, text):
+        """WAV bytes for ``text`` from the TTS cache or Murf, or None"""
+        try:
+            audio = b''.join([chunk async for chunk in self.stream_speech(text)])
+            return audio or None
+        except Exception as e:
+            return None
+    
+    async def stream_speech(self, text):
+        """Yield WAV bytes for ``text`` as Murf's response arrives.
+
+        The base64 audio in Murf's JSON is decoded chunk by chunk rather
+        than after the whole body is buffered. Chunks are spooled into the
+        cache as they go out and the clip is published only once it has fully
+        arrived; a cache hit yields it in one piece.
+        """
+        cache_key = self.speech_cache_key(text)
+        cached = await asyncio.to_thread(self.tts_cache.get, cache_key)
+        if cached is not None:
+            yield cached
+            return
+        
+        url = "https://api.murf.ai/v1/speech/generate"
+        headers = {
+            "api-key": self.murf_key,
+            "Content-Type": "application/json"
+        }
+        payload = dict(MURF_VOICE, text=text, encodeAsBase64=True)
+        
+        decoder = Base64FieldDecoder('encodedAudio')
+        writer = await asyncio.to_thread(self.tts_cache.writer, cache_key)
+        try:
+            async with self.http['murf'].post(url, headers=headers, json=payload) as resp:
+                if resp.status != 200:
+                    print(f"Murf error ({resp.status}): {await resp.text()}")
+                    writer.abort()
+                    return
+                async for chunk in resp.content.iter_chunked(64 * 1024):
+                    data = decoder.feed(chunk)
+                    if data:
+                        await asyncio.to_thread(writer.write, data)
+                        yield data
+            if not decoder.done:
+                raise ValueError("Murf response ended before the audio did")
+        except BaseException:
+            writer.abort()
+            raise
+        await asyncio.to_thread(writer.commit)
+    
+    async def transcribe_upload(self, read):
+        """Transcribe audio pulled from a blocking ``read(size)`` (the request stream).
+
+        Chunks are sent to Deepgram as they are read, so the upload is never
+        written to disk or held whole in memory. Nothing is sent when the
+        audio is under MIN_AUDIO_BYTES. Returns ``(transcript, bytes_read)``.
+        """
+        head = b''
+        while len(head) < MIN_AUDIO_BYTES:
+            chunk = await asyncio.to_thread(read, UPLOAD_CHUNK_SIZE)
+            if not chunk:
+                return None, len(head)
+            head += chunk
+        size = len(head)
+        
+        async def body():
+            nonlocal size
+            yield head
+            while True:
+                chunk = await asyncio.to_thread(read, UPLOAD_CHUNK_SIZE)
+                if not chunk:
+                    break
+                size += len(chunk)
+                yield chunk
+        
+        transcript = await self.transcribe(body())
+        print(f"Audio upload size: {size} bytes")
+        return transcript, size
+    
+    async def transcribe(self, audio_data):
+        """Deepgram transcript of ``audio_data`` (bytes or an async iterable of chunks)"""
         try:
-            # Read audio file
-            with open(audio_file_path, 'rb') as audio_file:
-                audio_data = audio_file.read()
-                print(f"Audio file size: {len(audio_data)} bytes")
-            
             url = "https://api.deepgram.com/v1/listen"
             headers = {
                 "Authorization": f"Token {self.deepgram_key}"
@@ -531,31 +877,85 @@ class WebBackend:
                 "smart_format": "true"
             }
                 
-            async with aiohttp.ClientSession() as session:
-                async with session.post(url, headers=headers, params=params, data=audio_data) as resp:
-                    print(f"Deepgram response status: {resp.status}")
+            async with self.http['deepgram'].post(url, headers=headers, params=params, data=audio_data) as resp:
+                print(f"Deepgram response status: {resp.status}")
+                
+                if resp.status == 200:
+                    result = await resp.json()
                     
-                    if resp.status == 200:
-                        result = await resp.json()
-                        
-                        channels = result.get('results', {}).get('channels', [])
-                        if channels and len(channels) > 0:
-                            alternatives = channels[0].get('alternatives', [])
-                            if alternatives and len(alternatives) > 0:
-                                transcript = alternatives[0].get('transcript', '').strip()
-                                if transcript:
-                                    print(f"Successful transcription: {transcript}")
-                                    return transcript
-                    else:
-                        error_text = await resp.text()
-                        print(f"Deepgram error ({resp.status}): {error_text}")
-                    return None
+                    channels = result.get('results', {}).get('channels', [])
+                    if channels and len(channels) > 0:
+                        alternatives = channels[0].get('alternatives', [])
+                        if alternatives and len(alternatives) > 0:
+                            transcript = alternatives[0].get('transcript', '').strip()
+                            if transcript:
+                                print(f"Successful transcription: {transcript}")
+                                return transcript
+                else:
+                    error_text = await resp.text()
+                    print(f"Deepgram error ({resp.status}): {error_text}")
+                return None
         except Exception as e:
             print(f"Speech to text error: {e}")
             return None
+    
+    async def voice_turn(self, read, user_id="demo123"):
+        """Transcribe, answer and synthesize one voice message in a single pass.
+
+        ``read`` is the upload's blocking read. Returns the transcript, reply
+        text, base64 audio, upload size and per-stage timings in milliseconds.
+        """
+        started = time.perf_counter()
+        timings = {}
+        
+        def elapsed_ms(since):
+            return round((time.perf_counter() - since) * 1000, 1)
+        
+        def load_context():
+            loaded_at = time.perf_counter()
+            context = self.load_chat_context(user_id)
+            timings["context_ms"] = elapsed_ms(loaded_at)
+            return context
+        
+        # Load history and style while Deepgram transcribes
+        context_task = asyncio.create_task(asyncio.to_thread(load_context))
+        stage = time.perf_counter()
+        transcript, audio_bytes = await self.transcribe_upload(read)
+        timings["stt_ms"] = elapsed_ms(stage)
+        if not transcript:
+            await asyncio.gather(context_task, return_exceptions=True)
+            timings["total_ms"] = elapsed_ms(started)
+            return {"transcript": None, "response": None, "audio": None, "audio_bytes": audio_bytes, "timings": timings}
+        
+        stage = time.perf_counter()
+        context = await context_task
+        timings["context_wait_ms"] = elapsed_ms(stage)
+        
+        stage = time.perf_counter()
+        response = await self.get_ai_response(transcript, user_id, context)
+        timings["llm_ms"] = elapsed_ms(stage)
+        
+        # Persist the exchange while the reply is being synthesized
+        save_task = asyncio.create_task(asyncio.to_thread(self.save_chat_turn, user_id, transcript, response))
+        stage = time.perf_counter()
+        audio = await self.text_to_speech(response)
+        timings["tts_ms"] = elapsed_ms(stage)
+        await save_task
+        
+        timings["total_ms"] = elapsed_ms(started)
+        return {"transcript": transcript, "response": response, "audio": audio, "audio_bytes": audio_bytes, "timings": timings}
 
 backend = WebBackend()
 
+def get_page_args():
+    """Read optional ?limit=&cursor= keyset pagination params"""
+    limit = request.args.get('limit', type=int)
+    cursor = request.args.get('cursor') or None
+    return limit, cursor
+
+def is_paginated(limit, cursor):
+    return limit is not None or cursor is not None
+
 @app.route('/api/chat', methods=['POST'])
 def chat():
     try:
@@ -563,32 +963,115 @@ def chat():
         text = data.get('text', '')
         user_id = data.get('user_id', 'demo123')  # Get user_id from request
         
-        loop = asyncio.new_event_loop()
-        asyncio.set_event_loop(loop)
-        response = loop.run_until_complete(backend.get_ai_response(text, user_id))
-        loop.close()
-        
-        # Create session ID if none exists
-        if not backend.current_session_id:
-            backend.current_session_id = f"session_{int(datetime.now().timestamp())}"
+        response = backend.runtime.run(backend.get_ai_response(text, user_id))
         
         # Store chat message in database
-        backend.db.add_chat_message(user_id, backend.current_session_id, text, response)
+        backend.save_chat_turn(user_id, text, response)
         
         return jsonify({"response": response})
     except Exception as e:
         return jsonify({"error": str(e)}), 500
 
-@app.route('/api/tts', methods=['POST'])
+@app.route('/api/chat/stream', methods=['POST'])
+def chat_stream():
+    """Server-sent events: a "token" event per chunk of the reply, then "done" with the full text.
+
+    With ``"speak": true`` an "audio" event (base64 WAV) also follows each
+    sentence, in order, while the rest of the reply is still generating.
+    """
+    data = request.json or {}
+    text = data.get('text', '')
+    user_id = data.get('user_id', 'demo123')
+    if data.get('speak'):
+        events = backend.speak_ai_response(text, user_id)
+    else:
+        events = (("token", token) async for token in backend.stream_ai_response(text, user_id))
+    
+    def stream():
+        tokens = []
+        try:
+            for event_type, event_data in backend.runtime.iterate(events):
+                if event_type == "token":
+                    tokens.append(event_data)
+                    event_data = {"text": event_data}
+                yield format_sse({"event": event_type, "data": event_data})
+        except Exception as e:
+            yield format_sse({"event": "error", "data": {"error": str(e)}})
+        else:
+            yield format_sse({"event": "done", "data": {"response": ''.join(tokens).strip()}})
+        finally:
+            # Runs on client disconnect and upstream errors too, so whatever
+            # was generated is kept
+            response = ''.join(tokens).strip()
+            if response:
+                try:
+                    backend.save_chat_turn(user_id, text, response)
+                except Exception as e:
+                    print(f"Error saving chat turn: {e}")
+    
+    return Response(stream_with_context(stream()), mimetype='text/event-stream',
+                    headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"})
+
+@app.route('/api/voice-turn', methods=['POST'])
+def voice_turn():
+    """Audio in, transcript + reply text + reply audio out, in one round trip"""
+    try:
+        read = audio_upload_reader()
+        if read is None:
+            return jsonify({"error": "No audio file provided"}), 400
+        
+        user_id = request.args.get('user_id') or request.form.get('user_id', 'demo123')
+        result = backend.runtime.run(backend.voice_turn(read, user_id))
+        if result["audio_bytes"] < MIN_AUDIO_BYTES:
+            return jsonify({"error": "Audio file too small - please record longer"}), 400
+        if not result["transcript"]:
+            return jsonify({"error": "No speech detected - please speak more clearly", "timings": result["timings"]}), 400
+        return jsonify(result)
+    except Exception as e:
+        print(f"Voice turn error: {e}")
+        return jsonify({"error": str(e)}), 500
+
+def wants_binary_audio(data):
+    """Raw WAV instead of base64-in-JSON: GET, ``"binary": true`` or ``Accept: audio/wav``"""
+    if request.method == 'GET' or data.get('binary'):
+        return True
+    return request.accept_mimetypes.best_match(['application/json', 'audio/wav']) == 'audio/wav'
+
+def binary_speech_response(text):
+    """Raw WAV for ``text``, streamed as it is synthesized when it isn't cached.
+
+    Cached and stitched audio is sent whole with an ETag and byte-range
+    support; a range request for uncached audio waits for the full clip.
+    """
+    if request.range is None and not backend.speech_ready(text):
+        chunks = backend.runtime.iterate(backend.stream_speech(text))
+        first = next(chunks, None)
+        if first is None:
+            return jsonify({"error": "TTS failed"}), 500
+        
+        def stream():
+            yield first
+            yield from chunks
+        
+        return Response(stream_with_context(stream()), mimetype='audio/wav',
+                        headers={"Cache-Control": "no-cache"})
+    
+    audio = backend.runtime.run(backend.speech_audio(text))
+    if not audio:
+        return jsonify({"error": "TTS failed"}), 500
+    response = Response(audio, mimetype='audio/wav')
+    response.set_etag(backend.speech_cache_key(text))
+    return response.make_conditional(request, accept_ranges=True, complete_length=len(audio))
+
+@app.route('/api/tts', methods=['GET', 'POST'])
 def text_to_speech():
     try:
-        data = request.json
+        data = request.args if request.method == 'GET' else (request.json or {})
         text = data.get('text', '')
+        if wants_binary_audio(data):
+            return binary_speech_response(text)
         
-        loop = asyncio.new_event_loop()
-        asyncio.set_event_loop(loop)
-        audio_data = loop.run_until_complete(backend.text_to_speech(text))
-        loop.close()
+        audio_data = backend.runtime.run(backend.text_to_speech(text))
         
         if audio_data:
             return jsonify({"audio": audio_data})
@@ -596,38 +1079,31 @@ def text_to_speech():
     except Exception as e:
         return jsonify({"error": str(e)}), 500
 
+def audio_upload_reader():
+    """Blocking ``read(size)`` over the uploaded audio, or None if there is none.
+
+    A raw ``audio/*`` (or octet-stream) body is read straight off the
+    request stream; a multipart ``audio`` field is read from its part.
+    """
+    if request.mimetype.startswith('audio/') or request.mimetype == 'application/octet-stream':
+        return request.stream.read
+    if 'audio' in request.files:
+        audio_file = request.files['audio']
+        print(f"Received audio file: {audio_file.filename}")
+        return audio_file.stream.read
+    return None
+
 @app.route('/api/stt', methods=['POST'])
 def speech_to_text():
-    temp_file_path = None
     try:
-        if 'audio' not in request.files:
+        read = audio_upload_reader()
+        if read is None:
             return jsonify({"error": "No audio file provided"}), 400
         
-        audio_file = request.files['audio']
-        print(f"Received audio file: {audio_file.filename}, size: {audio_file.content_length}")
-        
-        # Save to temporary file
-        with tempfile.NamedTemporaryFile(delete=False, suffix='.webm') as temp_file:
-            temp_file_path = temp_file.name
-            audio_file.save(temp_file_path)
-            print(f"Saved to temp file: {temp_file_path}")
-        
-        # Check file size
-        file_size = os.path.getsize(temp_file_path)
-        print(f"Temp file size: {file_size} bytes")
-        
-        if file_size < 1000:  # Less than 1KB probably means no audio
-            try:
-                os.unlink(temp_file_path)
-            except:
-                pass
+        transcript, size = backend.runtime.run(backend.transcribe_upload(read))
+        if size < MIN_AUDIO_BYTES:
             return jsonify({"error": "Audio file too small - please record longer"}), 400
         
-        loop = asyncio.new_event_loop()
-        asyncio.set_event_loop(loop)
-        transcript = loop.run_until_complete(backend.speech_to_text(temp_file_path))
-        loop.close()
-        
         if transcript and transcript.strip():
             print(f"Transcript: {transcript}")
             return jsonify({"transcript": transcript})
@@ -636,13 +1112,6 @@ def speech_to_text():
     except Exception as e:
         print(f"STT endpoint error: {e}")
         return jsonify({"error": str(e)}), 500
-    finally:
-        # Clean up temp file in finally block
-        if temp_file_path:
-            try:
-                os.unlink(temp_file_path)
-            except Exception as cleanup_error:
-                print(f"Could not delete temp file: {cleanup_error}")
 
 @app.route('/api/tasks', methods=['GET', 'POST'])
 def tasks():
@@ -658,6 +1127,13 @@ def tasks():
         )
         return jsonify({"task_id": task_id})
     else:
+        limit, cursor = get_page_args()
+        if is_paginated(limit, cursor):
+            try:
+                user_tasks, next_cursor = backend.db.get_tasks(user_id, limit, cursor)
+            except ValueError as e:
+                return jsonify({"error": str(e)}), 400
+            return jsonify({"tasks": user_tasks, "next_cursor": next_cursor})
         user_tasks = backend.db.get_tasks(user_id)
         return jsonify({"tasks": user_tasks})
 
@@ -677,7 +1153,17 @@ def goals():
         goal_id = backend.db.add_goal(user_id, data.get('title'))
         return jsonify({"goal_id": goal_id})
     else:
-        user_goals = backend.db.get_goals(user_id)
+        # ?include=subgoals embeds each goal's subGoals, fetched in one query
+        include = request.args.get('include', '').split(',')
+        get_goals = backend.db.get_goals_with_subgoals if 'subgoals' in include else backend.db.get_goals
+        limit, cursor = get_page_args()
+        if is_paginated(limit, cursor):
+            try:
+                user_goals, next_cursor = get_goals(user_id, limit, cursor)
+            except ValueError as e:
+                return jsonify({"error": str(e)}), 400
+            return jsonify({"goals": user_goals, "next_cursor": next_cursor})
+        user_goals = get_goals(user_id)
         return jsonify({"goals": user_goals})
 
 @app.route('/api/goals/<int:goal_id>/progress', methods=['POST'])
@@ -686,16 +1172,9 @@ def update_goal_progress(goal_id):
         data = request.json
         progress = data.get('progress', 0)
         
-        conn = backend.db.db_path
-        import sqlite3
-        conn = sqlite3.connect(backend.db.db_path)
-        cursor = conn.cursor()
-        cursor.execute('UPDATE goals SET progress = ? WHERE id = ?', (progress, goal_id))
-        affected_rows = cursor.rowcount
-        conn.commit()
-        conn.close()
+        success = backend.db.update_goal_progress(goal_id, progress)
         
-        if affected_rows > 0:
+        if success:
             return jsonify({"message": "Goal progress updated successfully"})
         return jsonify({"error": "Goal not found"}), 404
     except Exception as e:
@@ -751,20 +1230,25 @@ def habits():
         return jsonify({"habit_id": habit_id})
     else:
         # Get habits from database
-        from datetime import date
-        today = date.today().isoformat()
-        
-        user_habits = backend.db.get_habits(user_id)
+        limit, cursor = get_page_args()
+        next_cursor = None
+        if is_paginated(limit, cursor):
+            try:
+                user_habits, next_cursor = backend.db.get_habits(user_id, limit, cursor)
+            except ValueError as e:
+                return jsonify({"error": str(e)}), 400
+        else:
+            user_habits = backend.db.get_habits(user_id)
+        habit_logs = backend.db.get_habit_logs(user_id)
         habits_with_status = []
         
         for habit in user_habits:
             habit_copy = habit.copy()
-            habit_logs = backend.habit_logs.get(habit['id'], [])
-            habit_copy['completed_today'] = today in habit_logs
-            habit_copy['recent_logs'] = habit_logs[-7:] if len(habit_logs) > 7 else habit_logs
-            habit_copy['last_completed'] = None  # Add for compatibility
+            habit_copy.update(habit_logs.get(habit['id'], {}))
             habits_with_status.append(habit_copy)
         
+        if is_paginated(limit, cursor):
+            return jsonify({"habits": habits_with_status, "next_cursor": next_cursor})
         return jsonify({"habits": habits_with_status})
 
 @app.route('/api/habits/<int:habit_id>', methods=['DELETE'])
@@ -780,20 +1264,14 @@ def delete_habit(habit_id):
 @app.route('/api/habits/<int:habit_id>/log', methods=['POST'])
 def log_habit(habit_id):
     try:
-        from datetime import datetime
-        today = datetime.now().strftime('%Y-%m-%d')
-        
-        # Initialize habit logs if not exists
-        if habit_id not in backend.habit_logs:
-            backend.habit_logs[habit_id] = []
+        logged = backend.db.log_habit(habit_id)
+        if logged is None:
+            return jsonify({"error": "Habit not found"}), 404
         
         # Check if already logged today
-        if today in backend.habit_logs[habit_id]:
+        if not logged:
             return jsonify({"error": "Already logged today"}), 400
         
-        # Add today's log
-        backend.habit_logs[habit_id].append(today)
-        
         return jsonify({"message": "Habit logged successfully"})
     except Exception as e:
         return jsonify({"error": str(e)}), 500
@@ -801,6 +1279,13 @@ def log_habit(habit_id):
 @app.route('/api/history', methods=['GET'])
 def get_chat_history():
     user_id = request.args.get('user_id', 'demo123')
+    limit, cursor = get_page_args()
+    if is_paginated(limit, cursor):
+        try:
+            sessions, next_cursor = backend.db.get_chat_sessions(user_id, limit, cursor)
+        except ValueError as e:
+            return jsonify({"error": str(e)}), 400
+        return jsonify({"sessions": sessions, "next_cursor": next_cursor})
     sessions = backend.db.get_chat_sessions(user_id)
     return jsonify({"sessions": sessions})
 
@@ -819,13 +1304,23 @@ def handle_session_history(session_id):
             return jsonify({"message": "Chat session deleted successfully"})
         return jsonify({"error": "Session not found"}), 404
     
-    messages = backend.db.get_session_messages(user_id, session_id)
+    limit, cursor = get_page_args()
+    next_cursor = None
+    if is_paginated(limit, cursor):
+        try:
+            messages, next_cursor = backend.db.get_session_messages(user_id, session_id, limit, cursor)
+        except ValueError as e:
+            return jsonify({"error": str(e)}), 400
+    else:
+        messages = backend.db.get_session_messages(user_id, session_id)
     if messages:
         session_data = {
             "messages": messages,
             "created_at": messages[0]['timestamp'] if messages else None,
             "title": messages[0]['user_message'][:50] + "..." if messages else "Empty Session"
         }
+        if is_paginated(limit, cursor):
+            return jsonify({"session": session_data, "next_cursor": next_cursor})
         return jsonify({"session": session_data})
     return jsonify({"error": "Session not found"}), 404
 
@@ -919,6 +1414,17 @@ def get_friends():
     except Exception as e:
         return jsonify({"error": str(e)}), 500
 
+@app.route('/api/friends/<friend_id>', methods=['DELETE'])
+def remove_friend(friend_id):
+    try:
+        user_id = request.args.get('user_id', 'demo123')
+        success = backend.db.remove_friend(user_id, friend_id)
+        if success:
+            return jsonify({"message": "Friend removed"})
+        return jsonify({"error": "Friend not found"}), 404
+    except Exception as e:
+        return jsonify({"error": str(e)}), 500
+
 @app.route('/api/tasks/shared', methods=['GET', 'POST'])
 def shared_tasks():
     if request.method == 'POST':
@@ -987,42 +1493,112 @@ def shared_goals():
 def get_messages():
     try:
         user_id = request.args.get('user_id', 'demo123')
+        limit, cursor = get_page_args()
+        
+        # ?since=<cursor> returns only messages newer than the cursor; a bare
+        # ?since= returns no messages, just a cursor for the current position
+        if 'since' in request.args:
+            try:
+                messages, since = backend.db.get_messages_since(user_id, request.args.get('since'), limit)
+            except ValueError as e:
+                return jsonify({"error": str(e)}), 400
+            return jsonify({
+                "messages": messages,
+                "since": since,
+                "unread": backend.db.get_unread_counts(user_id)
+            })
+        
+        if is_paginated(limit, cursor):
+            try:
+                messages, next_cursor = backend.db.get_messages(user_id, limit, cursor)
+            except ValueError as e:
+                return jsonify({"error": str(e)}), 400
+            return jsonify({"messages": messages, "next_cursor": next_cursor})
         messages = backend.db.get_messages(user_id)
-        return jsonify({"messages": messages})
+        return jsonify({"messages": messages, "unread": backend.db.get_unread_counts(user_id)})
+    except Exception as e:
+        return jsonify({"error": str(e)}), 500
+
+@app.route('/api/messages/read', methods=['POST'])
+def mark_messages_read():
+    """Mark a conversation read and reset its unread counter"""
+    try:
+        data = request.json
+        user_id = data.get('user_id', 'demo123')
+        contact_id = data.get('contact_id')
+        if not contact_id:
+            return jsonify({"error": "contact_id is required"}), 400
+        
+        marked = backend.db.mark_conversation_read(user_id, contact_id)
+        return jsonify({"marked": marked, "unread": backend.db.get_unread_counts(user_id)})
+    except Exception as e:
+        return jsonify({"error": str(e)}), 500
+
+@app.route('/api/search', methods=['GET'])
+def search():
+    """Full-text search over chat history, tasks, goals and habits"""
+    try:
+        user_id = request.args.get('user_id', 'demo123')
+        query = request.args.get('q', '')
+        types = request.args.get('types')
+        types = [t.strip() for t in types.split(',')] if types else None
+        limit = request.args.get('limit', 20, type=int)
+        
+        results = backend.db.search(user_id, query, types, limit)
+        return jsonify({"query": query, "results": results})
     except Exception as e:
         return jsonify({"error": str(e)}), 500
 
 @app.route('/api/proactive-check', methods=['GET'])
 def proactive_check():
     """Get proactive message from AI about pending tasks"""
+    user_id = request.args.get('user_id', 'demo123')
     try:
-        # Only return proactive messages if user has actual tasks
-        if not backend.tasks:
-            return jsonify({"message": None})
-        
-        pending_tasks = [task for task in backend.tasks if task['status'] == 'pending']
-        
-        # Don't be proactive if no pending tasks
-        if not pending_tasks:
-            return jsonify({"message": None})
-        
-        # Only be proactive occasionally (not every time)
-        import random
-        if random.random() > 0.3:  # 30% chance of proactive message
-            return jsonify({"message": None})
-        
-        # Generate simple, general check-in message
-        messages = [
-            "How are your tasks going today?",
-            "Need any help with your to-do list?",
-            "How's your productivity today?"
-        ]
-        
-        selected_message = random.choice(messages)
-        return jsonify({"message": selected_message})
+        return jsonify({"message": pick_nudge(backend.db.get_tasks(user_id))})
     except Exception as e:
         return jsonify({"error": str(e)}), 500
 
+@app.route('/api/events', methods=['GET'])
+def event_stream():
+    """Server-sent events: message, friend_request, friend_request_response and nudge"""
+    user_id = request.args.get('user_id', 'demo123')
+    last_event_id = request.headers.get('Last-Event-ID') or request.args.get('last_event_id')
+    try:
+        last_event_id = int(last_event_id) if last_event_id else None
+    except ValueError:
+        return jsonify({"error": "Invalid Last-Event-ID"}), 400
+    heartbeat = float(os.getenv('SSE_HEARTBEAT_S', '15'))
+
+    def stream():
+        subscription = backend.events.subscribe(user_id, last_event_id)
+        try:
+            while True:
+                event = subscription.get(timeout=heartbeat)
+                # Comment line keeps proxies from closing an idle stream
+                yield format_sse(event) if event else ": keep-alive\n\n"
+        finally:
+            subscription.close()
+
+    return Response(stream_with_context(stream()), mimetype='text/event-stream',
+                    headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"})
+
+@app.route('/api/stats/db', methods=['GET'])
+def db_stats():
+    """Connection pool statistics for monitoring"""
+    return jsonify({
+        "pool": backend.db.get_pool_stats(),
+        "events": dict(backend.events.get_stats(), nudges=backend.nudges.get_stats())
+    })
+
+@app.route('/api/stats/runtime', methods=['GET'])
+def runtime_stats():
+    """Shared event loop and upstream connection pool statistics for monitoring"""
+    return jsonify({
+        "runtime": backend.runtime.get_stats(),
+        "http": {name: client.get_stats() for name, client in backend.http.items()},
+        "tts_cache": backend.tts_cache.get_stats()
+    })
+
 if __name__ == '__main__':
     print("Starting Web Backend for Frontend Integration...")
     print("API available at: http://localhost:5000")